@@ -3,20 +3,58 @@
 
 from mtm_imports import *
 from mtm_config import config
-from mtm_cache_stabilized import *
 from mtm_server import *
 from mtm_html import DASHBOARD_HTML
 from mtm_background_stabilized import *
 from mtm_persistence_stabilized import load_state, save_state, start_auto_save, register_shutdown_handler
-from mtm_db_stabilized import get_opening_mtm as get_opening_mtm_db, set_opening_mtm as set_opening_mtm_db, is_opening_mtm_captured as is_opening_mtm_captured_db
-
-# Apply optimized configuration
-mtm_cache["cache_ttl"] = config.get("cache_ttl", 5.0)
+from mtm_persistence_stabilized import start_hub_worker, stop_hub_worker
+from mtm_workers import hub_worker
+from mtm_db_async import async_db
+from mtm_db_stabilized import get_mtm_history_range, get_mtm_history_since, get_last_history_marker
+from mtm_db_stabilized import get_history_partitions, refresh_history_partitions
+from mtm_history import read_history
+from mtm_http import CircuitOpenError
 
 # Import API endpoints after DASHBOARD_HTML is defined
 from mtm_api_part1 import *
 from mtm_api_part4 import *
 
+# Imported last: the modules above re-export the legacy mtm_cache names
+from mtm_cache_stabilized import *
+from mtm_cache_stabilized import _finite
+
+# With hub_workers > 1 each worker process elects its role as it starts
+if hub_worker.multi:
+    app.router.add_event_handler("startup", start_hub_worker)
+    app.router.add_event_handler("shutdown", stop_hub_worker)
+
+def _touch_viewed(user_ids):
+    """Poll the users a dashboard asked for at the fastest cadence; IDs not in users.json are ignored."""
+    index = user_registry.current().index
+    for user_id in user_ids:
+        if user_id in index:
+            poll_cadence.touch(user_id)
+
+# Batch MTM endpoint - every user (or a subset) in one response
+@app.get("/MTM/all")
+async def get_mtm_all(UserID: str = ""):
+    """Return cached stats for all users, or for a comma-separated subset, in one payload"""
+    user_ids = [user_id.strip() for user_id in UserID.split(",") if user_id.strip()]
+    # A requested subset is polled at the fastest cadence; the unfiltered
+    # overview does not mark every user as viewed
+    _touch_viewed(user_ids)
+    batch = get_mtm_batch(user_ids)
+    
+    # Users behind a client machine whose circuit is open show last known values
+    users = user_registry.current()
+    down = {user_id for user_id in batch["users"] if not upstream_client.is_available(users.get_ip(user_id) or "")}
+    if down:
+        batch = dict(batch, users={
+            user_id: dict(entry, stale=True) if user_id in down else entry
+            for user_id, entry in batch["users"].items()
+        })
+    return JSONResponse(content=batch)
+
 # Define the optimized MTM endpoint
 @app.get("/MTM")
 async def get_mtm(request: Request, UserID: str = ""):
@@ -24,7 +62,7 @@ async def get_mtm(request: Request, UserID: str = ""):
     logger.debug(f"MTM endpoint accessed with UserID: {UserID}")
     
     # Check if daily reset is needed (only once per request)
-    check_daily_reset()
+    await check_daily_reset_async()
     
     # Validate that a user ID was provided
     if not UserID:
@@ -34,16 +72,19 @@ async def get_mtm(request: Request, UserID: str = ""):
             content={"status": "error", "response": 0, "error": "UserID parameter is required"}
         )
     
+    # Several users requested at once (/MTM?UserID=a,b,c) - serve them as one batch
+    if "," in UserID:
+        user_ids = [user_id.strip() for user_id in UserID.split(",") if user_id.strip()]
+        _touch_viewed(user_ids)
+        return JSONResponse(content=get_mtm_batch(user_ids))
+    
+    # A dashboard is viewing this user: poll it at the fastest cadence
+    _touch_viewed([UserID])
+    
     try:
-        # Get user IP from users.json
-        users_data = get_user_data()
-        user_ip = None
-        
-        # Find the specific user in the users data
-        for user in users_data["users"]:
-            if user["userId"] == UserID:
-                user_ip = user.get("ip")
-                break
+        # Get user IP from the in-memory user registry (no file I/O, dict lookup)
+        users = user_registry.current()
+        user_ip = users.get_ip(UserID)
         
         if not user_ip:
             logger.error(f"No IP found for user {UserID}")
@@ -52,33 +93,18 @@ async def get_mtm(request: Request, UserID: str = ""):
                 content={"status": "error", "response": 0, "error": f"User {UserID} not found or no IP configured"}
             )
         
-        # Get current time to check against opening hour and start time
-        now = datetime.now()
-        current_time_str = now.strftime("%H:%M")
-        
-        # Extract time parts for comparison
-        current_hour, current_minute = now.hour, now.minute
-        current_time_val = current_hour * 100 + current_minute
-        
-        # Get the opening hour and start time from users.json
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
+        # Session phase is compiled once per users.json version; between
+        # boundaries this is a single timestamp compare
+        phase = trading_session.phase()
         
-        # Parse opening hour and start time
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
-        
-        logger.debug(f"Time check for {UserID}: Current={current_time_str} ({current_time_val}), Opening={opening_hour} ({opening_hour_val}), Start={start_time} ({start_time_val})")
+        logger.debug(f"Session phase for {UserID}: {phase}")
         
         # BEFORE opening hour - don't fetch at all, just return zeros
-        if current_time_val < opening_hour_val:
-            logger.debug(f"Before opening hour for {UserID} - {current_time_val} < {opening_hour_val} - not fetching, returning zeros")
+        if phase == PRE_OPEN:
+            logger.debug(f"Before opening hour for {UserID} - not fetching, returning zeros")
             
             # Get opening hour value (should be 0 before opening hour)
-            opening_hour_mtm = get_opening_mtm_db(UserID)
+            opening_hour_mtm = state_cache.get_opening_mtm(UserID)
             
             return JSONResponse(
                 content={
@@ -91,18 +117,20 @@ async def get_mtm(request: Request, UserID: str = ""):
                 }
             )
         
-        # AT opening hour, fetch MTM and store it
-        elif current_time_val == opening_hour_val and not is_opening_mtm_captured_db(UserID):
-            logger.info(f"Exactly at opening hour for {UserID} - {current_time_val} == {opening_hour_val} - fetching for opening hour")
+        # AT opening hour, fetch MTM and store it (reader workers wait for the poller's snapshot)
+        elif phase == OPENING and hub_worker.is_poller and not state_cache.is_opening_mtm_captured(UserID):
+            logger.info(f"Exactly at opening hour for {UserID} - fetching for opening hour")
             
             # Fetch from client machine
             full_url = f"http://{user_ip}/MTM"
             logger.info(f"Fetching opening hour MTM from {full_url} for user {UserID}")
-            response = requests.get(
-                full_url,
-                headers=headers,
+            # Concurrent requests at the opening minute share one fetch, so
+            # only the leader stores the opening value
+            response, coalesced = await upstream_client.get_shared(
+                user_ip,
+                "/MTM",
                 params={"UserID": UserID},
-                timeout=10  # Increased timeout
+                timeout=10
             )
             response.raise_for_status()
             
@@ -115,36 +143,40 @@ async def get_mtm(request: Request, UserID: str = ""):
             mtm_value = float(data["response"])
             
             # Store the opening hour MTM value in the database
-            set_opening_mtm_db(UserID, mtm_value)
-            logger.info(f"Stored opening hour MTM for {UserID} in DB: {mtm_value}")
+            if not coalesced:
+                state_cache.set_opening_mtm(UserID, mtm_value)
+                logger.info(f"Stored opening hour MTM for {UserID} in DB: {mtm_value}")
             
             # Get opening hour value for this user
-            opening_hour_mtm = get_opening_mtm_db(UserID)
+            opening_hour_mtm = state_cache.get_opening_mtm(UserID)
             
             # Calculate relative MTM (current value minus opening hour value)
             relative_mtm = mtm_value - opening_hour_mtm
             
             # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            if not coalesced:
+                update_user_stats(UserID, relative_mtm)
             
             # Return response with stats
+            stats = init_user_stats(UserID).snapshot()
             response_data = {
                 "status": "success",
                 "response": relative_mtm,  # Return relative MTM instead of absolute
-                "max_mtm": mtm_cache["stats"][UserID]["max_mtm"],
-                "min_mtm": mtm_cache["stats"][UserID]["min_mtm"],
+                "max_mtm": stats["max_mtm"],
+                "min_mtm": stats["min_mtm"],
                 "opening_mtm": opening_hour_mtm,
                 "cached": False
             }
             
             return JSONResponse(content=response_data)
         
-        # At opening hour but ALREADY hit - return opening hour MTM but zeros for current/max/min
-        elif current_time_val == opening_hour_val and is_opening_mtm_captured_db(UserID):
-            logger.debug(f"Still at opening hour for {UserID} but already hit - returning zeros with stored opening hour")
+        # At opening hour but ALREADY hit, or between opening hour and start time -
+        # return opening hour MTM but zeros for current/max/min
+        elif phase == OPENING or phase == WARMUP:
+            logger.debug(f"{phase} for {UserID} - returning zeros with stored opening hour")
             
             # Get opening hour value
-            opening_hour_mtm = get_opening_mtm_db(UserID)
+            opening_hour_mtm = state_cache.get_opening_mtm(UserID)
             
             return JSONResponse(
                 content={
@@ -157,31 +189,28 @@ async def get_mtm(request: Request, UserID: str = ""):
                 }
             )
         
-        # BETWEEN opening hour and start time
-        elif current_time_val > opening_hour_val and current_time_val < start_time_val:
-            logger.debug(f"Between opening and start for {UserID} - {opening_hour_val} < {current_time_val} < {start_time_val} - returning zeros with stored opening hour")
-            
-            # Get opening hour value
-            opening_hour_mtm = get_opening_mtm_db(UserID)
-            
+        # A reader worker never calls the client machines: it serves the
+        # values the poller shares, so extra workers add no upstream load
+        if not hub_worker.is_poller:
+            stats = get_cached_data(UserID)["stats"]
             return JSONResponse(
                 content={
                     "status": "success",
-                    "response": 0,  # Current MTM as 0 (no change from opening)
-                    "max_mtm": 0,   # Max MTM as 0
-                    "min_mtm": 0,   # Min MTM as 0
-                    "opening_mtm": opening_hour_mtm,
-                    "cached": False
+                    "response": _finite(stats["current_mtm"]) if stats else 0,
+                    "max_mtm": _finite(stats["max_mtm"]) if stats else 0,
+                    "min_mtm": _finite(stats["min_mtm"]) if stats else 0,
+                    "opening_mtm": state_cache.get_opening_mtm(UserID),
+                    "cached": True
                 }
             )
         
-        # After start time, use optimized cache logic
-        # Use cache if available and not expired
-        if is_cache_valid(UserID):
+        # LIVE (or CLOSED) - use cache if available and not expired; after
+        # close the last value is served as-is, without polling
+        if is_cache_valid(UserID) or (phase == CLOSED and get_cached_data(UserID)["stats"]):
             logger.debug(f"Using cached data for {UserID}")
             
             # Get opening hour value for this user
-            opening_hour_mtm = get_opening_mtm_db(UserID)
+            opening_hour_mtm = state_cache.get_opening_mtm(UserID)
             
             # Get cached stats
             cached_data = get_cached_data(UserID)
@@ -203,12 +232,13 @@ async def get_mtm(request: Request, UserID: str = ""):
         full_url = f"http://{user_ip}/MTM"
         logger.debug(f"Fetching regular MTM from {full_url} for user {UserID}")
         
-        # Forward the request to the client machine
-        response = requests.get(
-            full_url,
-            headers=headers,
+        # Forward the request to the client machine; concurrent misses for
+        # this user wait on the same in-flight request
+        response, coalesced = await upstream_client.get_shared(
+            user_ip,
+            "/MTM",
             params={"UserID": UserID},
-            timeout=10  # Increased timeout
+            timeout=10
         )
         
         response.raise_for_status()  # Raise exception for bad status codes
@@ -226,17 +256,16 @@ async def get_mtm(request: Request, UserID: str = ""):
             # Extract MTM value
             mtm_value = float(data["response"])
             
-            # Update cache with optimized functions
-            set_cached_data(user_id=UserID, data=response.text)
-            
             # Get opening hour value for this user
-            opening_hour_mtm = get_opening_mtm_db(UserID)
+            opening_hour_mtm = state_cache.get_opening_mtm(UserID)
             
             # Calculate relative MTM (current value minus opening hour value)
             relative_mtm = mtm_value - opening_hour_mtm
             
-            # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            # Update cache and stats (a coalesced request's leader already did)
+            if not coalesced:
+                set_cached_data(user_id=UserID, data=response.text)
+                update_user_stats(UserID, relative_mtm)
             
             # Get updated stats
             cached_data = get_cached_data(UserID)
@@ -258,9 +287,25 @@ async def get_mtm(request: Request, UserID: str = ""):
             # If not JSON, return the raw text
             return response.text
             
-    except requests.RequestException as e:
+    except (requests.RequestException, httpx.HTTPError) as e:
         error_msg = f"Failed to fetch MTM data: {str(e)}"
-        logger.error(error_msg, exc_info=True)
+        
+        # Serve the last known good values, flagged stale, while the client machine is down
+        stats = get_cached_data(UserID)["stats"] if trading_session.phase() in (LIVE, CLOSED) else None
+        if stats:
+            logger.warning(f"{error_msg} - serving last known values for {UserID}")
+            return JSONResponse(content={
+                "status": "success",
+                "response": _finite(stats["current_mtm"]),
+                "max_mtm": _finite(stats["max_mtm"]),
+                "min_mtm": _finite(stats["min_mtm"]),
+                "opening_mtm": state_cache.get_opening_mtm(UserID),
+                "cached": True,
+                "stale": True,
+                "error": error_msg
+            })
+        
+        logger.error(error_msg, exc_info=not isinstance(e, CircuitOpenError))
         return JSONResponse(
             status_code=500,
             content={"status": "error", "response": 0, "error": error_msg}
@@ -273,6 +318,114 @@ async def get_mtm(request: Request, UserID: str = ""):
             content={"status": "error", "response": 0, "error": error_msg}
         )
 
+# Per-user MTM candles
+@app.get("/bars")
+async def get_bars(UserID: str = "", tf: str = "1m", date: str = ""):
+    """Return a user's MTM OHLC bars (tf=1m or 5m) for today or the given YYYY-MM-DD date"""
+    if not UserID:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": "UserID parameter is required"}
+        )
+    if tf not in TIMEFRAMES:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": f"tf must be one of {', '.join(TIMEFRAMES)}"}
+        )
+    
+    try:
+        bars = await async_db.run(get_mtm_bars, UserID, tf, date or None)
+    except ValueError:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": "date must be YYYY-MM-DD"}
+        )
+    return JSONResponse(content={"status": "success", "UserID": UserID, "tf": tf, "bars": bars})
+
+def _read_history(UserID: str, max_points: int, since: str):
+    """Build the /history payload from today's history table (runs on the database thread pool)."""
+    # Each day table numbers its ids from 1, so a cursor is (day, id): one
+    # from an earlier day gets today's full history and reset
+    day = datetime.now().strftime("%Y-%m-%d")
+    if not hub_worker.is_poller and day not in get_history_partitions():
+        # A reader serves the poller's day tables; pick up a new one before the next sync
+        refresh_history_partitions()
+    return read_history(
+        UserID, max_points, since, day,
+        lambda user_id, after_id=0, until_id=None: get_mtm_history_since(user_id, after_id, until_id, day),
+        lambda user_id: get_last_history_marker(user_id, day)
+    )
+
+# Endpoint to get today's MTM history for a user
+@app.get("/history")
+async def get_history(UserID: str = "", max_points: int = 0, since: str = ""):
+    """Return today's MTM history for a user from the database.
+
+    max_points downsamples the series; since=<cursor> (from an earlier
+    response) returns only the points added after it. reset is true when the
+    cursor is from an earlier day and the full history is sent instead.
+    """
+    if not UserID:
+        return JSONResponse(status_code=400, content={"status": "error", "error": "UserID parameter is required"})
+    
+    # Cursors handed out before a daily reset are stale; only the poller resets
+    await check_daily_reset_async()
+    _touch_viewed([UserID])
+    return JSONResponse(content=await async_db.run(_read_history, UserID, max_points, since))
+
+def _parse_range_time(value: str, default: float):
+    """Epoch seconds from an epoch number, "YYYY-MM-DD" or "YYYY-MM-DD HH:MM[:SS]" (local time)."""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time '{value}'")
+
+# Multi-day MTM history
+@app.get("/history/range")
+async def get_history_range(UserID: str = "", start: str = Query("", alias="from"), to: str = "", step: int = 0):
+    """Return a user's MTM history between from and to (default: the last 24 hours).
+
+    from/to are epoch seconds or local "YYYY-MM-DD[ HH:MM[:SS]]" times; step > 0
+    buckets the points into step-second buckets with last/min/max values.
+    """
+    if not UserID:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": "UserID parameter is required"}
+        )
+    
+    try:
+        end_ts = _parse_range_time(to, time.time())
+        start_ts = _parse_range_time(start, end_ts - 86400)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": str(e)}
+        )
+    if end_ts <= start_ts:
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "response": 0, "error": "to must be later than from"}
+        )
+    
+    points = await async_db.run(get_mtm_history_range, UserID, start_ts, end_ts, max(step, 0))
+    return JSONResponse(content={
+        "status": "success",
+        "UserID": UserID,
+        "from": int(start_ts),
+        "to": int(end_ts),
+        "step": max(step, 0),
+        "history": points
+    })
+
 # Endpoint to get configuration values
 @app.get("/config")
 async def get_config():
@@ -284,6 +437,16 @@ async def get_config():
         "server_port": config["server_port"]
     })
 
+# Server-push stream replacing per-user dashboard polling
+@app.get("/stream")
+async def stream_mtm(request: Request):
+    """Server-sent events with one consolidated MTM snapshot per cache update"""
+    return StreamingResponse(
+        mtm_stream.events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Performance monitoring endpoint
 @app.get("/performance")
 async def get_performance_stats():
@@ -292,16 +455,19 @@ async def get_performance_stats():
         from mtm_db_stabilized import get_database_stats
         from mtm_background_stabilized import get_background_stats
         
-        db_stats = get_database_stats()
+        db_stats = await async_db.run(get_database_stats)
         bg_stats = get_background_stats()
         
         return JSONResponse(content={
             "database": db_stats,
             "background": bg_stats,
-            "cache": {
-                "cache_ttl": mtm_cache["cache_ttl"],
-                "batch_updates_pending": len(mtm_cache["batch_updates"])
-            }
+            "single_flight": upstream_client.flights.get_stats(),
+            "db_async": async_db.get_stats(),
+            "state_cache": state_cache.get_stats(),
+            "bars": bar_engine.get_stats(),
+            "journal": tick_journal.get_stats(),
+            "cache": user_states.get_stats(),
+            "worker": hub_worker.get_stats()
         })
     except Exception as e:
         logger.error(f"Error getting performance stats: {str(e)}")
@@ -312,33 +478,47 @@ if __name__ == "__main__":
     logger.info("Starting MarvelQuant Central Hub (Optimized Version)...")
     logger.info(f"Using configuration: MTM refresh={config['mtm_refresh_interval']}ms, Chart update={config['chart_update_interval']}ms")
     
-    # Try to load previous state
-    loaded = load_state()
-    if loaded:
-        logger.info("Successfully loaded previous state")
-    else:
-        logger.info("No previous state loaded, starting fresh")
-    
-    # Register shutdown handler to save state on exit
-    register_shutdown_handler()
-    
-    # Start auto-save for periodic persistence
-    start_auto_save()
-    logger.info("Auto-save started (handled by batch processing)")
-    
-    # Start the background scheduler if enabled
-    if config["enable_background_scheduler"]:
-        start_background_scheduler()
-        logger.info("Optimized background scheduler started")
+    if hub_worker.multi:
+        # Each worker imports the app and elects its role on startup (start_hub_worker);
+        # this process only supervises them
+        logger.info(f"Starting {hub_worker.workers} workers; one polls, all serve")
+        uvicorn.run(
+            "central_dashboard_optimized_fixed:app",
+            host="0.0.0.0",
+            port=config["server_port"],
+            workers=hub_worker.workers,
+            log_level="warning",
+            access_log=False,
+            loop="asyncio"
+        )
     else:
-        logger.info("Background scheduler disabled in config")
-    
-    # Start the FastAPI server with optimized settings
-    uvicorn.run(
-        app, 
-        host="0.0.0.0", 
-        port=config["server_port"],
-        log_level="warning",  # Reduce logging overhead
-        access_log=False,     # Disable access logs for better performance
-        loop="asyncio"        # Use asyncio for better performance
-    )
+        # Try to load previous state
+        loaded = load_state()
+        if loaded:
+            logger.info("Successfully loaded previous state")
+        else:
+            logger.info("No previous state loaded, starting fresh")
+        
+        # Register shutdown handler to save state on exit
+        register_shutdown_handler()
+        
+        # Start auto-save for periodic persistence
+        start_auto_save()
+        logger.info("Auto-save started (handled by batch processing)")
+        
+        # Start the background scheduler if enabled
+        if config["enable_background_scheduler"]:
+            start_background_scheduler()
+            logger.info("Optimized background scheduler started")
+        else:
+            logger.info("Background scheduler disabled in config")
+        
+        # Start the FastAPI server with optimized settings
+        uvicorn.run(
+            app, 
+            host="0.0.0.0", 
+            port=config["server_port"],
+            log_level="warning",  # Reduce logging overhead
+            access_log=False,     # Disable access logs for better performance
+            loop="asyncio"        # Use asyncio for better performance
+        )
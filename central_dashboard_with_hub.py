@@ -61,8 +61,7 @@ mtm_cache = {
     "stats": {},  # Store max/min values for each user
     "last_reset_date": datetime.now().strftime("%Y-%m-%d"),  # Track the last reset date
     "opening_mtm": {},  # Store opening hour MTM values for each user
-    "opening_hour_hit": {},   # Track if opening hour fetch has been done for each user
-    "history": {}  # Store today's MTM history for each user: {user_id: [(timestamp, mtm_value), ...]}
+    "opening_hour_hit": {}   # Track if opening hour fetch has been done for each user
 }
 
 # Initialize stats
@@ -84,12 +83,8 @@ def update_user_stats(user_id: str, mtm_value: float):
         mtm_cache["stats"][user_id]["max_mtm"] = mtm_value
     if mtm_value < mtm_cache["stats"][user_id]["min_mtm"]:
         mtm_cache["stats"][user_id]["min_mtm"] = mtm_value
-    # Append to history (for today)
-    now = datetime.now()
-    ts = now.strftime("%H:%M:%S")
-    if user_id not in mtm_cache["history"]:
-        mtm_cache["history"][user_id] = []
-    mtm_cache["history"][user_id].append({"timestamp": ts, "mtm": mtm_value})
+    # Append to history (for today) - bounded per-user ring buffer
+    mtm_history.append(user_id, mtm_value)
 
 # Reset stats for a user
 def reset_user_stats(user_id: str):
@@ -104,8 +99,7 @@ def reset_user_stats(user_id: str):
     if user_id in mtm_cache["opening_hour_hit"]:
         mtm_cache["opening_hour_hit"].pop(user_id)
     # Reset history for this user
-    if user_id in mtm_cache["history"]:
-        mtm_cache["history"][user_id] = []
+    mtm_history.clear(user_id)
 
 # Reset all stats
 def reset_all_stats():
@@ -148,15 +142,22 @@ headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
 }
 
+# Shared keep-alive client for /MTM calls to the client machines
+from mtm_http import upstream_client
+from mtm_users import user_registry
+from mtm_session import trading_session, PRE_OPEN, OPENING, WARMUP, LIVE, CLOSED
+from mtm_history import mtm_history, downsample_cache
+from mtm_opening import opening_snapshot
+
+@app.on_event("shutdown")
+async def close_upstream_client():
+    """Close keep-alive connections to the client machines"""
+    await upstream_client.aclose()
+
 # Function to get user data from users.json
 def get_user_data():
-    try:
-        with open("users.json", "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load users.json: {str(e)}", exc_info=True)
-        # Return empty user data instead of defaults
-        return {"users": []}
+    """Return the parsed users.json, reloaded only when the file changes."""
+    return user_registry.current().data
 
 # Create default users.json if it doesn't exist
 if not os.path.exists("users.json"):
@@ -179,6 +180,11 @@ async def status():
         "name": "Stoxxo Central Hub", 
         "status": "running", 
         "cached_users": list(mtm_cache["stats"].keys()),
+        "single_flight": upstream_client.flights.get_stats(),
+        "session": trading_session.get_status(),
+        "opening": opening_snapshot.get_stats(),
+        "history": mtm_history.get_stats(),
+        "history_downsample": downsample_cache.get_stats(),
         "description": "Central hub for Stoxxo trading data"
     }
 
@@ -188,9 +194,8 @@ async def get_users():
     logger.info("Users list requested")
     
     try:
-        # Read the users.json file
-        with open("users.json", "r") as f:
-            users_data = json.load(f)
+        # Served from the in-memory user registry
+        users_data = get_user_data()
         
         # Log each user and their IP
         for user in users_data["users"]:
@@ -218,7 +223,7 @@ def check_daily_reset():
         reset_all_stats()
         mtm_cache["last_reset_date"] = current_date
         # Reset history for all users
-        mtm_cache["history"] = {}
+        mtm_history.clear()
         return True
     return False
 
@@ -241,15 +246,9 @@ async def get_mtm(request: Request, UserID: str = ""):
     try:
         current_time = time.time()
         
-        # Get user IP from users.json
-        users_data = get_user_data()
-        user_ip = None
-        
-        # Find the specific user in the users data
-        for user in users_data["users"]:
-            if user["userId"] == UserID:
-                user_ip = user.get("ip")
-                break
+        # Get user IP from the in-memory user registry (no file I/O, dict lookup)
+        users = user_registry.current()
+        user_ip = users.get_ip(UserID)
         
         if not user_ip:
             logger.error(f"No IP found for user {UserID}")
@@ -258,30 +257,15 @@ async def get_mtm(request: Request, UserID: str = ""):
                 content={"status": "error", "response": 0, "error": f"User {UserID} not found or no IP configured"}
             )
         
-        # Get current time to check against opening hour and start time
-        now = datetime.now()
-        current_time_str = now.strftime("%H:%M")
-        
-        # Extract time parts for comparison
-        current_hour, current_minute = now.hour, now.minute
-        current_time_val = current_hour * 100 + current_minute
-        
-        # Get the opening hour and start time from users.json
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
-        
-        # Parse opening hour and start time
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
+        # Session phase is compiled once per users.json version; between
+        # boundaries this is a single timestamp compare
+        phase = trading_session.phase()
         
-        logger.info(f"Time check for {UserID}: Current={current_time_str} ({current_time_val}), Opening={opening_hour} ({opening_hour_val}), Start={start_time} ({start_time_val})")
+        logger.info(f"Session phase for {UserID}: {phase}")
         
         # BEFORE opening hour - don't fetch at all, just return zeros
-        if current_time_val < opening_hour_val:
-            logger.info(f"Before opening hour for {UserID} - {current_time_val} < {opening_hour_val} - not fetching, returning zeros")
+        if phase == PRE_OPEN:
+            logger.info(f"Before opening hour for {UserID} - not fetching, returning zeros")
             
             # Get opening hour value (should be 0 before opening hour)
             opening_hour_mtm = mtm_cache["opening_mtm"].get(UserID, 0)
@@ -298,8 +282,8 @@ async def get_mtm(request: Request, UserID: str = ""):
             )
         
         # AT opening hour, fetch MTM and store it
-        elif current_time_val == opening_hour_val and UserID not in mtm_cache["opening_hour_hit"]:
-            logger.info(f"Exactly at opening hour for {UserID} - {current_time_val} == {opening_hour_val} - fetching for opening hour")
+        elif phase == OPENING and UserID not in mtm_cache["opening_hour_hit"]:
+            logger.info(f"Exactly at opening hour for {UserID} - fetching for opening hour")
             
             # Mark this user as hit at opening hour 
             mtm_cache["opening_hour_hit"][UserID] = True
@@ -307,9 +291,11 @@ async def get_mtm(request: Request, UserID: str = ""):
             # Fetch from client machine
             full_url = f"http://{user_ip}/MTM"
             logger.info(f"Fetching opening hour MTM from {full_url} for user {UserID}")
-            response = requests.get(
-                full_url,
-                headers=headers,
+            # Concurrent requests at the opening minute share one fetch, so
+            # only the leader stores the opening value
+            response, coalesced = await upstream_client.get_shared(
+                user_ip,
+                "/MTM",
                 params={"UserID": UserID},
                 timeout=5
             )
@@ -324,8 +310,9 @@ async def get_mtm(request: Request, UserID: str = ""):
             mtm_value = float(data["response"])
             
             # Store the opening hour MTM value
-            mtm_cache["opening_mtm"][UserID] = mtm_value
-            logger.info(f"Stored opening hour MTM for {UserID}: {mtm_value}")
+            if not coalesced:
+                mtm_cache["opening_mtm"][UserID] = mtm_value
+                logger.info(f"Stored opening hour MTM for {UserID}: {mtm_value}")
             
             # Get opening hour value for this user
             opening_hour_mtm = mtm_cache["opening_mtm"].get(UserID, 0)
@@ -334,7 +321,8 @@ async def get_mtm(request: Request, UserID: str = ""):
             relative_mtm = mtm_value - opening_hour_mtm
             
             # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            if not coalesced:
+                update_user_stats(UserID, relative_mtm)
             
             # Return response with stats
             response_data = {
@@ -348,27 +336,10 @@ async def get_mtm(request: Request, UserID: str = ""):
             
             return JSONResponse(content=response_data)
         
-        # At opening hour but ALREADY hit - return opening hour MTM but zeros for current/max/min
-        elif current_time_val == opening_hour_val and UserID in mtm_cache["opening_hour_hit"]:
-            logger.info(f"Still at opening hour for {UserID} but already hit - returning zeros with stored opening hour")
-            
-            # Get opening hour value
-            opening_hour_mtm = mtm_cache["opening_mtm"].get(UserID, 0)
-            
-            return JSONResponse(
-                content={
-                    "status": "success",
-                    "response": 0,  # Current MTM as 0 (no change from opening)
-                    "max_mtm": 0,   # Max MTM as 0
-                    "min_mtm": 0,   # Min MTM as 0
-                    "opening_mtm": opening_hour_mtm,
-                    "cached": False
-                }
-            )
-        
-        # BETWEEN opening hour and start time
-        elif current_time_val > opening_hour_val and current_time_val < start_time_val:
-            logger.info(f"Between opening and start for {UserID} - {opening_hour_val} < {current_time_val} < {start_time_val} - returning zeros with stored opening hour")
+        # At opening hour but ALREADY hit, or between opening hour and start time -
+        # return opening hour MTM but zeros for current/max/min
+        elif phase == OPENING or phase == WARMUP:
+            logger.info(f"{phase} for {UserID} - returning zeros with stored opening hour")
             
             # Get opening hour value
             opening_hour_mtm = mtm_cache["opening_mtm"].get(UserID, 0)
@@ -384,9 +355,9 @@ async def get_mtm(request: Request, UserID: str = ""):
                 }
             )
         
-        # After start time or if at opening hour but already hit, use normal cache logic
-        # Use cache if available and not expired
-        if UserID in mtm_cache["data"] and UserID in mtm_cache["last_updated"] and time.time() - mtm_cache["last_updated"][UserID] < mtm_cache["cache_ttl"]:
+        # LIVE (or CLOSED) - use cache if available and not expired; after
+        # close the last value is served as-is, without polling
+        if UserID in mtm_cache["data"] and UserID in mtm_cache["last_updated"] and (phase == CLOSED or time.time() - mtm_cache["last_updated"][UserID] < mtm_cache["cache_ttl"]):
             logger.info(f"Using cached data for {UserID}")
             
             # Get opening hour value for this user
@@ -408,12 +379,13 @@ async def get_mtm(request: Request, UserID: str = ""):
         full_url = f"http://{user_ip}/MTM"
         logger.info(f"Fetching regular MTM from {full_url} for user {UserID}")
         
-        # Forward the request to the client machine
-        response = requests.get(
-            full_url,
-            headers=headers,
+        # Forward the request to the client machine; concurrent misses for
+        # this user wait on the same in-flight request
+        response, coalesced = await upstream_client.get_shared(
+            user_ip,
+            "/MTM",
             params={"UserID": UserID},
-            timeout=5  # Add timeout
+            timeout=5
         )
         
         response.raise_for_status()  # Raise exception for bad status codes
@@ -432,18 +404,17 @@ async def get_mtm(request: Request, UserID: str = ""):
             # Extract MTM value
             mtm_value = float(data["response"])
             
-            # Update cache
-            mtm_cache["data"][UserID] = response.text
-            mtm_cache["last_updated"][UserID] = time.time()
-            
             # Get opening hour value for this user
             opening_hour_mtm = mtm_cache["opening_mtm"].get(UserID, 0)
             
             # Calculate relative MTM (current value minus opening hour value)
             relative_mtm = mtm_value - opening_hour_mtm
             
-            # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            # Update cache and stats (a coalesced request's leader already did)
+            if not coalesced:
+                mtm_cache["data"][UserID] = response.text
+                mtm_cache["last_updated"][UserID] = time.time()
+                update_user_stats(UserID, relative_mtm)
             
             # Return response with stats
             response_data = {
@@ -461,7 +432,7 @@ async def get_mtm(request: Request, UserID: str = ""):
             # If not JSON, return the raw text
             return response.text
             
-    except requests.RequestException as e:
+    except (requests.RequestException, httpx.HTTPError) as e:
         error_msg = f"Failed to fetch MTM data: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return JSONResponse(
@@ -532,12 +503,18 @@ async def trigger_background_fetch(background_tasks: BackgroundTasks):
 
 # Endpoint to get today's MTM history for a user
 @app.get("/history")
-async def get_history(UserID: str = ""):
-    """Return today's MTM history for a user"""
+async def get_history(UserID: str = "", max_points: int = 0, since: str = ""):
+    """Return today's MTM history for a user.
+
+    max_points downsamples the series; since=<cursor> (from an earlier
+    response) returns only the points added after it, with reset set when the
+    cursor is stale (e.g. after the daily reset) and the full history is sent.
+    """
     if not UserID:
         return JSONResponse(status_code=400, content={"status": "error", "error": "UserID parameter is required"})
-    history = mtm_cache["history"].get(UserID, [])
-    return JSONResponse(content={"status": "success", "history": history})
+    check_daily_reset()
+    result = mtm_history.get_history(UserID, max_points=max_points, since=since or None)
+    return JSONResponse(content={"status": "success", **result})
 
 # Dashboard HTML to be served at the root endpoint
 DASHBOARD_HTML = """<!DOCTYPE html>
@@ -800,6 +777,8 @@ DASHBOARD_HTML = """<!DOCTYPE html>
         let zeroMtmCount = {};
         // History cache for user graphs
         const historyCache = {};
+        const HISTORY_MAX_POINTS = 300; // Charts get a server-side downsample of at most this many points
+        const historyCursor = {}; // /history cursor per user, so chart refreshes fetch only new points
         // Spinner SVG
         const spinnerSVG = `<div style='display:flex;align-items:center;justify-content:center;height:100%;'><svg width='40' height='40' viewBox='0 0 40 40' fill='none'><circle cx='20' cy='20' r='16' stroke='#2a5298' stroke-width='4' stroke-linecap='round' stroke-dasharray='80' stroke-dashoffset='60'><animate attributeName='stroke-dashoffset' values='60;0' dur='1s' repeatCount='indefinite'/></circle></svg></div>`;
         // Helper: Exponential backoff for MTM fetch errors
@@ -1082,10 +1061,10 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                                 setTimeout(() => renderUserGraph(userId, instance.popper.querySelector('canvas'), false, true), 0);
                             } else {
                                 instance.setContent(spinnerSVG);
-                                fetch(`/history?UserID=${userId}`)
+                                fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`)
                                     .then(res => res.json())
                                     .then(data => {
-                                        historyCache[userId] = data.history || [];
+                                        storeHistory(userId, data, false);
                                         instance.setContent(createGraphPopoverContent(userId, false));
                                         setTimeout(() => renderUserGraph(userId, instance.popper.querySelector('canvas'), false, true), 0);
                                     });
@@ -1120,8 +1099,8 @@ DASHBOARD_HTML = """<!DOCTYPE html>
             if (useCache && historyCache[userId]) {
                 historyPromise = Promise.resolve({ history: historyCache[userId] });
             } else {
-                historyPromise = fetch(`/history?UserID=${userId}`).then(res => res.json()).then(data => {
-                    historyCache[userId] = data.history || [];
+                historyPromise = fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`).then(res => res.json()).then(data => {
+                    storeHistory(userId, data, false);
                     return data;
                 });
             }
@@ -1228,10 +1207,10 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                 } else {
                     renderUserGraph(userId, canvas, true, false);
                     // Wait for data, then hide spinner
-                    fetch(`/history?UserID=${userId}`)
+                    fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`)
                         .then(res => res.json())
                         .then(data => {
-                            historyCache[userId] = data.history || [];
+                            storeHistory(userId, data, false);
                             document.getElementById('graph-modal-spinner').style.display = 'none';
                             canvas.style.display = '';
                             renderUserGraph(userId, canvas, true, true);
@@ -1264,13 +1243,29 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                 if (e.target === modalBg) modalBg.remove();
             });
         }
+        // Store a /history response; deltas are appended unless the server reset the series
+        function storeHistory(userId, data, isDelta) {
+            if (isDelta && !data.reset && historyCache[userId]) {
+                historyCache[userId].push(...(data.history || []));
+            } else {
+                historyCache[userId] = data.history || [];
+            }
+            historyCursor[userId] = data.cursor;
+        }
+        // Fetch only the points added since the last call; start again from a fresh
+        // downsample once the appended points outgrow it
+        async function updateChartHistory(userId) {
+            const cached = historyCache[userId];
+            const isDelta = Boolean(cached && historyCursor[userId] && cached.length < 2 * HISTORY_MAX_POINTS);
+            const url = isDelta
+                ? `/history?UserID=${userId}&since=${encodeURIComponent(historyCursor[userId])}`
+                : `/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`;
+            const data = await fetch(url).then(res => res.json());
+            storeHistory(userId, data, isDelta);
+        }
         // Proactively refresh chart history for all users
         async function refreshAllChartHistories() {
-            await Promise.all(users.map(user =>
-                fetch(`/history?UserID=${user.userId}`)
-                    .then(res => res.json())
-                    .then(data => { historyCache[user.userId] = data.history || []; })
-            ));
+            await Promise.all(users.map(user => updateChartHistory(user.userId)));
         }
         // Refresh chart cache when returning to the tab
         document.addEventListener('visibilitychange', function() {
@@ -1288,10 +1283,10 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                 if (modal && lastChartUserId) {
                     const canvas = document.getElementById(`graph-canvas-${lastChartUserId}-modal`);
                     if (canvas) {
-                        fetch(`/history?UserID=${lastChartUserId}`)
+                        fetch(`/history?UserID=${lastChartUserId}&max_points=${HISTORY_MAX_POINTS}`)
                             .then(res => res.json())
                             .then(data => {
-                                historyCache[lastChartUserId] = data.history || [];
+                                storeHistory(lastChartUserId, data, false);
                                 renderUserGraph(lastChartUserId, canvas, true, true);
                             });
                     }
@@ -1303,10 +1298,10 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                     if (popover) {
                         const canvas = popover.querySelector('canvas');
                         if (canvas) {
-                            fetch(`/history?UserID=${lastPopoverUserId}`)
+                            fetch(`/history?UserID=${lastPopoverUserId}&max_points=${HISTORY_MAX_POINTS}`)
                                 .then(res => res.json())
                                 .then(data => {
-                                    historyCache[lastPopoverUserId] = data.history || [];
+                                    storeHistory(lastPopoverUserId, data, false);
                                     renderUserGraph(lastPopoverUserId, canvas, false, true);
                                 });
                         }
@@ -1323,54 +1318,26 @@ DASHBOARD_HTML = """<!DOCTYPE html>
 async def fetch_user_mtm_background(user_id: str, user_ip: str):
     """Fetch MTM data for a user in the background"""
     try:
-        full_url = f"http://{user_ip}/MTM"
-        logger.info(f"Background fetching from {full_url} for user {user_id}")
-        
-        # Forward the request to the client machine
-        response = requests.get(
-            full_url,
-            headers=headers,
-            params={"UserID": user_id},
-            timeout=5
-        )
-        
-        response.raise_for_status()
+        logger.info(f"Background fetching from http://{user_ip}/MTM for user {user_id}")
         
-        # Parse the response
-        data = response.json()
-        if isinstance(data, str):
-            data = json.loads(data)
+        # Forward the request to the client machine over the shared keep-alive client
+        data, _ = await upstream_client.fetch_mtm(user_id, user_ip, timeout=5)
         
         # Extract MTM value
         mtm_value = float(data["response"])
         logger.info(f"Background fetch successful for {user_id}, MTM: {mtm_value}")
         
-        # Store value depending on current time
-        now = datetime.now()
-        current_time_str = now.strftime("%H:%M")
-        current_hour, current_minute = now.hour, now.minute
-        current_time_val = current_hour * 100 + current_minute
-        
-        # Get settings from users.json
-        users_data = get_user_data()
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
-        
-        # Parse times
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
+        # Store value depending on the trading session phase
+        phase = trading_session.phase()
         
         # If at opening hour, store as opening MTM
-        if current_time_val == opening_hour_val:
+        if phase == OPENING:
             logger.info(f"Background fetch at opening hour for {user_id} - storing as opening MTM")
             mtm_cache["opening_mtm"][user_id] = mtm_value
             mtm_cache["opening_hour_hit"][user_id] = True
         
         # If after start time, update regular stats
-        if current_time_val >= start_time_val:
+        if phase == LIVE:
             # Calculate relative MTM (current value minus opening hour value)
             opening_hour_mtm = mtm_cache["opening_mtm"].get(user_id, 0)
             relative_mtm = mtm_value - opening_hour_mtm
@@ -1385,16 +1352,23 @@ async def fetch_user_mtm_background(user_id: str, user_ip: str):
     except Exception as e:
         logger.error(f"Background fetch error for {user_id}: {str(e)}", exc_info=True)
 
+def store_opening_mtm(user_id: str, data: dict):
+    """Store a value fetched by the opening snapshot as the user's opening MTM"""
+    mtm_cache["opening_mtm"][user_id] = float(data["response"])
+    mtm_cache["opening_hour_hit"][user_id] = True
+
 # Background scheduler function
 def start_background_scheduler():
     """Start a background scheduler that checks the time and fetches data"""
-    def run_scheduler():
+    async def run_scheduler():
         logger.info("Starting background scheduler")
+        last_phase = None
+        prewarmed_for = None   # Opening boundary the connections were last pre-warmed for
+        captured_for = None    # Opening boundary the snapshot last ran for
         while True:
             try:
                 # Get current time
                 now = datetime.now()
-                current_time_str = now.strftime("%H:%M")
                 
                 # Get settings from users.json
                 users_data = get_user_data()
@@ -1402,25 +1376,34 @@ def start_background_scheduler():
                 start_time = users_data.get("start_time", "09:16")
                 
                 # Check if it's opening hour or start time
-                is_opening_hour = current_time_str == opening_hour
-                is_start_time = current_time_str == start_time
-                is_after_start = current_time_str > start_time
+                phase = trading_session.phase()
+                is_opening_hour = phase == OPENING
+                is_start_time = phase == LIVE and last_phase != LIVE
+                is_after_start = phase == LIVE
+                last_phase = phase
+                
+                # Shortly before the opening minute, open connections to the client machines
+                if phase == PRE_OPEN:
+                    opening_at = time.time() + trading_session.seconds_until_next_transition()
+                    if opening_at - time.time() <= opening_snapshot.prewarm_lead and prewarmed_for != round(opening_at):
+                        prewarmed_for = round(opening_at)
+                        await opening_snapshot.prewarm(
+                            users_data.get("users", []), timeout=max(0.5, opening_at - time.time() - 0.5)
+                        )
                 
-                # If it's opening hour and we haven't fetched for some users
+                # If it's opening hour, snapshot every user not fetched yet at once
                 if is_opening_hour:
-                    logger.info(f"It's opening hour: {opening_hour}")
-                    
-                    # Fetch for all users that haven't been fetched yet
-                    for user in users_data.get("users", []):
-                        user_id = user.get("userId")
-                        user_ip = user.get("ip")
-                        
-                        if user_id and user_ip and user_id not in mtm_cache["opening_hour_hit"]:
-                            logger.info(f"Scheduling background fetch for {user_id} at opening hour")
-                            # Create a new event loop for the async function
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            loop.run_until_complete(fetch_user_mtm_background(user_id, user_ip))
+                    boundary = trading_session.phase_started_at()
+                    pending = [
+                        user for user in users_data.get("users", [])
+                        if user.get("userId") and user.get("ip") and user["userId"] not in mtm_cache["opening_hour_hit"]
+                    ]
+                    if pending and captured_for != round(boundary):
+                        logger.info(f"It's opening hour: {opening_hour}")
+                        captured_for = round(boundary)
+                        # Retries within the minute happen inside the snapshot
+                        until = time.time() + trading_session.seconds_until_next_transition()
+                        await opening_snapshot.capture(pending, boundary, until, store_opening_mtm)
                 
                 # If it's start time or after start time, initiate regular fetching
                 if is_start_time or (is_after_start and now.second == 0):  # Only fetch at xx:xx:00
@@ -1428,29 +1411,23 @@ def start_background_scheduler():
                     if is_start_time:
                         logger.info(f"It's start time: {start_time}")
                     
-                    # Fetch for all users
-                    for user in users_data.get("users", []):
-                        user_id = user.get("userId")
-                        user_ip = user.get("ip")
-                        
-                        if user_id and user_ip:
-                            # Only fetch every minute after start time
-                            if is_start_time or now.second == 0:
-                                # Create a new event loop for the async function
-                                loop = asyncio.new_event_loop()
-                                asyncio.set_event_loop(loop)
-                                loop.run_until_complete(fetch_user_mtm_background(user_id, user_ip))
+                    # Fetch for all users concurrently
+                    await asyncio.gather(*(
+                        fetch_user_mtm_background(user["userId"], user["ip"])
+                        for user in users_data.get("users", [])
+                        if user.get("userId") and user.get("ip")
+                    ))
                 
-                # Sleep for 1 second before checking again
-                time.sleep(1)
+                # Check again in 1 second, or right at a phase boundary that comes sooner
+                await asyncio.sleep(min(1.0, max(0.01, trading_session.seconds_until_next_transition())))
                 
             except Exception as e:
                 logger.error(f"Error in background scheduler: {str(e)}", exc_info=True)
                 # Sleep a bit longer on error to prevent spam
-                time.sleep(5)
+                await asyncio.sleep(5)
     
-    # Start the scheduler in a separate thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    # Start the scheduler in a separate thread with its own event loop
+    scheduler_thread = threading.Thread(target=lambda: asyncio.run(run_scheduler()), daemon=True)
     scheduler_thread.start()
     logger.info("Background scheduler started in separate thread")
 
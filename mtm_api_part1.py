@@ -1,10 +1,13 @@
 # mtm_api_part1.py
 # File 4: API Endpoints Part 1
 
+import sys
 from mtm_imports import *
 from mtm_cache import *
 from mtm_server import *
 from mtm_html import DASHBOARD_HTML
+from mtm_history import downsample_cache
+from mtm_db_async import async_db
 
 @app.get("/")
 async def root():
@@ -16,12 +19,26 @@ async def root():
 async def status():
     """API endpoint returning server status"""
     logger.info("Status endpoint accessed")
-    return {
+    # Only the stabilized app loads the opening MTM / app state cache, and it
+    # serves /stream from its own snapshot stream
+    stabilized_cache = sys.modules.get("mtm_cache_stabilized")
+    stream = stabilized_cache.mtm_stream if stabilized_cache is not None else mtm_stream
+    status = {
         "name": "Stoxxo Central Hub", 
         "status": "running", 
         "cached_users": list(mtm_cache["stats"].keys()),
+        "stream": stream.get_stats(),
+        "upstream_hosts": upstream_client.get_host_stats(),
+        "single_flight": upstream_client.flights.get_stats(),
+        "db_async": async_db.get_stats(),
+        "session": trading_session.get_status(),
+        "history_downsample": downsample_cache.get_stats(),
         "description": "Central hub for Stoxxo trading data"
     }
+    if stabilized_cache is not None:
+        status["state_cache"] = stabilized_cache.state_cache.get_stats()
+        status["user_states"] = stabilized_cache.user_states.get_stats()
+    return status
 
 @app.get("/users")
 async def get_users():
@@ -29,9 +46,8 @@ async def get_users():
     logger.info("Users list requested")
     
     try:
-        # Read the users.json file
-        with open("users.json", "r") as f:
-            users_data = json.load(f)
+        # Served from the in-memory user registry
+        users_data = get_user_data()
         
         # Log each user and their IP
         for user in users_data["users"]:
@@ -24,15 +24,9 @@ async def get_mtm(request: Request, UserID: str = ""):
     try:
         current_time = time.time()
         
-        # Get user IP from users.json
-        users_data = get_user_data()
-        user_ip = None
-        
-        # Find the specific user in the users data
-        for user in users_data["users"]:
-            if user["userId"] == UserID:
-                user_ip = user.get("ip")
-                break
+        # Get user IP from the in-memory user registry (no file I/O, dict lookup)
+        users = user_registry.current()
+        user_ip = users.get_ip(UserID)
         
         if not user_ip:
             logger.error(f"No IP found for user {UserID}")
@@ -49,16 +43,9 @@ async def get_mtm(request: Request, UserID: str = ""):
         current_hour, current_minute = now.hour, now.minute
         current_time_val = current_hour * 100 + current_minute
         
-        # Get the opening hour and start time from users.json
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
-        
-        # Parse opening hour and start time
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
+        # Opening hour and start time are parsed once per users.json version
+        opening_hour, start_time = users.opening_hour, users.start_time
+        opening_hour_val, start_time_val = users.opening_hour_val, users.start_time_val
         
         logger.info(f"Time check for {UserID}: Current={current_time_str} ({current_time_val}), Opening={opening_hour} ({opening_hour_val}), Start={start_time} ({start_time_val})")
         
@@ -90,9 +77,9 @@ async def get_mtm(request: Request, UserID: str = ""):
             # Fetch from client machine
             full_url = f"http://{user_ip}/MTM"
             logger.info(f"Fetching opening hour MTM from {full_url} for user {UserID}")
-            response = requests.get(
-                full_url,
-                headers=headers,
+            response = await upstream_client.get(
+                user_ip,
+                "/MTM",
                 params={"UserID": UserID},
                 timeout=5
             )
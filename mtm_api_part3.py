@@ -12,26 +12,17 @@ async def get_mtm_continued(request: Request, UserID: str = ""):
     # for clarity. In the merged file, do not duplicate the function declaration.
     
     try:
-        # Get user info
-        users_data = get_user_data()
-        user_ip = None
-        for user in users_data["users"]:
-            if user["userId"] == UserID:
-                user_ip = user.get("ip")
-                break
+        # Get user info from the in-memory user registry
+        users = user_registry.current()
+        user_ip = users.get_ip(UserID)
                 
         # Get current time 
         now = datetime.now()
         current_hour, current_minute = now.hour, now.minute
         current_time_val = current_hour * 100 + current_minute
         
-        # Get opening/start times
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
+        # Get opening/start times (parsed once per users.json version)
+        opening_hour_val, start_time_val = users.opening_hour_val, users.start_time_val
         
         # BETWEEN opening hour and start time
         if current_time_val > opening_hour_val and current_time_val < start_time_val:
@@ -76,11 +67,11 @@ async def get_mtm_continued(request: Request, UserID: str = ""):
         logger.info(f"Fetching regular MTM from {full_url} for user {UserID}")
         
         # Forward the request to the client machine
-        response = requests.get(
-            full_url,
-            headers=headers,
+        response = await upstream_client.get(
+            user_ip,
+            "/MTM",
             params={"UserID": UserID},
-            timeout=5  # Add timeout
+            timeout=5
         )
         
         response.raise_for_status()  # Raise exception for bad status codes
@@ -128,7 +119,7 @@ async def get_mtm_continued(request: Request, UserID: str = ""):
             # If not JSON, return the raw text
             return response.text
             
-    except requests.RequestException as e:
+    except (requests.RequestException, httpx.HTTPError) as e:
         error_msg = f"Failed to fetch MTM data: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return JSONResponse(
@@ -6,27 +6,23 @@ from mtm_cache import *
 from mtm_server import *
 from mtm_background import fetch_user_mtm_background
 from mtm_db import get_mtm_history, reset_all_stats_db, get_user_stats, get_app_state
+from mtm_db_async import async_db
 
 @app.post("/reset-all")
 async def reset_all():
     """Reset stats for all users in the database"""
     logger.info("Resetting all user stats")
-    reset_all_stats_db()
+    await async_db.run(reset_all_stats_db)
     # Also clear in-memory caches
     mtm_cache["stats"] = {}
     mtm_cache["opening_mtm"] = {}
     mtm_cache["opening_hour_hit"] = {}
     mtm_cache["time_markers"] = {}
+    mtm_stream.notify()
     return {"status": "success", "message": "All stats reset"}
 
-@app.get("/db-debug")
-async def get_db_debug():
-    """Endpoint that returns the current state of the database for debugging"""
-    logger.info("Database debug endpoint accessed")
-    
-    users_data = get_user_data()
-    users = users_data.get("users", [])
-    
+def _collect_db_debug(users):
+    """Read the /db-debug payload (runs on the database thread pool)."""
     debug_data = {
         "last_reset_date": get_app_state("last_reset_date"),
         "users": []
@@ -42,7 +38,17 @@ async def get_db_debug():
             "history_points": len(history)
         }
         debug_data["users"].append(user_info)
-        
+    return debug_data
+
+@app.get("/db-debug")
+async def get_db_debug():
+    """Endpoint that returns the current state of the database for debugging"""
+    logger.info("Database debug endpoint accessed")
+    
+    users_data = get_user_data()
+    users = users_data.get("users", [])
+    
+    debug_data = await async_db.run(_collect_db_debug, users)
     return JSONResponse(content=debug_data)
 
 @app.post("/trigger-background-fetch")
@@ -63,15 +69,6 @@ async def trigger_background_fetch(background_tasks: BackgroundTasks):
     
     return {"status": "success", "message": f"Triggered background fetch for {fetch_count} users"}
 
-# Endpoint to get today's MTM history for a user
-@app.get("/history")
-async def get_history(UserID: str = ""):
-    """Return today's MTM history for a user from the database"""
-    if not UserID:
-        return JSONResponse(status_code=400, content={"status": "error", "error": "UserID parameter is required"})
-    history = get_mtm_history(UserID)
-    return JSONResponse(content={"status": "success", "history": history})
-
 # Unused endpoints from the old implementation - can be removed or left as is
 @app.post("/reset/{user_id}")
 async def reset_stats(user_id: str):
@@ -4,232 +4,277 @@
 import threading
 import time
 import asyncio
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from mtm_imports import *
-from mtm_cache_stabilized import *
 from mtm_server import *
-import aiohttp
+# After mtm_server, which re-exports the legacy mtm_cache names
+from mtm_cache_stabilized import *
+from mtm_scheduler import TickStats, next_boundary, sleep_until
+from mtm_cadence import poll_cadence
+from mtm_opening import opening_snapshot
 
-# Global event loop for background operations
-background_loop = None
-background_tasks = {}
+# Background poller state
+background_stats = {
+    "last_poll_started": None,   # When the last poll of all users started
+    "last_poll_duration": 0.0,   # How long it took, in seconds
+    "last_poll_users": 0,        # Users included in the last poll
+    "last_poll_errors": 0        # Users whose fetch failed in the last poll
+}
+tick_stats = TickStats()
+scheduler_task = None      # asyncio.Task running run_scheduler()
+scheduler_loop = None      # The server's event loop the task runs in
+scheduler_stop = None      # asyncio.Event that ends run_scheduler()
+_scheduler_hooks_added = False
 
-def get_or_create_event_loop():
-    """Get or create an event loop for background operations."""
-    global background_loop
-    if background_loop is None:
-        try:
-            background_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(background_loop)
-        except RuntimeError:
-            background_loop = asyncio.get_event_loop()
-    return background_loop
+def process_user_mtm_background(user_id: str, data: dict):
+    """Store a background-fetched MTM value according to the trading session phase."""
+    # Extract MTM value
+    mtm_value = float(data["response"])
+    logger.debug(f"Background fetch successful for {user_id}, MTM: {mtm_value}")
+    
+    # Store value depending on the trading session phase
+    phase = trading_session.phase()
+    
+    # If at opening hour, store as opening MTM
+    if phase == OPENING:
+        logger.info(f"Background fetch at opening hour for {user_id} - storing as opening MTM")
+        state_cache.set_opening_mtm(user_id, mtm_value)
+    
+    # If after start time, update regular stats
+    if phase == LIVE:
+        # Calculate relative MTM (current value minus opening hour value)
+        opening_hour_mtm = state_cache.get_opening_mtm(user_id)
+        relative_mtm = mtm_value - opening_hour_mtm
+        
+        # Update user stats with the relative MTM value
+        update_user_stats(user_id, relative_mtm)
+        poll_cadence.observe(user_id, relative_mtm)
+        
+        # Also store the raw response in the cache
+        set_cached_data(user_id, json.dumps(data))
 
 # Function to fetch MTM data for a user in the background
 async def fetch_user_mtm_background(user_id: str, user_ip: str):
     """Fetch MTM data for a user in the background with improved error handling."""
     try:
-        full_url = f"http://{user_ip}/MTM"
-        logger.debug(f"Background fetching from {full_url} for user {user_id}")
-        
-        # Use session for connection pooling
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            async with session.get(full_url, params={"UserID": user_id}) as response:
-                if response.status != 200:
-                    logger.warning(f"Background fetch failed for {user_id}: HTTP {response.status}")
-                    return
-                
-                data = await response.json()
-                if isinstance(data, str):
-                    data = json.loads(data)
-                
-                # Extract MTM value
-                mtm_value = float(data["response"])
-                logger.debug(f"Background fetch successful for {user_id}, MTM: {mtm_value}")
-                
-                # Store value depending on current time
-                now = datetime.now()
-                current_time_str = now.strftime("%H:%M")
-                current_hour, current_minute = now.hour, now.minute
-                current_time_val = current_hour * 100 + current_minute
-                
-                # Get settings from users.json
-                users_data = get_user_data()
-                opening_hour = users_data.get("opening_mtm", "09:15")
-                start_time = users_data.get("start_time", "09:16")
-                
-                # Parse times
-                opening_hour_parts = opening_hour.split(":")
-                start_time_parts = start_time.split(":")
-                
-                opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-                start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
-                
-                # If at opening hour, store as opening MTM
-                if current_time_val == opening_hour_val:
-                    logger.info(f"Background fetch at opening hour for {user_id} - storing as opening MTM")
-                    set_opening_mtm_db(user_id, mtm_value)
-                    
-                    # Save state immediately after capturing opening MTM
-                    from mtm_persistence_stabilized import save_state
-                    save_state()
-                    logger.info(f"Saved state immediately after capturing opening MTM for {user_id} in background")
-                
-                # If after start time, update regular stats
-                if current_time_val >= start_time_val:
-                    # Calculate relative MTM (current value minus opening hour value)
-                    opening_hour_mtm = get_opening_mtm_db(user_id)
-                    relative_mtm = mtm_value - opening_hour_mtm
-                    
-                    # Update user stats with the relative MTM value
-                    update_user_stats(user_id, relative_mtm)
-                    
-                    # Also store the raw response in the cache
-                    set_cached_data(user_id, json.dumps(data))
-    
-    except asyncio.TimeoutError:
+        logger.debug(f"Background fetching from http://{user_ip}/MTM for user {user_id}")
+        data, _ = await upstream_client.fetch_mtm(user_id, user_ip, timeout=10)
+        process_user_mtm_background(user_id, data)
+    except httpx.TimeoutException:
         logger.warning(f"Background fetch timeout for {user_id}")
     except Exception as e:
         logger.error(f"Background fetch error for {user_id}: {str(e)}", exc_info=True)
 
-def schedule_background_fetch(user_id: str, user_ip: str, delay: float = 0):
-    """Schedule a background fetch with proper task management."""
-    global background_tasks
-    
-    # Cancel existing task if any
-    if user_id in background_tasks:
-        background_tasks[user_id].cancel()
+async def fetch_users_mtm_background(users: list, timeout: float = None):
+    """Fetch MTM for many users with one bounded keep-alive fan-out per client machine.
+
+    Returns (users fetched, errors, users cut off by the timeout).
+    """
+    started = time.time()
+    errors = 0
+    timed_out = 0
+    results = await upstream_client.fetch_mtm_by_host(users, timeout=timeout)
+    for user_id, result in results.items():
+        if isinstance(result, Exception):
+            errors += 1
+            if isinstance(result, TimeoutError):
+                timed_out += 1
+            logger.warning(f"Background fetch failed for {user_id}: {type(result).__name__}: {str(result)}")
+            continue
+        try:
+            process_user_mtm_background(user_id, result[0])
+        except Exception as e:
+            errors += 1
+            logger.error(f"Background fetch error for {user_id}: {str(e)}", exc_info=True)
     
-    # Create new task
-    loop = get_or_create_event_loop()
-    task = loop.create_task(fetch_user_mtm_background(user_id, user_ip))
-    background_tasks[user_id] = task
+    background_stats["last_poll_started"] = datetime.fromtimestamp(started).strftime("%H:%M:%S")
+    background_stats["last_poll_duration"] = round(time.time() - started, 3)
+    background_stats["last_poll_users"] = len(results)
+    background_stats["last_poll_errors"] = errors
+    return len(results), errors, timed_out
+
+def _poll_settings():
+    """(tick interval, deadline) while LIVE; a tick always ends before the next boundary.
+
+    Ticks come at the fastest per-user cadence; each polls only the users due.
+    """
+    interval = poll_cadence.min_interval
+    deadline = min(float(config.get("background_poll_deadline", 20.0)), interval * 0.9)
+    return interval, deadline
+
+async def run_tick(kind: str, scheduled: float, users: list, deadline: float):
+    """Fetch every user concurrently, bounded by deadline, and record the tick's timing."""
+    started = time.time()
+    fetched, errors, timed_out = await fetch_users_mtm_background(users, timeout=deadline)
+    tick = tick_stats.record(kind, scheduled, started, time.time(), fetched, errors, timed_out)
+    if timed_out:
+        logger.warning(f"{kind} tick at {tick['scheduled']}: {timed_out} of {fetched} users missed the {deadline}s deadline")
+    logger.debug(f"{kind} tick at {tick['scheduled']}: late {tick['lateness_ms']} ms, took {tick['duration_ms']} ms")
+
+def store_opening_mtm(user_id: str, data: dict):
+    """Store a value fetched by the opening snapshot as the user's opening MTM."""
+    state_cache.set_opening_mtm(user_id, float(data["response"]))
+
+async def run_opening_snapshot(boundary: float, users: list):
+    """Capture the opening MTM of users concurrently, retrying within the opening minute."""
+    started = time.time()
+    until = started + trading_session.seconds_until_next_transition(started)
+    report = await opening_snapshot.capture(users, boundary, until, store_opening_mtm)
+    failed = len(report["failed"])
+    tick_stats.record("opening", boundary, started, time.time(), report["users"], failed, 0)
+
+async def run_scheduler(stop: asyncio.Event):
+    """Fire background fetches at wall-clock boundaries, in the server's event loop.
+
+    Ticks are the start of the opening minute (a concurrent snapshot of the
+    users whose opening MTM is not captured yet, with connections pre-warmed
+    shortly before), start time, and while LIVE every poll_interval_min
+    seconds aligned to the clock, polling the users whose adaptive
+    interval (poll_cadence) has elapsed. Between ticks the task
+    sleeps until the next boundary, re-planning at least every 5 seconds in
+    case users.json moves it.
+    """
+    logger.info("Starting aligned background scheduler")
+    last_phase = None
+    next_poll = None
+    prewarmed_for = None    # Opening boundary the connections were last pre-warmed for
     
-    # Add callback to clean up completed tasks
-    def cleanup_task(task):
-        if user_id in background_tasks:
-            del background_tasks[user_id]
+    while not stop.is_set():
+        try:
+            now = time.time()
+            phase = trading_session.phase(now)
+            interval, deadline = _poll_settings()
+            users = user_registry.current()
+            
+            if phase != last_phase:
+                # A phase boundary was crossed; on startup there is no boundary to be late for
+                boundary = trading_session.phase_started_at(now) if last_phase is not None else now
+                last_phase = phase
+                
+                # Entering the opening minute: capture the opening MTM
+                if phase == OPENING:
+                    logger.info(f"It's opening hour: {users.opening_hour}")
+                    # Yesterday's volatility and poll times no longer apply
+                    poll_cadence.reset()
+                    pending = [
+                        user for user in users.users
+                        if user.get("ip") and not state_cache.is_opening_mtm_captured(user["userId"])
+                    ]
+                    if pending:
+                        logger.info(f"Fetching opening MTM for {len(pending)} users")
+                        await run_opening_snapshot(boundary, pending)
+                
+                # Entering LIVE: fetch at once, then on the aligned boundaries
+                elif phase == LIVE:
+                    logger.info(f"It's start time: {users.start_time}")
+                    poll_cadence.mark_polled(users.users, boundary)
+                    await run_tick("start", boundary, users.users, deadline)
+                    next_poll = next_boundary(time.time(), interval)
+                continue
+            
+            if phase == LIVE:
+                if now >= next_poll:
+                    # Boundaries that passed while the loop was busy are skipped, not fired late
+                    missed = int((now - next_poll) // interval)
+                    tick_stats.skipped += missed
+                    scheduled = next_poll + missed * interval
+                    due = poll_cadence.due(users.users, scheduled)
+                    if due:
+                        await run_tick("poll", scheduled, due, deadline)
+                    next_poll = next_boundary(max(time.time(), scheduled), interval)
+                    continue
+                target = min(next_poll, now + trading_session.seconds_until_next_transition(now))
+            elif phase == PRE_OPEN:
+                # The next boundary is the opening minute; warm the connections shortly before it
+                opening_at = now + trading_session.seconds_until_next_transition(now)
+                prewarm_at = opening_at - opening_snapshot.prewarm_lead
+                if prewarmed_for != round(opening_at):
+                    if now >= prewarm_at:
+                        prewarmed_for = round(opening_at)
+                        # Never let a slow host hold the scheduler past the boundary
+                        await opening_snapshot.prewarm(users.users, timeout=max(0.5, opening_at - time.time() - 0.5))
+                        continue
+                    target = prewarm_at
+                else:
+                    target = opening_at
+            else:
+                # Nothing to poll until the next phase boundary
+                target = now + trading_session.seconds_until_next_transition(now)
+            
+            await sleep_until(target, stop)
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in background scheduler: {str(e)}", exc_info=True)
+            # Sleep longer on error to prevent spam
+            await sleep_until(time.time() + 10, stop, max_step=10)
     
-    task.add_done_callback(cleanup_task)
+    logger.info("Background scheduler stopped")
+
+def _start_scheduler_task():
+    """Create the scheduler task in the running (server) event loop."""
+    global scheduler_task, scheduler_loop, scheduler_stop
+    if scheduler_task is not None and not scheduler_task.done():
+        return
+    scheduler_loop = asyncio.get_running_loop()
+    scheduler_stop = asyncio.Event()
+    scheduler_task = scheduler_loop.create_task(run_scheduler(scheduler_stop))
 
 # Optimized background scheduler function
 def start_background_scheduler():
-    """Start an optimized background scheduler with reduced resource usage."""
-    def run_scheduler():
-        logger.info("Starting optimized background scheduler")
-        last_opening_check = None
-        last_start_check = None
-        
-        while True:
-            try:
-                # Get current time
-                now = datetime.now()
-                current_time_str = now.strftime("%H:%M")
-                
-                # Get settings from users.json
-                users_data = get_user_data()
-                opening_hour = users_data.get("opening_mtm", "09:15")
-                start_time = users_data.get("start_time", "09:16")
-                
-                # Check if it's opening hour (only once per minute)
-                if current_time_str == opening_hour and last_opening_check != current_time_str:
-                    logger.info(f"It's opening hour: {opening_hour}")
-                    last_opening_check = current_time_str
-                    
-                    # Fetch for all users that haven't been fetched yet
-                    for user in users_data.get("users", []):
-                        user_id = user.get("userId")
-                        user_ip = user.get("ip")
-                        
-                        if user_id and user_ip and not is_opening_mtm_captured_db(user_id):
-                            logger.info(f"Scheduling background fetch for {user_id} at opening hour")
-                            schedule_background_fetch(user_id, user_ip)
-                
-                # Check if it's start time (only once per minute)
-                if current_time_str == start_time and last_start_check != current_time_str:
-                    logger.info(f"It's start time: {start_time}")
-                    last_start_check = current_time_str
-                    
-                    # Fetch for all users
-                    for user in users_data.get("users", []):
-                        user_id = user.get("userId")
-                        user_ip = user.get("ip")
-                        
-                        if user_id and user_ip:
-                            schedule_background_fetch(user_id, user_ip)
-                
-                # Regular fetching after start time (every 30 seconds instead of every second)
-                elif current_time_str > start_time and now.second % 30 == 0:
-                    # Fetch for all users every 30 seconds
-                    for user in users_data.get("users", []):
-                        user_id = user.get("userId")
-                        user_ip = user.get("ip")
-                        
-                        if user_id and user_ip:
-                            schedule_background_fetch(user_id, user_ip)
-                
-                # Sleep for 5 seconds instead of 1 second to reduce CPU usage
-                time.sleep(5)
-                
-            except Exception as e:
-                logger.error(f"Error in background scheduler: {str(e)}", exc_info=True)
-                # Sleep longer on error to prevent spam
-                time.sleep(10)
-    
-    # Start the scheduler in a separate thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
-    logger.info("Optimized background scheduler started in separate thread")
+    """Run the background scheduler as a task in the server's event loop.
+
+    Called before the server starts (no running loop), the task is started
+    by the application's startup event and stopped on shutdown, so polling
+    shares uvicorn's loop and keep-alive connections.
+    """
+    global _scheduler_hooks_added
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        if not _scheduler_hooks_added:
+            app.router.add_event_handler("startup", _start_scheduler_task)
+            app.router.add_event_handler("shutdown", stop_background_scheduler)
+            _scheduler_hooks_added = True
+        logger.info("Background scheduler will start with the server's event loop")
+        return
+    _start_scheduler_task()
+    logger.info("Background scheduler started in the running event loop")
+
+def start_background_scheduler_in(loop):
+    """Start the scheduler task in loop from any thread (a worker promoted to poller)."""
+    loop.call_soon_threadsafe(_start_scheduler_task)
+    logger.info("Background scheduler starting in this worker's event loop")
+
+def stop_background_scheduler():
+    """Stop the background scheduler (safe to call from any thread)."""
+    if scheduler_task is None or scheduler_task.done() or scheduler_loop.is_closed():
+        return
+    try:
+        scheduler_loop.call_soon_threadsafe(scheduler_stop.set)
+    except RuntimeError:
+        # Loop closed in the meantime
+        pass
 
 def cleanup_background_tasks():
     """Clean up background tasks on shutdown."""
-    global background_tasks
-    for task in background_tasks.values():
-        if not task.done():
-            task.cancel()
-    background_tasks.clear()
+    stop_background_scheduler()
     logger.info("Background tasks cleaned up")
 
 # Performance monitoring
 def get_background_stats():
     """Get background scheduler statistics."""
     return {
-        "active_tasks": len(background_tasks),
-        "task_details": {user_id: task.done() for user_id, task in background_tasks.items()}
+        "scheduler_running": scheduler_task is not None and not scheduler_task.done(),
+        **background_stats,
+        "interval": _poll_settings()[0],
+        "deadline": _poll_settings()[1],
+        "ticks": tick_stats.get_stats(),
+        "cadence": poll_cadence.get_stats(),
+        "opening": opening_snapshot.get_stats(),
+        "hosts": upstream_client.get_host_stats()
     }
 
-# Global scheduler instance
-background_scheduler = BackgroundScheduler()
-
-def start_background_scheduler():
-    """Start the background scheduler"""
-    try:
-        background_scheduler.start()
-    except Exception as e:
-        logger.error(f"Error starting background scheduler: {str(e)}", exc_info=True)
-
-def stop_background_scheduler():
-    """Stop the background scheduler"""
-    try:
-        background_scheduler.stop()
-    except Exception as e:
-        logger.error(f"Error stopping background scheduler: {str(e)}", exc_info=True)
-
-# Legacy async function for compatibility
-async def fetch_user_mtm_background(user_id: str, user_ip: str):
-    """Legacy async function for compatibility"""
-    try:
-        # Run the synchronous version in a thread pool
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            background_scheduler._executor,
-            background_scheduler._fetch_user_mtm,
-            user_id,
-            user_ip
-        )
-    except Exception as e:
-        logger.error(f"Error in async background fetch for {user_id}: {str(e)}", exc_info=True)
-
 # Cleanup function for application shutdown
 def cleanup_background():
     """Clean up background resources"""
@@ -237,4 +282,4 @@ def cleanup_background():
         stop_background_scheduler()
         logger.info("Background resources cleaned up")
     except Exception as e:
-        logger.error(f"Error cleaning up background resources: {str(e)}", exc_info=True) 
\ No newline at end of file
+        logger.error(f"Error cleaning up background resources: {str(e)}", exc_info=True)
@@ -0,0 +1,101 @@
+# mtm_bars.py
+# Incrementally maintained MTM OHLC bars per user
+
+from mtm_imports import *
+
+# Supported bar timeframes: /bars?tf=<name> -> bar length in seconds
+TIMEFRAMES = {"1m": 60, "5m": 300}
+
+class Bar:
+    """One open/high/low/close bar starting at epoch second `start`."""
+
+    __slots__ = ("start", "open", "high", "low", "close")
+
+    def __init__(self, start: int, value: float):
+        self.start = start
+        self.open = self.high = self.low = self.close = value
+
+    def update(self, value: float):
+        if value > self.high:
+            self.high = value
+        if value < self.low:
+            self.low = value
+        self.close = value
+
+    def to_dict(self, closed: bool = True):
+        return {
+            "start": self.start,
+            "time": time.strftime("%H:%M", time.localtime(self.start)),
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "closed": closed
+        }
+
+class BarEngine:
+    """Rolls MTM updates into per-user bars for every timeframe.
+
+    Only the current (open) bar of each user and timeframe is kept in memory;
+    each update is O(timeframes). When an update falls into a later bar, the
+    finished bar is handed to on_close(user_id, tf_seconds, bar) to be stored,
+    so reading bars never regroups raw history.
+    """
+
+    def __init__(self, timeframes=TIMEFRAMES, on_close=None):
+        self.timeframes = dict(timeframes)
+        self.on_close = on_close
+        self.bars_closed = 0
+        self._current = {}      # (user_id, tf_seconds) -> Bar
+        self._lock = threading.Lock()
+
+    def update(self, user_id: str, value: float, epoch: float = None):
+        epoch = time.time() if epoch is None else epoch
+        closed = []
+        with self._lock:
+            for seconds in self.timeframes.values():
+                start = int(epoch // seconds * seconds)
+                bar = self._current.get((user_id, seconds))
+                if bar is None or start > bar.start:
+                    if bar is not None:
+                        closed.append((seconds, bar))
+                    self._current[(user_id, seconds)] = Bar(start, value)
+                else:
+                    bar.update(value)
+        self._emit(user_id, closed)
+
+    def _emit(self, user_id: str, closed: list):
+        for seconds, bar in closed:
+            self.bars_closed += 1
+            if self.on_close is not None:
+                try:
+                    self.on_close(user_id, seconds, bar)
+                except Exception as e:
+                    logger.error(f"Failed to store {seconds}s bar for {user_id}: {str(e)}", exc_info=True)
+
+    def current_bar(self, user_id: str, seconds: int):
+        """The user's open bar for a timeframe, or None."""
+        with self._lock:
+            return self._current.get((user_id, seconds))
+
+    def flush(self, now: float = None, include_open: bool = False):
+        """Store every bar whose period has ended; include_open also stores the open ones (shutdown)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if include_open:
+                finished = list(self._current.items())
+            else:
+                finished = [(key, bar) for key, bar in self._current.items() if bar.start + key[1] <= now]
+            for key, _ in finished:
+                del self._current[key]
+        for (user_id, seconds), bar in finished:
+            self._emit(user_id, [(seconds, bar)])
+
+    def get_stats(self):
+        with self._lock:
+            open_bars = len(self._current)
+        return {
+            "timeframes": list(self.timeframes),
+            "open_bars": open_bars,
+            "bars_closed": self.bars_closed
+        }
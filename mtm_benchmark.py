@@ -0,0 +1,237 @@
+# mtm_benchmark.py
+# Benchmark script for the hub's upstream fetch path against stub client machines
+#
+# Usage: python mtm_benchmark.py
+# Starts local stub client machines (one of them slow) and reports p50/p99
+# latency for requests to the healthy hosts while the slow host is hanging.
+# Then measures event-loop lag while /MTM and /history style handlers read
+# from a scratch database, calling sqlite3 on the loop vs. via mtm_db_async.
+# Finally measures update throughput and read latency of the per-user state
+# with 100+ users updated concurrently, against the same calls behind one
+# global lock.
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from mtm_http import UpstreamClient
+
+SLOW_DELAY = 2.0      # Seconds the hung client machine takes to answer
+FAST_REQUESTS = 60    # Requests sent to the healthy client machines
+SLOW_REQUESTS = 4     # Requests sent to the hung client machine
+
+DB_USERS = 20             # Users seeded into the scratch database
+DB_HISTORY_POINTS = 3000  # History rows seeded per user
+DB_REQUESTS = 200         # Concurrent /MTM and /history requests (each)
+LAG_TICK = 0.005          # Interval of the loop-lag probe in seconds
+
+STATE_USERS = 200         # Users updated concurrently, one thread each
+STATE_UPDATES = 200       # Updates per user
+STATE_READERS = 4         # Threads reading every user's stats meanwhile
+
+def make_stub_handler(delay):
+    """Create a handler that mimics a client machine's /MTM endpoint."""
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            body = json.dumps({"status": "success", "response": 1234.5}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+def start_stub(delay):
+    """Start a stub client machine on a free port and return its host:port."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"127.0.0.1:{server.server_address[1]}"
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def report(name, latencies):
+    print(f"{name:<28} p50={percentile(latencies, 50) * 1000:8.1f}ms  "
+          f"p99={percentile(latencies, 99) * 1000:8.1f}ms  "
+          f"mean={statistics.mean(latencies) * 1000:8.1f}ms")
+
+async def timed(start, coro_fn, *args):
+    """Latency from when the dashboard issued the request until it was answered."""
+    try:
+        await coro_fn(*args)
+    except Exception:
+        pass
+    return time.perf_counter() - start
+
+async def run_scenario(fetch, fast_hosts, slow_host):
+    """Fire slow-host and fast-host requests together, return fast-host latencies."""
+    start = time.perf_counter()
+    slow = [asyncio.create_task(timed(start, fetch, f"SLOW{i}", slow_host)) for i in range(SLOW_REQUESTS)]
+    fast = [
+        asyncio.create_task(timed(start, fetch, f"USER{i}", fast_hosts[i % len(fast_hosts)]))
+        for i in range(FAST_REQUESTS)
+    ]
+    fast_latencies = await asyncio.gather(*fast)
+    await asyncio.gather(*slow)
+    return fast_latencies
+
+async def bench_upstream_fetch(fast_hosts, slow_host):
+    """Compare blocking requests.get inside the loop with the shared async client."""
+    async def blocking_fetch(user_id, host):
+        # What get_mtm used to do: a blocking call on the event loop
+        requests.get(f"http://{host}/MTM", params={"UserID": user_id}, timeout=10)
+
+    client = UpstreamClient(max_per_host=4, timeout=10.0)
+
+    async def async_fetch(user_id, host):
+        await client.fetch_mtm(user_id, host)
+
+    report("blocking requests.get", await run_scenario(blocking_fetch, fast_hosts, slow_host))
+    report("shared async client", await run_scenario(async_fetch, fast_hosts, slow_host))
+    await client.aclose()
+
+async def measure_loop_lag(load):
+    """Run load() while a probe sleeps LAG_TICK in a loop; return how late each wake-up was."""
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_TICK)
+            lags.append(max(0.0, time.perf_counter() - start - LAG_TICK))
+
+    probe_task = asyncio.create_task(probe())
+    await load()
+    done.set()
+    await probe_task
+    return lags
+
+async def bench_db_loop_lag():
+    """Compare loop lag with sqlite3 called on the loop and through the async facade."""
+    # Scratch database: mtm_db_stabilized opens mtm_dashboard.db in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="mtm_bench_"))
+    import mtm_db_stabilized as db
+    import mtm_db_async as adb
+
+    for u in range(DB_USERS):
+        db.set_opening_mtm(f"USER{u}", 100.0)
+        for i in range(DB_HISTORY_POINTS):
+            db.add_mtm_history(f"USER{u}", f"{9 + i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}", float(i))
+    db.write_queue.sync()
+
+    async def sync_mtm(user_id):
+        db.get_app_state("last_reset_date")
+        if db.is_opening_mtm_captured(user_id):
+            db.get_opening_mtm(user_id)
+
+    async def sync_history(user_id):
+        db.get_mtm_history_since(user_id)
+
+    async def async_mtm(user_id):
+        await adb.get_app_state("last_reset_date")
+        if await adb.is_opening_mtm_captured(user_id):
+            await adb.get_opening_mtm(user_id)
+
+    async def async_history(user_id):
+        await adb.get_mtm_history_since(user_id)
+
+    def load(mtm, history):
+        async def run():
+            await asyncio.gather(*(
+                handler(f"USER{i % DB_USERS}") for i in range(DB_REQUESTS) for handler in (mtm, history)
+            ))
+        return run
+
+    report("sqlite3 on the event loop", await measure_loop_lag(load(sync_mtm, sync_history)))
+    report("mtm_db_async thread pool", await measure_loop_lag(load(async_mtm, async_history)))
+    print(f"async facade: {adb.async_db.get_stats()}")
+
+def bench_user_state_throughput():
+    """Compare per-user locks with every update and read serialized behind one lock."""
+    if "mtm_db_stabilized" not in sys.modules:
+        os.chdir(tempfile.mkdtemp(prefix="mtm_bench_"))
+    import mtm_cache_stabilized as cache
+
+    global_lock = threading.Lock()
+
+    def locked(fn):
+        def call(*args):
+            with global_lock:
+                return fn(*args)
+        return call
+
+    def run(name, update, read):
+        user_ids = [f"{name[:1]}USER{u}" for u in range(STATE_USERS)]
+        read_latencies = []
+        done = threading.Event()
+
+        def reader():
+            while not done.is_set():
+                start = time.perf_counter()
+                for user_id in user_ids:
+                    read(user_id)
+                read_latencies.append(time.perf_counter() - start)
+
+        def writer(user_id):
+            for i in range(STATE_UPDATES):
+                update(user_id, float(i % 100 - 50))
+
+        for user_id in user_ids:
+            cache.init_user_stats(user_id)
+        readers = [threading.Thread(target=reader) for _ in range(STATE_READERS)]
+        writers = [threading.Thread(target=writer, args=(user_id,)) for user_id in user_ids]
+        for thread in readers:
+            thread.start()
+        start = time.perf_counter()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        print(f"{name:<28} {STATE_USERS * STATE_UPDATES / elapsed:10.0f} updates/s")
+        report(f"{name} (read all users)", read_latencies)
+
+    run("global lock", locked(cache.update_user_stats), locked(cache.get_cached_data))
+    run("per-user locks", cache.update_user_stats, cache.get_cached_data)
+    print(f"user states: {cache.user_states.get_stats()}")
+
+def main():
+    fast_hosts = [start_stub(0.005) for _ in range(3)]
+    slow_host = start_stub(SLOW_DELAY)
+    print(f"Healthy hosts: {len(fast_hosts)}, hung host delay: {SLOW_DELAY}s")
+
+    print("\n== Upstream fetch latency for healthy hosts while one host hangs ==")
+    asyncio.run(bench_upstream_fetch(fast_hosts, slow_host))
+
+    print(f"\n== Event-loop lag under {DB_REQUESTS} concurrent /MTM + /history database reads ==")
+    asyncio.run(bench_db_loop_lag())
+
+    print(f"\n== Stats updates for {STATE_USERS} users with {STATE_READERS} concurrent readers ==")
+    bench_user_state_throughput()
+
+if __name__ == "__main__":
+    main()
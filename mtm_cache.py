@@ -6,10 +6,14 @@ from mtm_db import (
     get_user_stats, update_user_stats_db, add_mtm_history,
     get_app_state, set_app_state, clear_history_db, reset_all_stats_db,
     get_opening_mtm as get_opening_mtm_db,
+    get_all_opening_mtm as get_all_opening_mtm_db,
     set_opening_mtm as set_opening_mtm_db,
     is_opening_mtm_captured as is_opening_mtm_captured_db,
     reset_opening_mtm_db
 )
+from mtm_stream import SnapshotStream
+from mtm_users import user_registry
+from mtm_session import trading_session, LIVE, CLOSED
 
 # In-memory cache for recent data and frequently accessed information
 mtm_cache = {
@@ -66,6 +70,9 @@ def update_user_stats(user_id: str, mtm_value: float):
             mtm_cache["time_markers"][user_id] = {}
         mtm_cache["time_markers"][user_id][time_key] = True
         logger.info(f"Added history point for {user_id} at {ts}: {mtm_value}")
+    
+    # Push the change to /stream subscribers
+    mtm_stream.notify()
 
 def check_daily_reset():
     """Check if the date has changed and reset data if necessary."""
@@ -88,11 +95,60 @@ def check_daily_reset():
         mtm_cache["opening_mtm"] = {}
         mtm_cache["opening_hour_hit"] = {}
         mtm_cache["time_markers"] = {}
+        mtm_stream.notify()
         
         logger.info("Daily reset complete.")
         return True
     return False
 
+def _finite(value):
+    """Replace the +/-inf placeholders of untouched stats with 0 for JSON."""
+    return value if value not in (float('inf'), -float('inf')) else 0
+
+def get_mtm_snapshot():
+    """Build one consolidated snapshot of every user's current/max/min/opening MTM."""
+    check_daily_reset()
+    users = user_registry.current()
+    
+    # Before start time /MTM reports zeros, so the snapshot does the same
+    now = datetime.now()
+    is_live = trading_session.phase() in (LIVE, CLOSED)
+    
+    opening_by_user = get_all_opening_mtm_db()
+    
+    snapshot = {}
+    for user_id in users.index:
+        stats = mtm_cache["stats"].get(user_id) if is_live else None
+        snapshot[user_id] = {
+            "status": "success",
+            "response": _finite(stats["current_mtm"]) if stats else 0,
+            "max_mtm": _finite(stats["max_mtm"]) if stats else 0,
+            "min_mtm": _finite(stats["min_mtm"]) if stats else 0,
+            "opening_mtm": opening_by_user.get(user_id, 0)
+        }
+    
+    return {"status": "success", "timestamp": now.strftime("%H:%M:%S"), "users": snapshot}
+
+# Consolidated snapshot stream for the /stream and /MTM/all endpoints
+mtm_stream = SnapshotStream(get_mtm_snapshot, source_version=lambda: user_registry.current().version)
+
+# Phase changes (e.g. start time) change what the snapshot reports
+trading_session.on_transition(lambda old_phase, new_phase: mtm_stream.notify())
+
+def get_mtm_batch(user_ids=None):
+    """Return the shared snapshot, optionally narrowed to a subset of users."""
+    check_daily_reset()
+    snapshot = mtm_stream.snapshot()
+    if not user_ids:
+        return snapshot
+    users = snapshot["users"]
+    return {
+        "status": "success",
+        "timestamp": snapshot["timestamp"],
+        "users": {user_id: users[user_id] for user_id in user_ids if user_id in users},
+        "missing": [user_id for user_id in user_ids if user_id not in users]
+    }
+
 def load_from_db():
     """Load necessary data from the database into the in-memory cache on startup."""
     # The cache is loaded on-demand by init_user_stats and other functions.
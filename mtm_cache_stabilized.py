@@ -7,168 +7,561 @@ from collections import OrderedDict
 from mtm_imports import *
 from mtm_db_stabilized import (
     get_user_stats, update_user_stats_db, add_mtm_history,
-    get_app_state, set_app_state, clear_history_db, reset_all_stats_db,
+    get_app_state, get_all_app_state, set_app_state, clear_history_db, reset_all_stats_db,
     get_opening_mtm as get_opening_mtm_db,
+    get_all_opening_mtm as get_all_opening_mtm_db,
+    get_all_opening_mtm_state as get_all_opening_mtm_state_db,
     set_opening_mtm as set_opening_mtm_db,
     is_opening_mtm_captured as is_opening_mtm_captured_db,
-    reset_opening_mtm_db
+    reset_opening_mtm_db,
+    save_mtm_bar, get_mtm_bars as get_mtm_bars_db
 )
+from mtm_db_stabilized import get_last_history_marker, get_all_user_stats, get_history_summary, write_queue
+from mtm_db_stabilized import (
+    publish_live_state as publish_live_state_db, get_live_state as get_live_state_db,
+    touch_poll_demand, get_poll_demand_since, refresh_history_partitions
+)
+from mtm_bars import BarEngine, TIMEFRAMES
+from mtm_user_state import UserStateStore
+# Record kinds are aliased: OPENING is also the session phase star-imported by the apps
+from mtm_journal import TickJournal, JOURNAL_FILE, TICK as TICK_RECORD, OPENING as OPENING_RECORD, HISTORY as HISTORY_RECORD
+from mtm_config import config
+from mtm_stream import SnapshotStream
+from mtm_users import user_registry
+from mtm_session import trading_session, LIVE, CLOSED
+from mtm_db_async import async_db
+from mtm_cadence import poll_cadence
+from mtm_workers import hub_worker
+
+# Every sample is journaled before it is acknowledged; SQLite catches up on compaction
+tick_journal = TickJournal(JOURNAL_FILE, capacity=config.get("journal_capacity", 262144))
+
+class StateCache:
+    """Write-through cache of opening MTM, captured flags and app state.
+
+    These values change a few times a day, so they are loaded from the
+    database once (hydrate) and afterwards only changed through this cache's
+    setters, which write the database and update memory together. Reads
+    never touch SQLite: a key missing after hydration is known to be absent.
+    """
+
+    def __init__(self):
+        self.opening_mtm = {}   # user_id -> float
+        self.captured = set()   # user_ids whose opening MTM was captured today
+        self.app_state = {}     # key -> str, as stored in app_state
+        self.hydrated = False
+        self.hits = 0
+        self.misses = 0         # Reads of keys not present (answered with the default)
+        self.loads = 0          # Database hydrations
+        self._lock = threading.Lock()
+
+    def hydrate(self):
+        """(Re)load every cached key from the database."""
+        opening = get_all_opening_mtm_state_db()
+        app_state = get_all_app_state()
+        with self._lock:
+            self.opening_mtm = {user_id: float(mtm) for user_id, (mtm, _) in opening.items()}
+            self.captured = {user_id for user_id, (_, captured) in opening.items() if captured}
+            self.app_state = dict(app_state)
+            self.hydrated = True
+            self.loads += 1
+        for state in user_states.all():
+            with state.lock:
+                state.opening_mtm = self.opening_mtm.get(state.user_id, 0.0)
+        logger.info(f"State cache hydrated: {len(opening)} opening MTM values, {len(app_state)} app state keys")
+
+    def _read(self, table: dict, key, default):
+        if not self.hydrated:
+            self.hydrate()
+        with self._lock:
+            if key in table:
+                self.hits += 1
+                return table[key]
+            self.misses += 1
+            return default
+
+    def get_opening_mtm(self, user_id: str) -> float:
+        return self._read(self.opening_mtm, user_id, 0)
+
+    def get_all_opening_mtm(self) -> dict:
+        if not self.hydrated:
+            self.hydrate()
+        with self._lock:
+            self.hits += 1
+            return dict(self.opening_mtm)
+
+    def is_opening_mtm_captured(self, user_id: str) -> bool:
+        if not self.hydrated:
+            self.hydrate()
+        with self._lock:
+            if user_id in self.captured:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def set_opening_mtm(self, user_id: str, mtm: float):
+        state = user_states.get_or_create(user_id)
+        # Under the user's lock a journal compaction cannot fall between the two writes
+        with state.lock:
+            tick_journal.append(OPENING_RECORD, user_id, mtm)
+            set_opening_mtm_db(user_id, mtm)
+            state.opening_mtm = float(mtm)
+        with self._lock:
+            self.opening_mtm[user_id] = float(mtm)
+            self.captured.add(user_id)
+
+    def mirror_opening_mtm(self, opening: dict, captured: set):
+        """Replace the opening values with the poller's (reader workers, which never write them)."""
+        with self._lock:
+            self.opening_mtm = dict(opening)
+            self.captured = set(captured)
+            self.hydrated = True
+
+    def reset_opening_mtm(self):
+        reset_opening_mtm_db()
+        with self._lock:
+            self.opening_mtm = {}
+            self.captured = set()
+        for state in user_states.all():
+            with state.lock:
+                state.opening_mtm = 0.0
+
+    def get_app_state(self, key: str, default=None):
+        return self._read(self.app_state, key, default)
+
+    def set_app_state(self, key: str, value):
+        set_app_state(key, value)
+        with self._lock:
+            self.app_state[key] = str(value)
+
+    def get_stats(self):
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                "hydrated": self.hydrated,
+                "opening_mtm_values": len(self.opening_mtm),
+                "captured": len(self.captured),
+                "app_state_keys": len(self.app_state),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / reads, 3) if reads else 0,
+                "loads": self.loads
+            }
+
+# Global cache for opening MTM and app state
+state_cache = StateCache()
 
-# Optimized in-memory cache with better performance
-mtm_cache = {
-    "last_updated": {},      # Track last update time for API caching
-    "cache_ttl": 5.0,        # Increased to 5 seconds for better performance
-    "data": {},              # Cache for raw API responses from clients
-    "stats": {},             # In-memory copy of stats for quick access
-    "opening_mtm": {},       # In-memory copy of opening MTM values
-    "opening_hour_hit": {},  # Track if opening hour fetch has been done for a user
-    "time_markers": {},      # To avoid duplicate history entries for the same time interval
-    "batch_updates": {},     # Batch database updates
-    "last_batch_time": 0,    # Last batch update time
-    "batch_interval": 10     # Batch updates every 10 seconds
-}
-
-# Thread-safe lock for cache operations
-cache_lock = threading.Lock()
+def _load_user_state(user_id: str):
+    """Stored stats and opening MTM of a user seen for the first time since startup."""
+    return get_user_stats(user_id), state_cache.get_opening_mtm(user_id)
+
+# Live per-user state: current/max/min/opening MTM and the last raw response
+user_states = UserStateStore(_load_user_state, cache_ttl=config.get("cache_ttl", 5.0))
+
+# Per-minute and per-5-minute MTM bars; completed bars go to the mtm_bars table
+bar_engine = BarEngine(
+    TIMEFRAMES,
+    on_close=lambda user_id, seconds, bar: save_mtm_bar(user_id, seconds, bar.start, bar.open, bar.high, bar.low, bar.close)
+)
 
 def init_user_stats(user_id: str):
-    """Initialize user stats in both cache and database if not present."""
-    with cache_lock:
-        if user_id not in mtm_cache["stats"]:
-            # Try to load from DB first
-            stats = get_user_stats(user_id)
-            if stats:
-                mtm_cache["stats"][user_id] = stats
-            else:
-                # Not in DB, so initialize
-                mtm_cache["stats"][user_id] = {
-                    "max_mtm": -float('inf'),
-                    "min_mtm": float('inf'),
-                    "current_mtm": 0
-                }
-                # Also add to DB
-                update_user_stats_db(user_id, 0, -float('inf'), float('inf'))
+    """Load a user's state from the database if it is not in memory yet; returns the UserState.
+
+    A user with no stored stats starts dirty, so the next batch creates the row.
+    """
+    return user_states.get_or_create(user_id)
 
 def update_user_stats(user_id: str, mtm_value: float):
     """Update user stats in cache and queue for batch database update."""
-    with cache_lock:
-        init_user_stats(user_id)
-        
-        stats = mtm_cache["stats"][user_id]
-        stats["current_mtm"] = mtm_value
-        
-        if mtm_value > stats["max_mtm"]:
-            stats["max_mtm"] = mtm_value
-        if mtm_value < stats["min_mtm"]:
-            stats["min_mtm"] = mtm_value
-        
-        # Queue for batch update instead of immediate DB write
-        mtm_cache["batch_updates"][user_id] = {
-            "current_mtm": stats["current_mtm"],
-            "max_mtm": stats["max_mtm"],
-            "min_mtm": stats["min_mtm"]
-        }
+    state = init_user_stats(user_id)
+    
+    # Only this user's lock is held: other users update in parallel
+    with state.lock:
+        tick_journal.append(TICK_RECORD, user_id, mtm_value)
+        state.update(mtm_value)
         
         # Append to history in the database (only every 30 seconds)
         now = datetime.now()
         current_time = now.strftime("%H:%M:%S")
-        time_key = current_time[:6] + ("00" if int(current_time[6:]) < 30 else "30")
+        time_key = _time_key(current_time)
         
-        if mtm_cache["time_markers"].get(user_id, {}).get(time_key) is not True:
-            ts = now.strftime("%H:%M:%S")
-            add_mtm_history(user_id, ts, mtm_value)
-            if user_id not in mtm_cache["time_markers"]:
-                mtm_cache["time_markers"][user_id] = {}
-            mtm_cache["time_markers"][user_id][time_key] = True
-            logger.debug(f"Added history point for {user_id} at {ts}: {mtm_value}")
+        if state.time_key != time_key:
+            tick_journal.append(HISTORY_RECORD, user_id, mtm_value, now.timestamp())
+            add_mtm_history(user_id, current_time, mtm_value)
+            state.time_key = time_key
+            logger.debug(f"Added history point for {user_id} at {current_time}: {mtm_value}")
+    
+    # Roll the value into the user's open bars
+    bar_engine.update(user_id, mtm_value)
+    
+    # Push the change to /stream subscribers
+    mtm_stream.notify()
+
+def _write_batch_updates():
+    """Queue the stats of every user changed since the last batch for the database."""
+    changed = user_states.collect_dirty()
+    for user_id, stats in changed.items():
+        update_user_stats_db(
+            user_id, 
+            stats["current_mtm"], 
+            stats["max_mtm"], 
+            stats["min_mtm"]
+        )
+    
+    user_states.last_batch_time = time.time()
+    logger.debug(f"Processed batch updates for {len(changed)} users")
 
 def process_batch_updates():
     """Process batched database updates to reduce I/O."""
-    with cache_lock:
-        if not mtm_cache["batch_updates"]:
-            return
-        
-        current_time = time.time()
-        if current_time - mtm_cache["last_batch_time"] < mtm_cache["batch_interval"]:
-            return
-        
-        # Process all batched updates
-        for user_id, stats in mtm_cache["batch_updates"].items():
-            update_user_stats_db(
-                user_id, 
-                stats["current_mtm"], 
-                stats["max_mtm"], 
-                stats["min_mtm"]
-            )
-        
-        # Clear batch updates
-        mtm_cache["batch_updates"] = {}
-        mtm_cache["last_batch_time"] = current_time
-        logger.debug(f"Processed batch updates for {len(mtm_cache['batch_updates'])} users")
+    if time.time() - user_states.last_batch_time < user_states.batch_interval:
+        return
+    
+    # Process all batched updates
+    _write_batch_updates()
+
+def compact_journal():
+    """Move the journaled samples into SQLite and drop them from the journal."""
+    # Records are appended under their user's lock together with the state
+    # change, and collecting the batch takes each lock after this read, so
+    # every record before the cut is covered by these writes
+    cut = tick_journal.count
+    _write_batch_updates()
+    if write_queue.sync(timeout=30.0):
+        tick_journal.compact(cut)
+    else:
+        logger.warning("Database writes still pending; journal compaction postponed.")
+
+def replay_journal():
+    """Rebuild today's stats, opening MTM and history from the journal after a restart.
+
+    The journal holds every sample since the last compaction, including any
+    the database had not committed when the hub stopped.
+    """
+    started = time.perf_counter()
+    records = tick_journal.records()
+    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    
+    ticks = {}      # user_id -> (current, max, min)
+    openings = {}   # user_id -> opening MTM
+    history = {}    # user_id -> [(epoch, mtm)]
+    for kind, user_id, epoch, mtm in records:
+        if epoch < today_start:
+            continue    # Before the daily reset
+        if kind == TICK_RECORD:
+            current, high, low = ticks.get(user_id, (mtm, mtm, mtm))
+            ticks[user_id] = (mtm, max(high, mtm), min(low, mtm))
+        elif kind == OPENING_RECORD:
+            openings[user_id] = mtm
+        elif kind == HISTORY_RECORD:
+            history.setdefault(user_id, []).append((epoch, mtm))
+    
+    for user_id, mtm in openings.items():
+        if state_cache.get_opening_mtm(user_id) != mtm or not state_cache.is_opening_mtm_captured(user_id):
+            state_cache.set_opening_mtm(user_id, mtm)
+    
+    for user_id, (current, high, low) in ticks.items():
+        state = user_states.get_or_create(user_id)
+        with state.lock:
+            state.update(current)
+            state.max_mtm = max(state.max_mtm, high)
+            state.min_mtm = min(state.min_mtm, low)
+    
+    for user_id, points in history.items():
+        # Only points the database does not have yet are written again
+        marker = get_last_history_marker(user_id)
+        last_stored = marker[0][-8:] if marker else ""
+        state = user_states.get_or_create(user_id)
+        with state.lock:
+            for epoch, mtm in points:
+                ts = time.strftime("%H:%M:%S", time.localtime(epoch))
+                if ts > last_stored:
+                    add_mtm_history(user_id, ts, mtm)
+            state.time_key = _time_key(ts)
+    
+    if records:
+        logger.info(f"Replayed {len(records)} journal records for {len(ticks)} users "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
 
 def check_daily_reset():
     """Check if the date has changed and reset data if necessary."""
+    if not hub_worker.is_poller:
+        # The poller resets the shared state; readers pick the reset up from it
+        return False
     current_date = datetime.now().strftime("%Y-%m-%d")
-    last_reset_date = get_app_state("last_reset_date", default=current_date)
+    last_reset_date = state_cache.get_app_state("last_reset_date", default=current_date)
     
     if current_date != last_reset_date:
         logger.info(f"Performing daily stats reset. Last reset: {last_reset_date}, Current date: {current_date}")
         
+        # Store yesterday's last bars before the reset
+        bar_engine.flush()
+        
         # Reset data in the database
         reset_all_stats_db()
         clear_history_db()
-        reset_opening_mtm_db()
+        state_cache.reset_opening_mtm()
         
         # Update the reset date in the database
-        set_app_state("last_reset_date", current_date)
+        state_cache.set_app_state("last_reset_date", current_date)
         
-        # Clear in-memory caches
-        with cache_lock:
-            mtm_cache["stats"] = {}
-            mtm_cache["opening_mtm"] = {}
-            mtm_cache["opening_hour_hit"] = {}
-            mtm_cache["time_markers"] = {}
-            mtm_cache["batch_updates"] = {}
+        # Reset in-memory state in place, so concurrent updates are not lost
+        for state in user_states.all():
+            with state.lock:
+                state.reset()
+        mtm_stream.notify()
         
         logger.info("Daily reset complete.")
         return True
     return False
 
+async def check_daily_reset_async():
+    """check_daily_reset() for request handlers; only an actual reset runs on the database thread pool."""
+    if not hub_worker.is_poller:
+        return False
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    if state_cache.get_app_state("last_reset_date", default=current_date) == current_date:
+        return False
+    return await async_db.run(check_daily_reset)
+
 def get_cached_data(user_id: str):
-    """Get cached data with thread safety."""
-    with cache_lock:
-        return {
-            "data": mtm_cache["data"].get(user_id),
-            "last_updated": mtm_cache["last_updated"].get(user_id),
-            "stats": mtm_cache["stats"].get(user_id)
-        }
+    """Get one consistent copy of a user's raw response and stats (stats is None for an unknown user)."""
+    state = user_states.get(user_id)
+    if state is None:
+        return {"data": None, "last_updated": None, "stats": None}
+    snapshot = state.snapshot()
+    return {
+        "data": snapshot["raw"],
+        "last_updated": snapshot["last_updated"],
+        "stats": {key: snapshot[key] for key in ("current_mtm", "max_mtm", "min_mtm")}
+    }
 
 def set_cached_data(user_id: str, data: str, stats: dict = None):
-    """Set cached data with thread safety."""
-    with cache_lock:
-        mtm_cache["data"][user_id] = data
-        mtm_cache["last_updated"][user_id] = time.time()
+    """Store a user's raw client response, and optionally replace the stats."""
+    state = user_states.get_or_create(user_id)
+    with state.lock:
+        state.raw = data
+        state.last_updated = time.time()
         if stats:
-            mtm_cache["stats"][user_id] = stats
+            state.current_mtm = stats["current_mtm"]
+            state.max_mtm = stats["max_mtm"]
+            state.min_mtm = stats["min_mtm"]
+            state.dirty = True
 
 def is_cache_valid(user_id: str):
     """Check if cache is valid for a user."""
-    with cache_lock:
-        if user_id not in mtm_cache["last_updated"]:
-            return False
-        return time.time() - mtm_cache["last_updated"][user_id] < mtm_cache["cache_ttl"]
+    state = user_states.get(user_id)
+    last_updated = state.last_updated if state else None
+    return last_updated is not None and time.time() - last_updated < user_states.cache_ttl
+
+def _finite(value):
+    """Replace the +/-inf placeholders of untouched stats with 0 for JSON."""
+    return value if value not in (float('inf'), -float('inf')) else 0
+
+def get_mtm_snapshot():
+    """Build one consolidated snapshot of every user's current/max/min/opening MTM."""
+    check_daily_reset()
+    users = user_registry.current()
+    
+    # Before start time /MTM reports zeros, so the snapshot does the same
+    now = datetime.now()
+    is_live = trading_session.phase() in (LIVE, CLOSED)
+    
+    snapshot = {}
+    for user_id in users.index:
+        # Each user's values are read together under that user's lock only
+        state = user_states.get(user_id)
+        stats = state.snapshot() if state else None
+        opening_mtm = stats["opening_mtm"] if stats else state_cache.get_opening_mtm(user_id)
+        if not is_live:
+            stats = None
+        snapshot[user_id] = {
+            "status": "success",
+            "response": _finite(stats["current_mtm"]) if stats else 0,
+            "max_mtm": _finite(stats["max_mtm"]) if stats else 0,
+            "min_mtm": _finite(stats["min_mtm"]) if stats else 0,
+            "opening_mtm": opening_mtm
+        }
+    
+    return {"status": "success", "timestamp": now.strftime("%H:%M:%S"), "users": snapshot}
+
+# Consolidated snapshot stream for the /stream and /MTM/all endpoints
+mtm_stream = SnapshotStream(get_mtm_snapshot, source_version=lambda: user_registry.current().version)
+
+# Phase changes (e.g. start time) change what the snapshot reports
+trading_session.on_transition(lambda old_phase, new_phase: mtm_stream.notify())
+
+def get_mtm_batch(user_ids=None):
+    """Return the shared snapshot, optionally narrowed to a subset of users."""
+    check_daily_reset()
+    snapshot = mtm_stream.snapshot()
+    if not user_ids:
+        return snapshot
+    users = snapshot["users"]
+    return {
+        "status": "success",
+        "timestamp": snapshot["timestamp"],
+        "users": {user_id: users[user_id] for user_id in user_ids if user_id in users},
+        "missing": [user_id for user_id in user_ids if user_id not in users]
+    }
+
+def get_mtm_bars(user_id: str, tf: str, day: str = None):
+    """Return a user's bars for one day, oldest first, ending with the open bar if it is that day's.
+
+    Completed bars come from one primary-key range scan of mtm_bars, so the
+    cost is proportional to the number of bars returned.
+    """
+    seconds = TIMEFRAMES[tf]
+    day_start = datetime.strptime(day, "%Y-%m-%d") if day else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_from = int(day_start.timestamp())
+    start_to = start_from + 86400
+    
+    bars = [
+        {"start": start, "time": time.strftime("%H:%M", time.localtime(start)),
+         "open": open_, "high": high, "low": low, "close": close, "closed": True}
+        for start, open_, high, low, close in get_mtm_bars_db(user_id, seconds, start_from, start_to)
+    ]
+    current = bar_engine.current_bar(user_id, seconds)
+    if current is not None and start_from <= current.start < start_to:
+        if bars and bars[-1]["start"] == current.start:
+            bars.pop()
+        bars.append(current.to_dict(closed=False))
+    return bars
+
+def _time_key(timestamp: str):
+    """The 30-second history marker an "HH:MM:SS" timestamp falls in."""
+    return timestamp[:6] + ("00" if int(timestamp[6:8]) < 30 else "30")
 
 def load_from_db():
-    """Load necessary data from the database into the in-memory cache on startup."""
-    logger.info("Data will be loaded from the database on demand.")
+    """Load necessary data from the database into the in-memory cache on startup.
+
+    Stats, opening MTM, app state and a summary of today's history for every
+    user come from a handful of set-based queries, so the first dashboard
+    requests after a restart are answered from memory. Max/min are widened
+    by today's stored history, which may be newer than the last batched
+    user_stats write.
+    """
+    started = time.perf_counter()
+    state_cache.hydrate()
+    check_daily_reset()
+    
+    stored_stats = get_all_user_stats()
+    summary = get_history_summary()
+    registered = user_registry.current().index
+    
+    for user_id in set(registered) | set(stored_stats) | set(summary):
+        stats = dict(stored_stats.get(user_id) or {
+            "max_mtm": -float('inf'), "min_mtm": float('inf'), "current_mtm": 0
+        })
+        tail = summary.get(user_id)
+        if tail:
+            stats["max_mtm"] = max(stats["max_mtm"], tail["max"])
+            stats["min_mtm"] = min(stats["min_mtm"], tail["min"])
+            if user_id not in stored_stats:
+                stats["current_mtm"] = tail["last_mtm"]
+        state = user_states.get_or_create(user_id, stats)
+        with state.lock:
+            state.opening_mtm = state_cache.get_opening_mtm(user_id)
+            if tail:
+                # The current 30-second marker is already stored
+                state.time_key = _time_key(tail["last_timestamp"][-8:])
+    
+    logger.info(f"Warm start: loaded {len(stored_stats)} user stats and today's history summary for "
+                f"{len(summary)} users in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def cleanup_cache():
+    """Queue every pending stats change for the database on shutdown."""
+    _write_batch_updates()
+    logger.info(f"Cache cleaned up: {len(user_states)} user states written")
+
+# --- State shared between the workers of a multi-worker hub ---
+
+_published = {}         # user_id -> live_state row last published by this worker
+_demand_seq = 0         # Last poll_demand seq the poller has applied
+_demand_sent = {}       # user_id -> last dashboard request time a reader reported
+
+def publish_live_state():
+    """Write every user whose live state changed since the last call to live_state (poller)."""
+    with state_cache._lock:
+        captured = set(state_cache.captured)
+    rows = []
+    for state in user_states.all():
+        snapshot = state.snapshot()
+        row = (state.user_id, snapshot["current_mtm"], snapshot["max_mtm"], snapshot["min_mtm"],
+               snapshot["opening_mtm"], int(state.user_id in captured), snapshot["raw"], snapshot["last_updated"])
+        if _published.get(state.user_id) != row:
+            rows.append(row)
+            _published[state.user_id] = row
+    if rows:
+        publish_live_state_db(rows)
+    return len(rows)
+
+def apply_live_state():
+    """Refresh this worker's copy of every user's live state from live_state (readers)."""
+    rows = get_live_state_db()
+    changed = 0
+    for user_id, row in rows.items():
+        state = user_states.get_or_create(user_id, row)
+        values = (row["current_mtm"], row["max_mtm"], row["min_mtm"], row["opening_mtm"], row["raw"], row["last_updated"])
+        with state.lock:
+            if (state.current_mtm, state.max_mtm, state.min_mtm, state.opening_mtm, state.raw, state.last_updated) != values:
+                (state.current_mtm, state.max_mtm, state.min_mtm,
+                 state.opening_mtm, state.raw, state.last_updated) = values
+                changed += 1
+            # Only the poller writes user_stats
+            state.dirty = False
+    state_cache.mirror_opening_mtm(
+        {user_id: row["opening_mtm"] for user_id, row in rows.items()},
+        {user_id for user_id, row in rows.items() if row["captured"]}
+    )
+    if changed:
+        mtm_stream.notify()
+    return changed
+
+def sync_hub_state():
+    """One exchange of a worker with the others, run every hub_sync_interval seconds.
+
+    The poller publishes the users that changed and folds in the dashboard
+    demand the readers saw, so viewed users are polled at the fastest
+    cadence whichever worker serves them. A reader refreshes its copy of
+    the live state and reports its own demand (each user at most every
+    quarter demand window).
+    """
+    global _demand_seq
+    if hub_worker.is_poller:
+        publish_live_state()
+        demand, _demand_seq = get_poll_demand_since(_demand_seq)
+        for user_id, at in demand.items():
+            poll_cadence.touch(user_id, at)
+        return
+    
+    apply_live_state()
+    # History day tables are created and dropped by the poller
+    refresh_history_partitions()
+    
+    now = time.time()
+    demand = poll_cadence.demand_since(now - poll_cadence.demand_window)
+    resend = poll_cadence.demand_window / 4
+    demand = {user_id: at for user_id, at in demand.items() if at - _demand_sent.get(user_id, float('-inf')) >= resend}
+    if demand:
+        touch_poll_demand(demand)
+        _demand_sent.update(demand)
 
 # Start background batch processor
 def start_batch_processor():
     """Start background thread to process batch updates."""
+    compact_interval = config.get("journal_compact_interval", 60.0)
+    
     def batch_worker():
+        last_compaction = time.time()
         while True:
             try:
                 process_batch_updates()
+                # Store bars whose minute ended without a newer update
+                bar_engine.flush()
+                if time.time() - last_compaction >= compact_interval:
+                    compact_journal()
+                    last_compaction = time.time()
                 time.sleep(1)  # Check every second
             except Exception as e:
                 logger.error(f"Error in batch processor: {str(e)}", exc_info=True)
@@ -178,5 +571,14 @@ def start_batch_processor():
     batch_thread.start()
     logger.info("Batch processor started")
 
-# Initialize batch processor
-start_batch_processor() 
\ No newline at end of file
+# In a multi-worker hub only the elected poller journals and writes, once
+# promoted (see start_hub_worker); a one-process hub starts here
+if not hub_worker.multi:
+    # Initialize batch processor
+    start_batch_processor()
+    
+    # Load stats, opening MTM and app state once; request paths read them from memory
+    load_from_db()
+    
+    # Recover the samples of a session interrupted since the last compaction
+    replay_journal() 
\ No newline at end of file
@@ -0,0 +1,146 @@
+# mtm_cadence.py
+# Adaptive per-user background polling intervals
+
+import math
+from mtm_imports import *
+from mtm_config import config
+
+class PollCadence:
+    """Per-user poll interval between min_interval and max_interval seconds.
+
+    A user is polled at min_interval while a dashboard is looking at it: a
+    /MTM or /history request for that user (alone or in a UserID subset)
+    within the last demand_window seconds. Unfiltered views (/stream, /MTM/all
+    without UserID) do not count, or one open dashboard would keep every user
+    at min_interval. Otherwise the interval shrinks
+    with the user's MTM volatility, an exponentially weighted average of
+    |change| per minute between polls: at volatility_threshold it is half of
+    max_interval, and a flat account relaxes to max_interval. Intervals are
+    whole multiples of min_interval, so every poll still falls on the
+    scheduler's aligned boundaries.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float,
+                 demand_window: float = 60.0, volatility_threshold: float = 500.0,
+                 smoothing: float = 0.3):
+        self.min_interval = max(1.0, min(min_interval, max_interval))
+        self.max_interval = max(self.min_interval, max_interval)
+        self.demand_window = demand_window
+        self.volatility_threshold = volatility_threshold
+        self.smoothing = smoothing
+        self.polls = 0
+        self.skipped = 0                    # Polls avoided versus polling everyone every min_interval
+        self._demand = {}                   # user_id -> last dashboard request
+        self._last = {}                     # user_id -> (epoch, mtm) of the last observed value
+        self._volatility = {}               # user_id -> smoothed |MTM change| per minute
+        self._polled = {}                   # user_id -> scheduled time of the last poll
+        self._lock = threading.Lock()
+
+    @property
+    def adaptive(self):
+        return self.max_interval > self.min_interval
+
+    def touch(self, user_id: str, now: float = None):
+        """Record that a dashboard asked for this user (callers pass only known users)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if now > self._demand.get(user_id, float('-inf')):
+                self._demand[user_id] = now
+
+    def _prune(self, now: float):
+        """Forget dashboard requests older than demand_window; called with _lock held."""
+        cutoff = now - self.demand_window
+        for user_id in [user_id for user_id, at in self._demand.items() if at < cutoff]:
+            del self._demand[user_id]
+
+    def demand_since(self, since: float):
+        """{user_id: time} of the dashboard requests recorded after since."""
+        with self._lock:
+            self._prune(time.time())
+            return {user_id: at for user_id, at in self._demand.items() if at > since}
+
+    def observe(self, user_id: str, mtm: float, now: float = None):
+        """Fold a freshly fetched MTM value into the user's volatility."""
+        now = time.time() if now is None else now
+        with self._lock:
+            last = self._last.get(user_id)
+            self._last[user_id] = (now, mtm)
+            if last is None or now <= last[0]:
+                return
+            rate = abs(mtm - last[1]) / (now - last[0]) * 60
+            previous = self._volatility.get(user_id)
+            self._volatility[user_id] = rate if previous is None else previous + self.smoothing * (rate - previous)
+
+    def _watched(self, user_id: str, now: float):
+        return now - self._demand.get(user_id, float('-inf')) <= self.demand_window
+
+    def interval(self, user_id: str, now: float = None):
+        """The user's current poll interval in seconds."""
+        now = time.time() if now is None else now
+        if not self.adaptive or self._watched(user_id, now):
+            return self.min_interval
+        volatility = self._volatility.get(user_id, 0.0)
+        interval = self.max_interval / (1 + volatility / self.volatility_threshold) if self.volatility_threshold > 0 else self.max_interval
+        steps = max(1, math.ceil(interval / self.min_interval - 1e-9))
+        return min(self.max_interval, steps * self.min_interval)
+
+    def due(self, users: list, scheduled: float):
+        """The users to poll at the tick scheduled for `scheduled`; marks them polled."""
+        due = []
+        with self._lock:
+            self._prune(scheduled)
+            for user in users:
+                user_id = user.get("userId")
+                last = self._polled.get(user_id)
+                # Half a step of slack absorbs rounding of the aligned boundaries
+                if last is None or scheduled - last >= self.interval(user_id, scheduled) - self.min_interval / 2:
+                    self._polled[user_id] = scheduled
+                    due.append(user)
+            self.polls += len(due)
+            self.skipped += len(users) - len(due)
+        return due
+
+    def mark_polled(self, users: list, scheduled: float):
+        """Record a poll of every user outside the cadence (e.g. at start time)."""
+        with self._lock:
+            for user in users:
+                self._polled[user.get("userId")] = scheduled
+            self.polls += len(users)
+
+    def reset(self):
+        """Forget volatility and poll times (daily reset)."""
+        with self._lock:
+            self._last = {}
+            self._volatility = {}
+            self._polled = {}
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            user_ids = set(self._polled) | set(self._volatility)
+            users = {
+                user_id: {
+                    "interval": self.interval(user_id, now),
+                    "watched": self._watched(user_id, now),
+                    "volatility_per_min": round(self._volatility.get(user_id, 0.0), 2)
+                }
+                for user_id in sorted(user_ids)
+            }
+            return {
+                "adaptive": self.adaptive,
+                "min_interval": self.min_interval,
+                "max_interval": self.max_interval,
+                "demand_window": self.demand_window,
+                "volatility_threshold": self.volatility_threshold,
+                "polls": self.polls,
+                "skipped": self.skipped,
+                "users": users
+            }
+
+# Global poll cadence; the slowest cadence is the configured background interval
+poll_cadence = PollCadence(
+    min_interval=config.get("poll_interval_min", 10),
+    max_interval=config.get("background_fetch_interval", 30),
+    demand_window=config.get("poll_demand_window", 60.0),
+    volatility_threshold=config.get("poll_volatility_threshold", 500.0)
+)
@@ -11,7 +11,29 @@ DEFAULT_CONFIG = {
     'chart_update_interval': 30000,      # 30 seconds
     'cache_ttl': 0.5,                    # 0.5 seconds
     'server_port': 8556,                 # Default port
-    'enable_background_scheduler': True  # Enable background scheduler
+    'enable_background_scheduler': True, # Enable background scheduler
+    'upstream_timeout': 5.0,             # Timeout for client machine requests (seconds)
+    'upstream_host_timeout': 10.0,       # Deadline for one poll of all users on a client machine (seconds)
+    'upstream_max_per_host': 4,          # Concurrent requests allowed per client machine
+    'history_max_points': 20000,         # Intraday history points kept per user (oldest are overwritten)
+    'history_max_age': 0.0,              # Drop intraday history older than this many seconds (0 = keep the whole day)
+    'db_flush_interval': 0.2,            # Group-commit queued database writes after this many idle seconds
+    'db_flush_max_latency': 1.0,         # Never hold a queued database write longer than this many seconds
+    'db_async_workers': 4,               # Threads running database calls for request handlers
+    'db_async_max_pending': 64,          # Database calls queued or running before handlers wait for a slot
+    'journal_capacity': 262144,          # Records preallocated in the tick journal (doubles when full)
+    'journal_compact_interval': 60.0,    # Seconds between moving journaled samples into SQLite
+    'background_fetch_interval': 30,     # Seconds between background polls while LIVE (aligned to the clock)
+    'background_poll_deadline': 20.0,    # Longest one background poll of all users may take (seconds)
+    'poll_interval_min': 10,             # Fastest per-user poll interval, for viewed or volatile users (seconds)
+    'poll_demand_window': 60.0,          # A user counts as viewed for this long after a dashboard request (seconds)
+    'poll_volatility_threshold': 500.0,  # MTM change per minute that halves a user's poll interval
+    'upstream_breaker_failures': 5,      # Consecutive failures that open a client machine's circuit
+    'upstream_breaker_reset': 30.0,      # Seconds a circuit stays open before a probe request is let through
+    'upstream_hedge': False,             # Resend requests still unanswered after the host's p95 latency
+    'opening_prewarm_lead': 5.0,         # Seconds before the opening minute that connections are pre-warmed
+    'hub_workers': 1,                    # Server processes; above 1, one elected worker polls and the rest serve shared state
+    'hub_sync_interval': 0.5             # Seconds between shared-state exchanges of a multi-worker hub
 }
 
 # Initialize empty config
@@ -41,7 +63,7 @@ def load_config():
             settings = parser['settings']
             
             # Parse integer values
-            for key in ['mtm_refresh_interval', 'chart_update_interval', 'server_port']:
+            for key in ['mtm_refresh_interval', 'chart_update_interval', 'server_port', 'upstream_max_per_host', 'history_max_points', 'db_async_workers', 'db_async_max_pending', 'journal_capacity', 'background_fetch_interval', 'poll_interval_min', 'upstream_breaker_failures', 'hub_workers']:
                 if key in settings:
                     try:
                         config[key] = int(settings[key])
@@ -49,21 +71,23 @@ def load_config():
                         logging.warning(f"Invalid value for {key} in config.ini. Using default: {config[key]}")
             
             # Parse float values
-            if 'cache_ttl' in settings:
-                try:
-                    config['cache_ttl'] = float(settings['cache_ttl'])
-                except ValueError:
-                    logging.warning(f"Invalid value for cache_ttl in config.ini. Using default: {config['cache_ttl']}")
+            for key in ['cache_ttl', 'upstream_timeout', 'upstream_host_timeout', 'history_max_age', 'db_flush_interval', 'db_flush_max_latency', 'journal_compact_interval', 'background_poll_deadline', 'poll_demand_window', 'poll_volatility_threshold', 'upstream_breaker_reset', 'opening_prewarm_lead', 'hub_sync_interval']:
+                if key in settings:
+                    try:
+                        config[key] = float(settings[key])
+                    except ValueError:
+                        logging.warning(f"Invalid value for {key} in config.ini. Using default: {config[key]}")
             
             # Parse boolean values
-            if 'enable_background_scheduler' in settings:
-                value = settings['enable_background_scheduler'].lower()
-                if value in ['true', 'yes', '1', 'on']:
-                    config['enable_background_scheduler'] = True
-                elif value in ['false', 'no', '0', 'off']:
-                    config['enable_background_scheduler'] = False
-                else:
-                    logging.warning(f"Invalid value for enable_background_scheduler in config.ini. Using default: {config['enable_background_scheduler']}")
+            for key in ['enable_background_scheduler', 'upstream_hedge']:
+                if key in settings:
+                    value = settings[key].lower()
+                    if value in ['true', 'yes', '1', 'on']:
+                        config[key] = True
+                    elif value in ['false', 'no', '0', 'off']:
+                        config[key] = False
+                    else:
+                        logging.warning(f"Invalid value for {key} in config.ini. Using default: {config[key]}")
         
         logging.info(f"Loaded configuration: {config}")
         return config
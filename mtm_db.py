@@ -59,6 +59,8 @@ def init_db():
     
     # Create an index on user_id and timestamp for faster history lookups
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_mtm_history_user_ts ON mtm_history (user_id, timestamp)")
+    # (user_id, id) serves /history?since= deltas without scanning the whole day
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mtm_history_user_id ON mtm_history (user_id, id)")
     
     # Create a table for opening MTM values
     cursor.execute("""
@@ -130,6 +132,25 @@ def get_mtm_history(user_id):
     rows = cursor.fetchall()
     return [{"timestamp": r['timestamp'], "mtm": r['mtm']} for r in rows]
 
+def get_mtm_history_since(user_id, after_id=0, until_id=None):
+    """Return (points, last_id) for a user's history rows with after_id < id <= until_id, oldest first."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT id, timestamp, mtm FROM mtm_history WHERE user_id = ? AND id > ? AND id <= ? ORDER BY id ASC",
+        (user_id, after_id, until_id if until_id is not None else 2**63 - 1)
+    )
+    rows = cursor.fetchall()
+    return [{"timestamp": r['timestamp'], "mtm": r['mtm']} for r in rows], (rows[-1]['id'] if rows else after_id)
+
+def get_last_history_marker(user_id):
+    """Return (timestamp, id) of a user's latest history row, or None; served from the (user_id, timestamp) index."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT timestamp, id FROM mtm_history WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1", (user_id,))
+    row = cursor.fetchone()
+    return (row['timestamp'], row['id']) if row else None
+
 def clear_history_db():
     db = get_db()
     cursor = db.cursor()
@@ -146,6 +167,13 @@ def get_opening_mtm(user_id):
     row = cursor.fetchone()
     return row['mtm'] if row else 0
 
+def get_all_opening_mtm():
+    """Return {user_id: opening MTM} for every user in one query."""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT user_id, mtm FROM opening_mtm")
+    return {r['user_id']: r['mtm'] for r in cursor.fetchall()}
+
 def set_opening_mtm(user_id, mtm):
     db = get_db()
     cursor = db.cursor()
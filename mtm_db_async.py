@@ -0,0 +1,168 @@
+# mtm_db_async.py
+# Async access to the pooled SQLite database for FastAPI handlers
+
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from mtm_imports import *
+from mtm_config import config
+
+class AsyncDatabase:
+    """Runs blocking database calls on a small dedicated thread pool.
+
+    Handlers await run() instead of calling sqlite3 on the event loop, so a
+    slow query or a lock wait only holds a database thread. The number of
+    calls queued or running is bounded by max_pending per event loop; past
+    that, callers wait on an asyncio semaphore (without blocking the loop),
+    so a burst of requests cannot pile up unbounded work behind the pool.
+    """
+
+    def __init__(self, max_workers=4, max_pending=64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-async")
+        self._slots = {}            # event loop -> Semaphore(max_pending)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "errors": 0,
+            "saturated_waits": 0,
+            "pending": 0,
+            "max_pending": 0,
+            "total_queue_ms": 0.0,
+            "max_queue_ms": 0.0,
+            "total_run_ms": 0.0,
+            "max_run_ms": 0.0
+        }
+
+    def _loop_slots(self):
+        """Semaphore bounding pending calls from the running loop."""
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            for old_loop in [l for l in self._slots if l.is_closed()]:
+                del self._slots[old_loop]
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_pending)
+        return slots
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) executed on the database thread pool."""
+        slots = self._loop_slots()
+        if slots.locked():
+            with self._stats_lock:
+                self.stats["saturated_waits"] += 1
+
+        async with slots:
+            submitted = time.perf_counter()
+            with self._stats_lock:
+                self.stats["calls"] += 1
+                self.stats["pending"] += 1
+                self.stats["max_pending"] = max(self.stats["max_pending"], self.stats["pending"])
+
+            def call():
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    queue_ms = (started - submitted) * 1000
+                    run_ms = (time.perf_counter() - started) * 1000
+                    with self._stats_lock:
+                        self.stats["total_queue_ms"] += queue_ms
+                        self.stats["max_queue_ms"] = max(self.stats["max_queue_ms"], queue_ms)
+                        self.stats["total_run_ms"] += run_ms
+                        self.stats["max_run_ms"] = max(self.stats["max_run_ms"], run_ms)
+
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+            except Exception:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                raise
+            finally:
+                with self._stats_lock:
+                    self.stats["pending"] -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        calls = stats["calls"]
+        return {
+            "workers": self.max_workers,
+            "max_pending_allowed": self.max_pending,
+            "calls": calls,
+            "errors": stats["errors"],
+            "saturated_waits": stats["saturated_waits"],
+            "pending": stats["pending"],
+            "max_pending": stats["max_pending"],
+            "avg_queue_ms": round(stats["total_queue_ms"] / calls, 2) if calls else 0,
+            "max_queue_ms": round(stats["max_queue_ms"], 2),
+            "avg_run_ms": round(stats["total_run_ms"] / calls, 2) if calls else 0,
+            "max_run_ms": round(stats["max_run_ms"], 2)
+        }
+
+# Global async database executor
+async_db = AsyncDatabase(
+    max_workers=config.get("db_async_workers", 4),
+    max_pending=config.get("db_async_max_pending", 64)
+)
+
+def _async_variant(name):
+    """Async version of mtm_db_stabilized.<name> that runs on async_db.
+
+    mtm_db_stabilized is imported on first use, not here: importing it
+    initializes its schema, and the legacy app shares these API modules
+    with its own mtm_db database.
+    """
+    async def wrapper(*args, **kwargs):
+        fn = getattr(importlib.import_module("mtm_db_stabilized"), name)
+        return await async_db.run(fn, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__qualname__ = name
+    wrapper.__doc__ = f"Async variant of mtm_db_stabilized.{name}()."
+    return wrapper
+
+# --- Async variants of mtm_db_stabilized ---
+
+init_db = _async_variant("init_db")
+
+get_app_state = _async_variant("get_app_state")
+get_all_app_state = _async_variant("get_all_app_state")
+set_app_state = _async_variant("set_app_state")
+
+get_user_stats = _async_variant("get_user_stats")
+get_all_user_stats = _async_variant("get_all_user_stats")
+update_user_stats_db = _async_variant("update_user_stats_db")
+reset_all_stats_db = _async_variant("reset_all_stats_db")
+
+get_history_partitions = _async_variant("get_history_partitions")
+refresh_history_partitions = _async_variant("refresh_history_partitions")
+add_mtm_history = _async_variant("add_mtm_history")
+get_mtm_history = _async_variant("get_mtm_history")
+get_mtm_history_since = _async_variant("get_mtm_history_since")
+get_last_history_marker = _async_variant("get_last_history_marker")
+get_mtm_history_range = _async_variant("get_mtm_history_range")
+get_history_summary = _async_variant("get_history_summary")
+clear_history_db = _async_variant("clear_history_db")
+cleanup_old_history = _async_variant("cleanup_old_history")
+
+get_opening_mtm = _async_variant("get_opening_mtm")
+get_all_opening_mtm = _async_variant("get_all_opening_mtm")
+get_all_opening_mtm_state = _async_variant("get_all_opening_mtm_state")
+set_opening_mtm = _async_variant("set_opening_mtm")
+is_opening_mtm_captured = _async_variant("is_opening_mtm_captured")
+reset_opening_mtm_db = _async_variant("reset_opening_mtm_db")
+
+save_mtm_bar = _async_variant("save_mtm_bar")
+get_mtm_bars = _async_variant("get_mtm_bars")
+cleanup_old_bars = _async_variant("cleanup_old_bars")
+
+publish_live_state = _async_variant("publish_live_state")
+get_live_state = _async_variant("get_live_state")
+touch_poll_demand = _async_variant("touch_poll_demand")
+get_poll_demand_since = _async_variant("get_poll_demand_since")
+
+get_storage_sizes = _async_variant("get_storage_sizes")
+run_maintenance = _async_variant("run_maintenance")
+get_database_stats = _async_variant("get_database_stats")
@@ -5,8 +5,13 @@ import sqlite3
 import json
 import threading
 import queue
+import os
+import time
+import atexit
 from contextlib import contextmanager
+from datetime import timedelta
 from mtm_imports import logger, datetime
+from mtm_config import config
 
 DATABASE_FILE = "mtm_dashboard.db"
 
@@ -74,11 +79,233 @@ class DatabasePool:
 # Global database pool
 db_pool = DatabasePool()
 
+_FLUSH = object()   # Queue marker: flush what is pending now
+_STOP = object()    # Queue marker: flush everything and stop the writer
+
+class WriteBehindQueue:
+    """Single writer thread that group-commits queued writes.
+
+    Callers enqueue (sql, params) and return without touching SQLite, so
+    nothing waits on an fsync while holding the cache lock. The writer
+    collects a burst of writes until none has arrived for flush_interval
+    seconds (but never holds the oldest one longer than max_latency), then
+    applies consecutive runs of the same statement with executemany inside
+    one transaction.
+
+    Writes are tagged with their table; sync(table) waits until every write
+    queued for that table is committed, so readers that must see their own
+    writes (opening MTM, app state) can ask for it.
+    """
+
+    def __init__(self, flush_interval=0.2, max_latency=1.0, max_batch=5000, max_queue=100000):
+        self.flush_interval = flush_interval
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}              # table -> writes queued but not yet committed
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.stats = {
+            "flushes": 0,
+            "rows_written": 0,
+            "errors": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "max_queue_depth": 0
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, table, sql, params=()):
+        """Queue a write; it is committed within max_latency seconds."""
+        if self._closed:
+            # After shutdown there is no writer left, so write through
+            self._apply([(table, sql, params)])
+            return
+        with self._cond:
+            self._pending[table] = self._pending.get(table, 0) + 1
+        self._queue.put((table, sql, params))
+        depth = self._queue.qsize()
+        with self._cond:
+            if depth > self.stats["max_queue_depth"]:
+                self.stats["max_queue_depth"] = depth
+
+    def sync(self, table=None, timeout=5.0):
+        """Wait until queued writes (for one table, or all) are committed."""
+        with self._cond:
+            if not self._has_pending(table):
+                return True
+        if threading.current_thread() is self._thread:
+            return False
+        self._queue.put(_FLUSH)
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._has_pending(table), timeout)
+
+    def _has_pending(self, table):
+        if table is None:
+            return any(self._pending.values())
+        return self._pending.get(table, 0) > 0
+
+    def _run(self):
+        conn = db_pool._create_connection()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [] if item is _FLUSH else [item]
+            deadline = time.monotonic() + self.max_latency
+            while item is not _FLUSH and len(batch) < self.max_batch:
+                wait = min(self.flush_interval, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if item is not _FLUSH:
+                    batch.append(item)
+            if batch:
+                conn = self._apply_guarded(batch, conn)
+
+        # Drain whatever is left so nothing queued before shutdown is lost
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _FLUSH and item is not _STOP:
+                batch.append(item)
+        if batch:
+            conn = self._apply_guarded(batch, conn)
+        conn.close()
+
+    def _apply_guarded(self, batch, conn):
+        """_apply() for the writer thread: an error escaping it is logged and the thread keeps running.
+
+        Returns the connection to use next, a new one if the failed one was
+        left unusable (e.g. a failed ROLLBACK).
+        """
+        try:
+            self._apply(batch, conn)
+            return conn
+        except Exception as e:
+            with self._cond:
+                self.stats["errors"] += 1
+            logger.error(f"Database writer failed on a batch of {len(batch)} writes: {str(e)}", exc_info=True)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        while True:
+            try:
+                return db_pool._create_connection()
+            except Exception as e:
+                logger.error(f"Database writer cannot reconnect, retrying: {str(e)}")
+                time.sleep(1)
+
+    def _apply(self, batch, conn=None):
+        """Commit a batch in one transaction, falling back to one statement at a time on error."""
+        started = time.perf_counter()
+        written = 0                     # Writes actually committed
+        errors = 0
+        own_conn = conn is None
+        if own_conn:
+            conn = db_pool._create_connection()
+        try:
+            # Consecutive writes with the same SQL become one executemany, keeping order
+            runs = []
+            for table, sql, params in batch:
+                if runs and runs[-1][0] == sql:
+                    runs[-1][1].append(params)
+                else:
+                    runs.append((sql, [params]))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, rows in runs:
+                    if len(rows) == 1:
+                        conn.execute(sql, rows[0])
+                    else:
+                        conn.executemany(sql, rows)
+                conn.execute("COMMIT")
+                written = len(batch)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logger.error(f"Group commit of {len(batch)} writes failed, retrying one by one: {str(e)}", exc_info=True)
+                for table, sql, params in batch:
+                    try:
+                        conn.execute(sql, params)
+                        written += 1
+                    except Exception as e:
+                        errors += 1
+                        logger.error(f"Dropped database write to {table}: {str(e)}")
+        finally:
+            if own_conn:
+                conn.close()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self.stats["flushes"] += 1
+                self.stats["rows_written"] += written
+                self.stats["errors"] += errors
+                self.stats["last_flush_rows"] = written
+                self.stats["last_flush_ms"] = round(elapsed_ms, 2)
+                self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 2)
+                self.stats["total_flush_ms"] += elapsed_ms
+                for table, _, _ in batch:
+                    self._pending[table] -= 1
+                self._cond.notify_all()
+
+    def close(self, timeout=10.0):
+        """Stop accepting queued writes and commit everything still pending."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            logger.info("Database write queue flushed on shutdown.")
+
+    def get_stats(self):
+        with self._cond:
+            pending = {table: count for table, count in self._pending.items() if count}
+            stats = dict(self.stats)
+        flushes = stats["flushes"]
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending_by_table": pending,
+            "flush_interval": self.flush_interval,
+            "max_latency": self.max_latency,
+            **{key: value for key, value in stats.items() if key != "total_flush_ms"},
+            "avg_flush_ms": round(stats["total_flush_ms"] / flushes, 2) if flushes else 0,
+            "avg_flush_rows": round(stats["rows_written"] / flushes, 1) if flushes else 0
+        }
+
+# Global write-behind queue for history, stats, opening MTM and app state writes
+write_queue = WriteBehindQueue(
+    flush_interval=config.get("db_flush_interval", 0.2),
+    max_latency=config.get("db_flush_max_latency", 1.0)
+)
+
 def init_db():
     """Initialize the database and create tables if they don't exist."""
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         
+        # Free pages are returned to the OS by the maintenance task; this only
+        # takes effect before the first table is created (see run_maintenance)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
         # Create a table for application state (key-value store)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS app_state (
@@ -98,20 +325,10 @@ def init_db():
             )
         """)
         
-        # Create a table for MTM history with partitioning
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mtm_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                timestamp TEXT NOT NULL,
-                mtm REAL NOT NULL,
-                date TEXT NOT NULL
-            )
-        """)
+        # MTM history lives in one table per trading day (see _history_table)
+        _load_history_partitions(cursor)
         
         # Create optimized indexes
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_mtm_history_user_ts ON mtm_history (user_id, timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_mtm_history_date ON mtm_history (date)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_updated ON user_stats (last_updated)")
         
         # Create a table for opening MTM values
@@ -124,27 +341,78 @@ def init_db():
             )
         """)
         
+        # Completed MTM OHLC bars, clustered by (user, timeframe, bar start)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS mtm_bars (
+                user_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                open REAL NOT NULL,
+                high REAL NOT NULL,
+                low REAL NOT NULL,
+                close REAL NOT NULL,
+                PRIMARY KEY (user_id, tf, start)
+            ) WITHOUT ROWID
+        """)
+        
+        # Live state shared by the workers of a multi-worker hub: the poller
+        # writes each user's latest values, the other workers read them
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS live_state (
+                user_id TEXT PRIMARY KEY,
+                current_mtm REAL NOT NULL,
+                max_mtm REAL NOT NULL,
+                min_mtm REAL NOT NULL,
+                opening_mtm REAL NOT NULL DEFAULT 0,
+                captured INTEGER NOT NULL DEFAULT 0,
+                raw TEXT,
+                last_updated REAL
+            )
+        """)
+        
+        # When a dashboard on any worker last asked for a user (drives the poll cadence).
+        # seq orders the rows by commit, which the readers' own times do not
+        cursor.execute("PRAGMA table_info(poll_demand)")
+        columns = [row['name'] for row in cursor.fetchall()]
+        if columns and "seq" not in columns:
+            # Only holds the last minute of demand: recreate it rather than migrate
+            cursor.execute("DROP TABLE poll_demand")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS poll_demand (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL UNIQUE,
+                at REAL NOT NULL
+            )
+        """)
+        
         db.commit()
         logger.info("Database initialized with optimized settings.")
 
 # --- App State Functions ---
 
 def get_app_state(key, default=None):
+    write_queue.sync("app_state")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         cursor.execute("SELECT value FROM app_state WHERE key = ?", (key,))
         row = cursor.fetchone()
         return row['value'] if row else default
 
-def set_app_state(key, value):
+def get_all_app_state():
+    """Return every app_state row as {key: value}."""
+    write_queue.sync("app_state")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
-        cursor.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)", (key, str(value)))
-        db.commit()
+        cursor.execute("SELECT key, value FROM app_state")
+        return {r['key']: r['value'] for r in cursor.fetchall()}
+
+def set_app_state(key, value):
+    write_queue.submit("app_state", "INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)", (key, str(value)))
 
 # --- User Stats Functions ---
 
 def get_user_stats(user_id):
+    write_queue.sync("user_stats")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         cursor.execute("SELECT * FROM user_stats WHERE user_id = ?", (user_id,))
@@ -153,38 +421,209 @@ def get_user_stats(user_id):
             return dict(row)
         return None
 
-def update_user_stats_db(user_id, current_mtm, max_mtm, min_mtm):
+def get_all_user_stats():
+    """Return {user_id: stats} for every user in one query."""
+    write_queue.sync("user_stats")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_stats (user_id, max_mtm, min_mtm, current_mtm, last_updated)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """, (user_id, max_mtm, min_mtm, current_mtm))
-        db.commit()
+        cursor.execute("SELECT user_id, max_mtm, min_mtm, current_mtm FROM user_stats")
+        return {r['user_id']: {"max_mtm": r['max_mtm'], "min_mtm": r['min_mtm'], "current_mtm": r['current_mtm']}
+                for r in cursor.fetchall()}
+
+def update_user_stats_db(user_id, current_mtm, max_mtm, min_mtm):
+    write_queue.submit("user_stats", """
+        INSERT OR REPLACE INTO user_stats (user_id, max_mtm, min_mtm, current_mtm, last_updated)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (user_id, max_mtm, min_mtm, current_mtm))
 
 def reset_all_stats_db():
-    with db_pool.get_connection() as db:
-        cursor = db.cursor()
-        cursor.execute("UPDATE user_stats SET max_mtm = -999999999, min_mtm = 999999999, current_mtm = 0, last_updated = CURRENT_TIMESTAMP")
-        db.commit()
-        logger.info("Reset all user stats in the database.")
+    # Queued behind any pending stats writes so they cannot undo the reset
+    write_queue.submit("user_stats", "UPDATE user_stats SET max_mtm = -999999999, min_mtm = 999999999, current_mtm = 0, last_updated = CURRENT_TIMESTAMP")
+    write_queue.sync("user_stats")
+    logger.info("Reset all user stats in the database.")
+
+# --- MTM History Partitions ---
+#
+# History is stored in one table per trading day, mtm_history_YYYYMMDD, so the
+# daily reset and retention drop a table instead of deleting rows one by one.
+# The mtm_history view unions every day for cross-day queries; today's
+# /history reads go straight to today's table, and range queries only touch
+# the days they overlap.
+#
+# Each row carries its integer epoch second (ts) next to the display
+# timestamp; the (user_id, ts, mtm) index covers range scans on its own.
+
+HISTORY_TABLE_PREFIX = "mtm_history_"
+
+_history_partitions = set()     # Days ("YYYY-MM-DD") that have a history table
+_partitions_lock = threading.Lock()
+_legacy_history_table = False   # A legacy mtm_db mtm_history table occupies the view's name
+
+def _history_table(day):
+    """Table holding the history of a "YYYY-MM-DD" day."""
+    return HISTORY_TABLE_PREFIX + day.replace("-", "")
+
+def _history_day(table):
+    digits = table[len(HISTORY_TABLE_PREFIX):]
+    return f"{digits[:4]}-{digits[4:6]}-{digits[6:]}"
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def _create_partition_sql(day):
+    table = _history_table(day)
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                mtm REAL NOT NULL,
+                ts INTEGER NOT NULL DEFAULT 0
+            )""",
+        # Covering index: range scans by (user_id, ts) never visit the table
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_user_epoch ON {table} (user_id, ts, mtm)",
+        # (user_id, id) serves /history?since= deltas without scanning the whole day
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_user_id ON {table} (user_id, id)"
+    ]
+
+def _epoch_sql(day):
+    """SQL expression for a row's epoch second from its day and HH:MM:SS timestamp (local time)."""
+    return f"CAST(strftime('%s', '{day} ' || substr(timestamp, -8), 'utc') AS INTEGER)"
+
+def _upgrade_partition_sql(day):
+    """Add and backfill the ts column of a day table created before it existed."""
+    table = _history_table(day)
+    return [
+        f"ALTER TABLE {table} ADD COLUMN ts INTEGER NOT NULL DEFAULT 0",
+        f"UPDATE {table} SET ts = {_epoch_sql(day)}",
+        f"DROP INDEX IF EXISTS idx_{table}_user_ts"
+    ] + _create_partition_sql(day)
+
+def _to_epoch(day, timestamp):
+    """Epoch second of an "HH:MM:SS" (or "YYYY-MM-DD HH:MM:SS") timestamp on a day."""
+    return int(datetime.strptime(f"{day} {timestamp[-8:]}", "%Y-%m-%d %H:%M:%S").timestamp())
+
+def _history_view_sql():
+    """Statements recreating the mtm_history view over the current partitions."""
+    if _legacy_history_table:
+        return []
+    selects = [
+        f"SELECT id, user_id, timestamp, mtm, ts, '{day}' AS date FROM {_history_table(day)}"
+        for day in sorted(_history_partitions)
+    ] or ["SELECT 0 AS id, '' AS user_id, '' AS timestamp, 0.0 AS mtm, 0 AS ts, '' AS date WHERE 0"]
+    return ["DROP VIEW IF EXISTS mtm_history",
+            "CREATE VIEW mtm_history AS " + " UNION ALL ".join(selects)]
+
+def _load_history_partitions(cursor):
+    """Find the existing day tables, migrate a legacy single mtm_history table and build the view."""
+    global _legacy_history_table
+    cursor.execute("SELECT name, type FROM sqlite_master WHERE name LIKE 'mtm_history%'")
+    objects = {row['name']: row['type'] for row in cursor.fetchall()}
+    with _partitions_lock:
+        _history_partitions.clear()
+        for name, kind in objects.items():
+            if kind == 'table' and name.startswith(HISTORY_TABLE_PREFIX) and name[len(HISTORY_TABLE_PREFIX):].isdigit():
+                _history_partitions.add(_history_day(name))
+
+        for day in sorted(_history_partitions):
+            cursor.execute(f"PRAGMA table_info({_history_table(day)})")
+            if "ts" not in [row['name'] for row in cursor.fetchall()]:
+                cursor.execute("BEGIN IMMEDIATE")
+                for sql in _upgrade_partition_sql(day):
+                    cursor.execute(sql)
+                cursor.execute("COMMIT")
+                logger.info(f"Added epoch timestamps to the MTM history of {day}.")
+
+        if objects.get("mtm_history") == 'table':
+            cursor.execute("PRAGMA table_info(mtm_history)")
+            if "date" not in [row['name'] for row in cursor.fetchall()]:
+                # The legacy mtm_db schema, shared by the non-stabilized app: leave it alone
+                logger.warning("mtm_history belongs to the legacy schema; the cross-day view is not created.")
+                _legacy_history_table = True
+                return
+
+            # One-time migration from the unpartitioned table
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT DISTINCT date FROM mtm_history")
+            for day in [row['date'] for row in cursor.fetchall()]:
+                for sql in _create_partition_sql(day):
+                    cursor.execute(sql)
+                cursor.execute(
+                    f"INSERT INTO {_history_table(day)} (user_id, timestamp, mtm, ts) "
+                    f"SELECT user_id, timestamp, mtm, {_epoch_sql(day)} FROM mtm_history WHERE date = ? ORDER BY id",
+                    (day,)
+                )
+                _history_partitions.add(day)
+            cursor.execute("DROP TABLE mtm_history")
+            cursor.execute("COMMIT")
+            logger.info(f"Migrated MTM history into {len(_history_partitions)} daily tables.")
+
+        for sql in _history_view_sql():
+            cursor.execute(sql)
+
+def _ensure_partition(day):
+    """Create a day's table the first time it is written to.
+
+    The table and view are created before the day is added to
+    _history_partitions: readers trust that set and query the table without
+    waiting on the write queue, so it must exist by then.
+    """
+    if day in _history_partitions:
+        return
+    with _partitions_lock:
+        if day in _history_partitions:
+            return
+        with db_pool.get_connection() as db:
+            cursor = db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for sql in _create_partition_sql(day):
+                    cursor.execute(sql)
+                _history_partitions.add(day)
+                for sql in _history_view_sql():
+                    cursor.execute(sql)
+                cursor.execute("COMMIT")
+            except Exception:
+                _history_partitions.discard(day)
+                cursor.execute("ROLLBACK")
+                raise
+
+def _drop_partitions(days):
+    """Drop whole days of history: one DROP TABLE each, however many rows they hold."""
+    with _partitions_lock:
+        days = [day for day in days if day in _history_partitions]
+        if not days:
+            return []
+        _history_partitions.difference_update(days)
+        for day in days:
+            write_queue.submit("mtm_history", f"DROP TABLE IF EXISTS {_history_table(day)}")
+        for sql in _history_view_sql():
+            write_queue.submit("mtm_history", sql)
+    write_queue.sync("mtm_history")
+    return days
+
+def get_history_partitions():
+    """Days that currently have stored history, oldest first."""
+    with _partitions_lock:
+        return sorted(_history_partitions)
 
 # --- MTM History Functions ---
 
 def add_mtm_history(user_id, timestamp, mtm):
-    with db_pool.get_connection() as db:
-        cursor = db.cursor()
-        # Extract date for partitioning
-        date = timestamp.split(' ')[0] if ' ' in timestamp else datetime.now().strftime("%Y-%m-%d")
-        cursor.execute("INSERT INTO mtm_history (user_id, timestamp, mtm, date) VALUES (?, ?, ?, ?)", 
-                      (user_id, timestamp, mtm, date))
-        db.commit()
+    # Extract date for partitioning
+    date = timestamp.split(' ')[0] if ' ' in timestamp else _today()
+    _ensure_partition(date)
+    write_queue.submit("mtm_history", f"INSERT INTO {_history_table(date)} (user_id, timestamp, mtm, ts) VALUES (?, ?, ?, ?)",
+                       (user_id, timestamp, mtm, _to_epoch(date, timestamp)))
 
-def get_mtm_history(user_id, limit=1000):
+def get_mtm_history(user_id, limit=1000, day=None):
+    day = day or _today()
+    if day not in _history_partitions:
+        return []
     with db_pool.get_connection() as db:
         cursor = db.cursor()
-        cursor.execute("""
-            SELECT timestamp, mtm FROM mtm_history 
+        cursor.execute(f"""
+            SELECT timestamp, mtm FROM {_history_table(day)}
             WHERE user_id = ? 
             ORDER BY timestamp DESC 
             LIMIT ?
@@ -192,43 +631,138 @@ def get_mtm_history(user_id, limit=1000):
         rows = cursor.fetchall()
         return [{"timestamp": r['timestamp'], "mtm": r['mtm']} for r in rows]
 
-def clear_history_db():
+def get_mtm_history_since(user_id, after_id=0, until_id=None, day=None):
+    """Return (points, last_id) for a user's history rows with after_id < id <= until_id, oldest first."""
+    day = day or _today()
+    if day not in _history_partitions:
+        return [], after_id
     with db_pool.get_connection() as db:
         cursor = db.cursor()
-        cursor.execute("DELETE FROM mtm_history")
-        db.commit()
+        cursor.execute(
+            f"SELECT id, timestamp, mtm FROM {_history_table(day)} WHERE user_id = ? AND id > ? AND id <= ? ORDER BY id ASC",
+            (user_id, after_id, until_id if until_id is not None else 2**63 - 1)
+        )
+        rows = cursor.fetchall()
+        return [{"timestamp": r['timestamp'], "mtm": r['mtm']} for r in rows], (rows[-1]['id'] if rows else after_id)
+
+def get_last_history_marker(user_id, day=None):
+    """Return (timestamp, id) of a user's latest history row, or None; served from the (user_id, ts) index."""
+    day = day or _today()
+    if day not in _history_partitions:
+        return None
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute(f"SELECT timestamp, id FROM {_history_table(day)} WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT 1", (user_id,))
+        row = cursor.fetchone()
+        return (row['timestamp'], row['id']) if row else None
+
+def get_history_summary(day=None):
+    """Return {user_id: {"max", "min", "points", "last_timestamp", "last_mtm"}} for a day in one query."""
+    day = day or _today()
+    if day not in _history_partitions:
+        return {}
+    write_queue.sync("mtm_history")
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute(f"""
+            SELECT user_id, timestamp, mtm, high, low, points FROM (
+                SELECT user_id, timestamp, mtm,
+                       MAX(mtm) OVER per_user AS high,
+                       MIN(mtm) OVER per_user AS low,
+                       COUNT(*) OVER per_user AS points,
+                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY ts DESC, id DESC) AS newest
+                FROM {_history_table(day)}
+                WINDOW per_user AS (PARTITION BY user_id)
+            ) WHERE newest = 1
+        """)
+        return {
+            r['user_id']: {"max": r['high'], "min": r['low'], "points": r['points'],
+                           "last_timestamp": r['timestamp'], "last_mtm": r['mtm']}
+            for r in cursor.fetchall()
+        }
+
+def get_mtm_history_range(user_id, start_ts, end_ts, step=0):
+    """Return a user's history with start_ts <= ts < end_ts across days, oldest first.
+
+    Each overlapping day is one range scan of its covering (user_id, ts, mtm)
+    index. With step > 0 the points are bucketed into step-second buckets of
+    {"ts", "mtm" (last), "min", "max", "count"}; otherwise every point is
+    returned as {"ts", "mtm"}.
+    """
+    first_day = datetime.fromtimestamp(start_ts).strftime("%Y-%m-%d")
+    last_day = datetime.fromtimestamp(max(start_ts, end_ts - 1)).strftime("%Y-%m-%d")
+    days = [day for day in get_history_partitions() if first_day <= day <= last_day]
+    
+    points = []
+    bucket = None
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        for day in days:
+            cursor.execute(
+                f"SELECT ts, mtm FROM {_history_table(day)} WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (user_id, int(start_ts), int(end_ts))
+            )
+            for ts, mtm in cursor:
+                if step <= 0:
+                    points.append({"ts": ts, "mtm": mtm})
+                    continue
+                bucket_ts = ts - ts % step
+                if bucket is None or bucket["ts"] != bucket_ts:
+                    bucket = {"ts": bucket_ts, "mtm": mtm, "min": mtm, "max": mtm, "count": 0}
+                    points.append(bucket)
+                bucket["mtm"] = mtm
+                bucket["min"] = min(bucket["min"], mtm)
+                bucket["max"] = max(bucket["max"], mtm)
+                bucket["count"] += 1
+    return points
+
+def clear_history_db(day=None):
+    """Drop a day's history (today by default); earlier days are left to cleanup_old_history."""
+    if _drop_partitions([day or _today()]):
         logger.info("Cleared MTM history from the database.")
 
 def cleanup_old_history(days_to_keep=7):
     """Clean up old history data to prevent database bloat."""
-    with db_pool.get_connection() as db:
-        cursor = db.cursor()
-        cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).strftime("%Y-%m-%d")
-        cursor.execute("DELETE FROM mtm_history WHERE date < ?", (cutoff_date,))
-        deleted_count = cursor.rowcount
-        db.commit()
-        if deleted_count > 0:
-            logger.info(f"Cleaned up {deleted_count} old history records")
+    cutoff_date = (datetime.now() - timedelta(days=days_to_keep)).strftime("%Y-%m-%d")
+    dropped = _drop_partitions([day for day in get_history_partitions() if day < cutoff_date])
+    cleanup_old_bars(days_to_keep)
+    if dropped:
+        logger.info(f"Cleaned up history for {len(dropped)} old days ({dropped[0]} to {dropped[-1]})")
         
 # --- Opening MTM Functions ---
 
 def get_opening_mtm(user_id):
+    write_queue.sync("opening_mtm")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         cursor.execute("SELECT mtm FROM opening_mtm WHERE user_id = ?", (user_id,))
         row = cursor.fetchone()
         return row['mtm'] if row else 0
 
-def set_opening_mtm(user_id, mtm):
+def get_all_opening_mtm():
+    """Return {user_id: opening MTM} for every user in one query."""
+    write_queue.sync("opening_mtm")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO opening_mtm (user_id, mtm, captured, captured_at) 
-            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
-        """, (user_id, mtm))
-        db.commit()
+        cursor.execute("SELECT user_id, mtm FROM opening_mtm")
+        return {r['user_id']: r['mtm'] for r in cursor.fetchall()}
+
+def get_all_opening_mtm_state():
+    """Return {user_id: (opening MTM, captured)} for every user in one query."""
+    write_queue.sync("opening_mtm")
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT user_id, mtm, captured FROM opening_mtm")
+        return {r['user_id']: (r['mtm'], r['captured'] == 1) for r in cursor.fetchall()}
+
+def set_opening_mtm(user_id, mtm):
+    write_queue.submit("opening_mtm", """
+        INSERT OR REPLACE INTO opening_mtm (user_id, mtm, captured, captured_at)
+        VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+    """, (user_id, mtm))
         
 def is_opening_mtm_captured(user_id):
+    write_queue.sync("opening_mtm")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         cursor.execute("SELECT captured FROM opening_mtm WHERE user_id = ?", (user_id,))
@@ -236,14 +770,176 @@ def is_opening_mtm_captured(user_id):
         return row['captured'] == 1 if row else False
 
 def reset_opening_mtm_db():
+    write_queue.sync("opening_mtm")
     with db_pool.get_connection() as db:
         cursor = db.cursor()
         cursor.execute("DELETE FROM opening_mtm")
         db.commit()
         logger.info("Reset all opening MTM data in the database.")
 
+# --- MTM Bar Functions ---
+
+def save_mtm_bar(user_id, tf, start, open_, high, low, close):
+    """Queue a completed bar; tf is the bar length and start the bar's epoch second."""
+    write_queue.submit("mtm_bars", """
+        INSERT OR REPLACE INTO mtm_bars (user_id, tf, start, open, high, low, close)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, tf, int(start), open_, high, low, close))
+
+def get_mtm_bars(user_id, tf, start_from=0, start_to=None):
+    """Return a user's completed bars with start_from <= start < start_to, oldest first."""
+    write_queue.sync("mtm_bars")
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT start, open, high, low, close FROM mtm_bars "
+            "WHERE user_id = ? AND tf = ? AND start >= ? AND start < ? ORDER BY start",
+            (user_id, tf, int(start_from), int(start_to) if start_to is not None else 2**63 - 1)
+        )
+        return [tuple(r) for r in cursor.fetchall()]
+
+def cleanup_old_bars(days_to_keep=7):
+    """Delete bars older than the history retention window."""
+    cutoff = (datetime.now() - timedelta(days=days_to_keep)).replace(hour=0, minute=0, second=0, microsecond=0)
+    write_queue.submit("mtm_bars", "DELETE FROM mtm_bars WHERE start < ?", (int(cutoff.timestamp()),))
+    write_queue.sync("mtm_bars")
+
+# --- Shared Live State (multi-worker hub) ---
+
+def publish_live_state(rows):
+    """Queue [(user_id, current, max, min, opening, captured, raw, last_updated)] rows for live_state."""
+    for row in rows:
+        write_queue.submit("live_state", """
+            INSERT OR REPLACE INTO live_state
+                (user_id, current_mtm, max_mtm, min_mtm, opening_mtm, captured, raw, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, row)
+
+def get_live_state():
+    """Return {user_id: row dict} for every user in live_state, in one query."""
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT * FROM live_state")
+        return {r['user_id']: dict(r) for r in cursor.fetchall()}
+
+def touch_poll_demand(demand):
+    """Queue {user_id: epoch} dashboard requests seen by this worker.
+
+    Replacing a user's row gives it a new, never reused seq, so the poller
+    sees it even when its time is older than rows committed before it.
+    """
+    for user_id, at in demand.items():
+        write_queue.submit("poll_demand", "INSERT OR REPLACE INTO poll_demand (user_id, at) VALUES (?, ?)", (user_id, at))
+
+def get_poll_demand_since(after_seq):
+    """Return ({user_id: epoch}, last seq) for dashboard requests committed after seq after_seq."""
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT seq, user_id, at FROM poll_demand WHERE seq > ? ORDER BY seq", (after_seq,))
+        rows = cursor.fetchall()
+        return {r['user_id']: r['at'] for r in rows}, (rows[-1]['seq'] if rows else after_seq)
+
+def refresh_history_partitions():
+    """Pick up day tables created by another process (a worker that does not write history)."""
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        cursor.execute(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '{HISTORY_TABLE_PREFIX}%'")
+        days = {_history_day(r['name']) for r in cursor.fetchall() if r['name'][len(HISTORY_TABLE_PREFIX):].isdigit()}
+    with _partitions_lock:
+        _history_partitions.clear()
+        _history_partitions.update(days)
+
+# --- Maintenance ---
+
+# Result of the last run_maintenance() call, reported by get_database_stats
+maintenance_stats = {}
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def get_storage_sizes(db=None):
+    """Sizes of the database, its WAL and its free pages."""
+    def read(cursor):
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA freelist_count")
+        freelist = cursor.fetchone()[0]
+        return {
+            "database_bytes": _file_size(DATABASE_FILE),
+            "wal_bytes": _file_size(DATABASE_FILE + "-wal"),
+            "page_count": page_count,
+            "free_pages": freelist,
+            "free_bytes": freelist * page_size
+        }
+    if db is not None:
+        return read(db.cursor())
+    with db_pool.get_connection() as conn:
+        return read(conn.cursor())
+
+def run_maintenance():
+    """Checkpoint and truncate the WAL, reclaim free pages and refresh planner statistics.
+
+    Meant for outside market hours: the checkpoint waits for readers and the
+    first run on a database created without incremental auto-vacuum rebuilds
+    it with a full VACUUM.
+    """
+    started = time.perf_counter()
+    write_queue.sync(timeout=30.0)
+    with db_pool.get_connection() as db:
+        cursor = db.cursor()
+        before = get_storage_sizes(db)
+        
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != 2:
+            # Databases created before incremental auto-vacuum: convert once
+            logger.info("Converting the database to incremental auto-vacuum (one-time VACUUM)...")
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+        else:
+            # executescript steps the pragma to completion; execute() frees a single page
+            db.executescript("PRAGMA incremental_vacuum;")
+        
+        cursor.execute("ANALYZE")
+        cursor.execute("PRAGMA optimize")
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        busy, wal_frames, checkpointed = cursor.fetchone()
+        after = get_storage_sizes(db)
+    
+    maintenance_stats.clear()
+    maintenance_stats.update({
+        "ran_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "checkpoint_complete": busy == 0,
+        "checkpointed_frames": checkpointed,
+        "before": before,
+        "after": after
+    })
+    logger.info(f"Database maintenance done in {maintenance_stats['duration_ms']} ms: "
+                f"{before['database_bytes'] + before['wal_bytes']} -> {after['database_bytes'] + after['wal_bytes']} bytes")
+    return dict(maintenance_stats)
+
 # --- Performance Monitoring ---
 
+_day_row_counts = {}    # Past day -> history rows; those tables are no longer written
+
+def _history_row_count(cursor, days):
+    """Rows across the days' tables, counting each past day only once."""
+    today = _today()
+    total = 0
+    for day in days:
+        count = _day_row_counts.get(day)
+        if count is None:
+            cursor.execute(f"SELECT COUNT(*) as count FROM {_history_table(day)}")
+            count = cursor.fetchone()['count']
+            if day < today:
+                _day_row_counts[day] = count
+        total += count
+    for day in set(_day_row_counts).difference(days):
+        del _day_row_counts[day]
+    return total
+
 def get_database_stats():
     """Get database performance statistics."""
     with db_pool.get_connection() as db:
@@ -253,23 +949,38 @@ def get_database_stats():
         cursor.execute("SELECT COUNT(*) as count FROM user_stats")
         user_stats_count = cursor.fetchone()['count']
         
-        cursor.execute("SELECT COUNT(*) as count FROM mtm_history")
-        history_count = cursor.fetchone()['count']
+        # Per day table rather than the mtm_history view, which would scan every retained day
+        history_days = get_history_partitions()
+        history_count = _history_row_count(cursor, history_days)
         
         cursor.execute("SELECT COUNT(*) as count FROM opening_mtm")
         opening_mtm_count = cursor.fetchone()['count']
         
+        cursor.execute("SELECT COUNT(*) as count FROM mtm_bars")
+        bars_count = cursor.fetchone()['count']
+        
         # Get database file size
-        import os
-        db_size = os.path.getsize(DATABASE_FILE) if os.path.exists(DATABASE_FILE) else 0
+        db_size = _file_size(DATABASE_FILE)
+        storage = get_storage_sizes(db)
         
         return {
             "user_stats_count": user_stats_count,
             "history_count": history_count,
+            "history_days": len(history_days),
+            "history_oldest_day": history_days[0] if history_days else None,
             "opening_mtm_count": opening_mtm_count,
+            "bars_count": bars_count,
             "database_size_mb": round(db_size / (1024 * 1024), 2),
-            "connection_pool_size": db_pool.connections.qsize()
+            "wal_size_mb": round(storage["wal_bytes"] / (1024 * 1024), 2),
+            "free_pages": storage["free_pages"],
+            "last_maintenance": maintenance_stats or None,
+            "connection_pool_size": db_pool.connections.qsize(),
+            "write_queue": write_queue.get_stats()
         }
 
 # Initialize database on import
-init_db() 
\ No newline at end of file
+init_db()
+
+# Start the writer once the tables exist; commit anything still queued at exit
+write_queue.start()
+atexit.register(write_queue.close) 
\ No newline at end of file
@@ -0,0 +1,345 @@
+# mtm_history.py
+# Bounded in-memory intraday MTM history
+
+from array import array
+from mtm_imports import *
+from mtm_config import config
+
+class HistoryRing:
+    """Fixed-capacity ring of (epoch seconds, MTM) points for one user.
+
+    Timestamps and values live in two float64 arrays instead of one dict per
+    point. The arrays grow by doubling up to capacity; once full, each append
+    overwrites the oldest point, so appends are O(1) and memory per user is
+    bounded at 16 bytes x capacity.
+    """
+
+    def __init__(self, capacity: int, initial: int = 1024):
+        self.capacity = max(1, capacity)    # Appends index modulo the slot count, so never empty
+        size = max(1, min(initial, self.capacity))
+        self.epochs = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        self.start = 0      # Slot of the oldest point
+        self.size = 0       # Points currently held
+        self.appended = 0   # Points ever appended, including overwritten/expired ones
+
+    def _grow(self):
+        epochs, values = self.columns()
+        pad = array('d', bytes(8 * (min(self.capacity, 2 * len(self.epochs)) - self.size)))
+        self.epochs = epochs + pad
+        self.values = values + pad
+        self.start = 0
+
+    def append(self, epoch: float, value: float):
+        slots = len(self.epochs)
+        if self.size == slots and slots < self.capacity:
+            self._grow()
+            slots = len(self.epochs)
+        end = (self.start + self.size) % slots
+        self.epochs[end] = epoch
+        self.values[end] = value
+        if self.size < slots:
+            self.size += 1
+        else:
+            # Full: the oldest point is overwritten
+            self.start = (self.start + 1) % slots
+        self.appended += 1
+
+    def expire(self, cutoff: float):
+        """Drop points older than cutoff (epoch seconds)."""
+        slots = len(self.epochs)
+        while self.size and self.epochs[self.start] < cutoff:
+            self.start = (self.start + 1) % slots
+            self.size -= 1
+
+    def last_timestamp(self):
+        if not self.size:
+            return None
+        return self.epochs[(self.start + self.size - 1) % len(self.epochs)]
+
+    def tail(self, count: int):
+        """Return (epochs, values) arrays of the newest count points, oldest first."""
+        count = min(count, self.size)
+        slots = len(self.epochs)
+        begin = (self.start + self.size - count) % slots
+        end = begin + count
+        if end <= slots:
+            return self.epochs[begin:end], self.values[begin:end]
+        wrap = end - slots
+        return (self.epochs[begin:] + self.epochs[:wrap],
+                self.values[begin:] + self.values[:wrap])
+
+    def columns(self):
+        """Return (epochs, values) arrays in chronological order."""
+        return self.tail(self.size)
+
+    @property
+    def nbytes(self):
+        return (len(self.epochs) + len(self.values)) * self.epochs.itemsize
+
+def lttb_indices(xs, ys, max_points: int):
+    """Largest-triangle-three-buckets downsample of a series; returns kept indices.
+
+    The first and last points are always kept, and so are the global minimum
+    and maximum, so drawdown spikes survive the downsample. Below 4 points
+    there is no room for both: 1 keeps the last point, 2 the endpoints and 3
+    the endpoints plus the point furthest from the line between them.
+    """
+    n = len(xs)
+    if max_points <= 0 or n <= max_points:
+        return list(range(n))
+    if max_points == 1:
+        return [n - 1]
+    if max_points == 2:
+        return [0, n - 1]
+    if max_points == 3:
+        # One bucket between the endpoints, the last point as its third vertex
+        ax, ay, cx, cy = xs[0], ys[0], xs[n - 1], ys[n - 1]
+        best = max(range(1, n - 1), key=lambda j: abs((ax - cx) * (ys[j] - ay) - (ax - xs[j]) * (cy - ay)))
+        return [0, best, n - 1]
+
+    # Two slots are reserved for the global min/max
+    buckets = max_points - 4
+    keep = [0]
+    if buckets > 0:
+        bucket_size = (n - 2) / buckets
+        a = 0
+        for i in range(buckets):
+            start = int(i * bucket_size) + 1
+            end = int((i + 1) * bucket_size) + 1
+
+            # Average of the next bucket (or the last point) is the third vertex
+            next_start, next_end = end, min(int((i + 2) * bucket_size) + 1, n)
+            if next_start >= next_end:
+                avg_x, avg_y = xs[n - 1], ys[n - 1]
+            else:
+                count = next_end - next_start
+                avg_x = sum(xs[next_start:next_end]) / count
+                avg_y = sum(ys[next_start:next_end]) / count
+
+            ax, ay = xs[a], ys[a]
+            best, best_area = start, -1.0
+            for j in range(start, end):
+                area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+                if area > best_area:
+                    best, best_area = j, area
+            keep.append(best)
+            a = best
+    keep.append(n - 1)
+
+    lowest = min(range(n), key=ys.__getitem__)
+    highest = max(range(n), key=ys.__getitem__)
+    return sorted(set(keep) | {lowest, highest})
+
+def make_history_cursor(generation, position: int):
+    """Opaque /history cursor: the history generation plus a position within it."""
+    return f"{generation}:{position}"
+
+def parse_history_cursor(cursor: str, generation):
+    """Return the position in a cursor, or None if it is malformed or from an earlier generation."""
+    try:
+        cursor_generation, position = str(cursor).rsplit(":", 1)
+        position = int(position)
+    except ValueError:
+        return None
+    if cursor_generation != str(generation) or position < 0:
+        return None
+    return position
+
+def downsample_points(points: list, max_points: int):
+    """LTTB-downsample [{"timestamp": "HH:MM:SS", "mtm": value}] points."""
+    if max_points <= 0 or len(points) <= max_points:
+        return points
+    xs = []
+    for point in points:
+        hours, minutes, seconds = point["timestamp"].split(":")
+        xs.append(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+    ys = [point["mtm"] for point in points]
+    return [points[i] for i in lttb_indices(xs, ys, max_points)]
+
+class DownsampleCache:
+    """Downsampled history per (user, max_points), valid while the user's last point is unchanged."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}      # (user_id, max_points) -> (last_marker, points)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, last_marker, max_points: int, build):
+        """Return the cached result for last_marker, or build() and cache it."""
+        key = (user_id, max_points)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == last_marker:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        points = build()
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.clear()
+            self._entries[key] = (last_marker, points)
+        return points
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# Shared cache of downsampled /history responses
+downsample_cache = DownsampleCache()
+
+def read_history(user_id: str, max_points: int, since: str, generation, get_since, get_marker):
+    """Build the /history payload from a history table (runs on the database thread pool).
+
+    Each app passes its own database's readers: get_since(user_id, after_id,
+    until_id) returns (points, last_id) and get_marker(user_id) the
+    (timestamp, id) of the user's latest row. Cursors are generation:id, so
+    a cursor from an earlier generation gets the full history and reset.
+    """
+    reset = False
+    if since:
+        after_id = parse_history_cursor(since, generation)
+        if after_id is not None:
+            history, last_id = get_since(user_id, after_id)
+            return {
+                "status": "success", "history": history,
+                "cursor": make_history_cursor(generation, last_id), "reset": False
+            }
+        reset = True
+    
+    if max_points > 0:
+        # Recomputed only when the user's latest row changes; ids repeat across generations
+        marker = get_marker(user_id)
+        last_id = marker[1] if marker else 0
+        history = downsample_cache.get(
+            user_id, (generation, marker), max_points,
+            lambda: downsample_points(get_since(user_id, 0, last_id)[0], max_points)
+        )
+    else:
+        history, last_id = get_since(user_id)
+    return {
+        "status": "success", "history": history,
+        "cursor": make_history_cursor(generation, last_id), "reset": reset
+    }
+
+def _to_points(epochs, values):
+    """Format epoch/MTM columns as the [{"timestamp": "HH:MM:SS", "mtm": value}] /history payload."""
+    return [
+        {"timestamp": time.strftime("%H:%M:%S", time.localtime(epoch)), "mtm": value}
+        for epoch, value in zip(epochs, values)
+    ]
+
+class HistoryStore:
+    """Today's MTM history for every user, one HistoryRing each.
+
+    Retention is max_points per user (oldest points are overwritten) and,
+    optionally, max_age seconds (older points are dropped on append).
+    """
+
+    def __init__(self, max_points: int = 20000, max_age: float = 0):
+        self.max_points = max(1, max_points)
+        self.max_age = max_age
+        self.generation = 1     # Bumped on every clear so old /history cursors are detected
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def append(self, user_id: str, value: float, epoch: float = None):
+        epoch = time.time() if epoch is None else epoch
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if ring is None:
+                ring = self._rings[user_id] = HistoryRing(self.max_points)
+            ring.append(epoch, value)
+            if self.max_age:
+                ring.expire(epoch - self.max_age)
+
+    def get_series(self, user_id: str):
+        """Return (epochs, values) arrays for a user, oldest first."""
+        epochs, values, _ = self._read(user_id)
+        return epochs, values
+
+    def _read(self, user_id: str, after: int = 0):
+        """Return (epochs, values, position) for points appended after position `after`.
+
+        position is the user's append count, the cursor for the next call.
+        """
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if ring is None:
+                return array('d'), array('d'), 0
+            epochs, values = ring.tail(ring.appended - after)
+            return epochs, values, ring.appended
+
+    def get_points(self, user_id: str):
+        """Return a user's history as [{"timestamp": "HH:MM:SS", "mtm": value}]."""
+        epochs, values = self.get_series(user_id)
+        return _to_points(epochs, values)
+
+    def get_history(self, user_id: str, max_points: int = 0, since: str = None):
+        """Return {"history", "cursor", "reset"} for /history.
+
+        With since=<cursor> only points appended after the cursor are returned.
+        reset is true when the cursor can no longer be served (history cleared,
+        or the points were overwritten) and the full history is sent instead.
+        max_points LTTB-downsamples a full history.
+        """
+        with self._lock:
+            generation = self.generation
+            ring = self._rings.get(user_id)
+            appended = ring.appended if ring else 0
+            size = ring.size if ring else 0
+            last_timestamp = ring.last_timestamp() if ring else None
+
+        reset = False
+        if since:
+            position = parse_history_cursor(since, generation)
+            if position is not None and position <= appended and appended - position <= size:
+                epochs, values, position = self._read(user_id, position)
+                return {"history": _to_points(epochs, values),
+                        "cursor": make_history_cursor(generation, position), "reset": False}
+            reset = True
+
+        if max_points > 0:
+            def build():
+                epochs, values, position = self._read(user_id)
+                keep = lttb_indices(epochs, values, max_points)
+                return _to_points([epochs[i] for i in keep], [values[i] for i in keep]), position
+            history, position = downsample_cache.get(user_id, (generation, last_timestamp), max_points, build)
+        else:
+            epochs, values, position = self._read(user_id)
+            history = _to_points(epochs, values)
+        return {"history": history, "cursor": make_history_cursor(generation, position), "reset": reset}
+
+    def clear(self, user_id: str = None):
+        """Drop one user's history, or everyone's. Outstanding cursors become stale."""
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._rings = {}
+            else:
+                self._rings.pop(user_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            rings = list(self._rings.values())
+        points = sum(ring.size for ring in rings)
+        return {
+            "users": len(rings),
+            "points": points,
+            "max_points_per_user": self.max_points,
+            "max_age_seconds": self.max_age,
+            "bytes_allocated": sum(ring.nbytes for ring in rings),
+            "bytes_used": points * 16
+        }
+
+# Global intraday history store
+mtm_history = HistoryStore(
+    max_points=config.get("history_max_points", 20000),
+    max_age=config.get("history_max_age", 0)
+)
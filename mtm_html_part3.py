@@ -11,6 +11,7 @@ DASHBOARD_HTML_PART3 = """
     let CHART_UPDATE_INTERVAL = 30000; // Default: 30 seconds (will be updated from server config)
     let users = [];
     let refreshInterval;
+    let mtmStream = null; // EventSource for /stream (replaces per-user polling)
     let chartUpdateInterval; // New interval for chart updates
     let lastChartUpdate = {}; // Track last chart update by user
     let consecutiveErrors = 0;
@@ -21,6 +22,8 @@ DASHBOARD_HTML_PART3 = """
     let currentSortDirection = 'asc'; // Default sort direction
     // History cache for user graphs
     const historyCache = {};
+    const HISTORY_MAX_POINTS = 300; // Charts get a server-side downsample of at most this many points
+    const historyCursor = {}; // /history cursor per user, so chart refreshes fetch only new points
     // Spinner SVG
     const spinnerSVG = `<div style='display:flex;align-items:center;justify-content:center;height:100%;'><svg width='40' height='40' viewBox='0 0 40 40' fill='none'><circle cx='20' cy='20' r='16' stroke='#2a5298' stroke-width='4' stroke-linecap='round' stroke-dasharray='80' stroke-dashoffset='60'><animate attributeName='stroke-dashoffset' values='60;0' dur='1s' repeatCount='indefinite'/></circle></svg></div>`;
     // Helper: Exponential backoff for MTM fetch errors
@@ -5,32 +5,63 @@
 
 DASHBOARD_HTML_PART5 = """
 <script>
+    async function updateDueCharts() {
+        // Only update chart data every CHART_UPDATE_INTERVAL
+        const now = Date.now();
+        let chartUpdated = false;
+        for (const user of users) {
+            if (!lastChartUpdate[user.userId] || (now - lastChartUpdate[user.userId]) >= CHART_UPDATE_INTERVAL) {
+                await updateChartHistory(user.userId);
+                lastChartUpdate[user.userId] = now;
+                chartUpdated = true;
+            }
+        }
+        
+        // Only update UI elements if a chart was updated
+        if (chartUpdated) {
+            refreshChartDisplays();
+        }
+    }
     async function fetchAllMTM() {
-        const fetchPromises = users.map(user => fetchUserMTM(user.userId));
+        // One /MTM/all request for the whole grid instead of one /MTM per user
+        try {
+            const response = await fetch('/MTM/all');
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            await applyMTMSnapshot(await response.json());
+        } catch (error) {
+            handleFetchError();
+        }
+    }
+    async function applyMTMSnapshot(snapshot) {
         try {
-            await Promise.all(fetchPromises);
-            // Only update chart data every CHART_UPDATE_INTERVAL
-            const now = Date.now();
-            let chartUpdated = false;
             for (const user of users) {
-                if (!lastChartUpdate[user.userId] || (now - lastChartUpdate[user.userId]) >= CHART_UPDATE_INTERVAL) {
-                    await updateChartHistory(user.userId);
-                    lastChartUpdate[user.userId] = now;
-                    chartUpdated = true;
-                }
-            }
-            
-            // Only update UI elements if a chart was updated
-            if (chartUpdated) {
-                refreshChartDisplays();
+                const data = snapshot.users[user.userId];
+                if (!data) continue;
+                if (data.opening_mtm !== undefined) user.openingHourMtm = data.opening_mtm;
+                updateUserUI(user.userId, data);
             }
-            
+            resetErrorCount();
+            await updateDueCharts();
             updateLastUpdated();
         } catch (error) {
             handleFetchError();
         }
     }
+    function startMTMStream() {
+        // One server-pushed snapshot for all users instead of one /MTM poll per user
+        if (!window.EventSource) return false;
+        if (mtmStream) return true;
+        mtmStream = new EventSource('/stream');
+        mtmStream.onmessage = (event) => applyMTMSnapshot(JSON.parse(event.data));
+        // EventSource reconnects on its own, just surface the error state
+        mtmStream.onerror = () => handleFetchError();
+        return true;
+    }
     function startAutoRefresh() {
+        if (startMTMStream()) {
+            console.log(`MTM stream started: pushed by server, Chart updates every ${CHART_UPDATE_INTERVAL}ms`);
+            return;
+        }
         if (refreshInterval) clearInterval(refreshInterval);
         refreshInterval = setInterval(fetchAllMTM, REFRESH_INTERVAL);
         console.log(`Auto refresh started: MTM data every ${REFRESH_INTERVAL}ms, Chart updates every ${CHART_UPDATE_INTERVAL}ms`);
@@ -27,10 +27,10 @@ DASHBOARD_HTML_PART6 = """
                             setTimeout(() => renderUserGraph(userId, instance.popper.querySelector('canvas'), false, true), 0);
                         } else {
                             instance.setContent(spinnerSVG);
-                            fetch(`/history?UserID=${userId}`)
+                            fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`)
                                 .then(res => res.json())
                                 .then(data => {
-                                    historyCache[userId] = data.history || [];
+                                    storeHistory(userId, data, false);
                                     instance.setContent(createGraphPopoverContent(userId, false));
                                     setTimeout(() => renderUserGraph(userId, instance.popper.querySelector('canvas'), false, true), 0);
                                 });
@@ -61,13 +61,30 @@ DASHBOARD_HTML_PART6 = """
         return `<div class="graph-popover"><canvas id="graph-canvas-${userId}-${isModal ? 'modal' : 'popover'}" width="300" height="150"></canvas></div>`;
     }
     
+    // Store a /history response; deltas are appended unless the server reset the series
+    function storeHistory(userId, data, isDelta) {
+        if (isDelta && !data.reset && historyCache[userId]) {
+            historyCache[userId].push(...(data.history || []));
+        } else {
+            historyCache[userId] = data.history || [];
+        }
+        historyCursor[userId] = data.cursor;
+    }
+    
     // Function to update chart history for a specific user
     async function updateChartHistory(userId) {
         try {
-            const response = await fetch(`/history?UserID=${userId}`);
+            // Fetch only the points added since the last call; start again from a fresh
+            // downsample once the appended points outgrow it
+            const cached = historyCache[userId];
+            const isDelta = Boolean(cached && historyCursor[userId] && cached.length < 2 * HISTORY_MAX_POINTS);
+            const url = isDelta
+                ? `/history?UserID=${userId}&since=${encodeURIComponent(historyCursor[userId])}`
+                : `/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`;
+            const response = await fetch(url);
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
             const data = await response.json();
-            historyCache[userId] = data.history || [];
+            storeHistory(userId, data, isDelta);
             return true;
         } catch (error) {
             console.error(`Error updating chart history for ${userId}:`, error);
@@ -10,8 +10,8 @@ DASHBOARD_HTML_PART7 = """
         if (useCache && historyCache[userId]) {
             historyPromise = Promise.resolve({ history: historyCache[userId] });
         } else {
-            historyPromise = fetch(`/history?UserID=${userId}`).then(res => res.json()).then(data => {
-                historyCache[userId] = data.history || [];
+            historyPromise = fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`).then(res => res.json()).then(data => {
+                storeHistory(userId, data, false);
                 return data;
             });
         }
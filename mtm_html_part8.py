@@ -33,10 +33,10 @@ DASHBOARD_HTML_PART8 = """
             } else {
                 renderUserGraph(userId, canvas, true, false);
                 // Wait for data, then hide spinner
-                fetch(`/history?UserID=${userId}`)
+                fetch(`/history?UserID=${userId}&max_points=${HISTORY_MAX_POINTS}`)
                     .then(res => res.json())
                     .then(data => {
-                        historyCache[userId] = data.history || [];
+                        storeHistory(userId, data, false);
                         document.getElementById('graph-modal-spinner').style.display = 'none';
                         canvas.style.display = '';
                         renderUserGraph(userId, canvas, true, true);
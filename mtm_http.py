@@ -0,0 +1,435 @@
+# mtm_http.py
+# Shared async HTTP client for calls to the client machines
+
+from collections import deque
+from mtm_imports import *
+from mtm_config import config
+
+# Standard headers for requests
+headers = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Cache-Control': 'max-age=0',
+    'Connection': 'keep-alive',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+}
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without sending a request while a client machine's circuit is open."""
+
+class CircuitBreaker:
+    """Stops calls to a client machine that keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail at once instead of each waiting out its timeout. After reset_timeout
+    seconds one probe is let through (half-open): success closes the
+    circuit, failure opens it for another reset_timeout. Not thread-safe;
+    UpstreamClient calls it under its stats lock.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0           # Consecutive failures
+        self.opened_at = None
+        self.probing = False        # A half-open probe is in flight
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self, now: float = None):
+        """Whether a request may be sent now."""
+        now = time.time() if now is None else now
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probing = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, success: bool, now: float = None):
+        if success:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.time() if now is None else now
+            self.probing = False
+            self.opens += 1
+
+    def abandon(self):
+        """A request was cancelled before it had an outcome; let another probe through."""
+        self.probing = False
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened_at": datetime.fromtimestamp(self.opened_at).strftime("%H:%M:%S") if self.opened_at else None,
+            "opens": self.opens,
+            "rejected": self.rejected
+        }
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class HostStats:
+    """Latency and error counters for one client machine."""
+
+    def __init__(self, breaker: CircuitBreaker = None, samples: int = 256):
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=samples)  # Recent successful latencies, for percentiles
+        self.hedged = 0         # Requests that sent a second, hedged copy
+        self.hedge_wins = 0     # ... and were answered by the hedge first
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.last_error = None
+        self.last_success = None
+
+    def record(self, latency: float, error: Exception = None):
+        self.requests += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        if error is None:
+            self.consecutive_failures = 0
+            self.last_success = time.time()
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if isinstance(error, (httpx.TimeoutException, TimeoutError)):
+                self.timeouts += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+        # A 4xx answer (e.g. unknown user) still shows the host is healthy
+        host_failed = error is not None and not (
+            isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500
+        )
+        self.breaker.record(not host_failed)
+
+    def percentile(self, pct):
+        """Latency percentile of recent successful requests in seconds, or None without samples."""
+        if not self.latencies:
+            return None
+        return _percentile(sorted(self.latencies), pct)
+
+    def to_dict(self):
+        ordered = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "consecutive_failures": self.consecutive_failures,
+            "avg_latency_ms": round(self.total_latency / self.requests * 1000, 1) if self.requests else 0,
+            "max_latency_ms": round(self.max_latency * 1000, 1),
+            "last_latency_ms": round(self.last_latency * 1000, 1),
+            "latency_ms": {
+                "samples": len(ordered),
+                **{f"p{pct}": round(_percentile(ordered, pct) * 1000, 1) if ordered else 0 for pct in (50, 95, 99)}
+            },
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "breaker": self.breaker.to_dict(),
+            "last_error": self.last_error
+        }
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait for the same result instead of issuing their
+    own. Futures belong to one event loop, so in-flight calls are tracked per
+    loop.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}         # (event loop, key) -> Future
+        self._stats_lock = threading.Lock()
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) once per key; return (result, shared).
+
+        shared is True for callers that reused another caller's result, so
+        they can skip side effects the leader already performed.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        future = self._inflight.get(flight_key)
+        if future is not None:
+            with self._stats_lock:
+                self.coalesced += 1
+            # shield: a waiter going away must not cancel the leader's call
+            return await asyncio.shield(future), True
+
+        future = loop.create_future()
+        self._inflight[flight_key] = future
+        with self._stats_lock:
+            self.calls += 1
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[flight_key]
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight)
+            }
+
+class UpstreamClient:
+    """One long-lived keep-alive httpx client shared by every upstream call.
+
+    Each client machine (host:port) gets its own semaphore so a hung host can
+    only tie up its own connection slots, never the event loop or other hosts.
+    httpx connections belong to the loop that opened them, so each event
+    loop gets its own client.
+
+    Every host has a circuit breaker: while it is open, calls raise
+    CircuitOpenError immediately. With hedge enabled, a request still
+    unanswered after the host's p95 latency is sent a second time and the
+    first answer wins.
+    """
+
+    def __init__(self, max_per_host=4, timeout=5.0, host_timeout=None, max_connections=100,
+                 breaker_failures=5, breaker_reset=30.0, hedge=False, hedge_min_samples=20):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.host_timeout = host_timeout or timeout * 2
+        self.max_connections = max_connections
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self._per_loop = {}         # event loop -> {"client": AsyncClient, "host_limits": {host: Semaphore}}
+        self._host_stats = {}
+        self._stats_lock = threading.Lock()
+        self.flights = SingleFlight()
+
+    def _loop_state(self):
+        """Return the client and host semaphores for the running loop."""
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            # Forget loops that have been closed since the last call
+            for old_loop in [l for l in self._per_loop if l.is_closed()]:
+                del self._per_loop[old_loop]
+            state = {
+                "client": httpx.AsyncClient(
+                    headers=headers,
+                    timeout=httpx.Timeout(self.timeout),
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections,
+                        keepalive_expiry=30.0
+                    )
+                ),
+                "host_limits": {}
+            }
+            self._per_loop[loop] = state
+        return state
+
+    def _host(self, host: str):
+        """HostStats for a host; caller holds _stats_lock."""
+        stats = self._host_stats.get(host)
+        if stats is None:
+            stats = self._host_stats[host] = HostStats(CircuitBreaker(self.breaker_failures, self.breaker_reset))
+        return stats
+
+    def _record(self, host: str, latency: float, error: Exception = None):
+        with self._stats_lock:
+            self._host(host).record(latency, error)
+
+    def is_available(self, host: str):
+        """False while the host's circuit is open (its calls would fail at once)."""
+        with self._stats_lock:
+            stats = self._host_stats.get(host)
+            return stats is None or stats.breaker.state != CircuitBreaker.OPEN
+
+    async def get(self, host: str, path: str = "/MTM", params: dict = None, timeout: float = None):
+        """GET http://{host}{path} without blocking the event loop."""
+        with self._stats_lock:
+            stats = self._host(host)
+            if not stats.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for client machine {host}")
+            hedge_after = None
+            if self.hedge and stats.breaker.state == CircuitBreaker.CLOSED and len(stats.latencies) >= self.hedge_min_samples:
+                hedge_after = stats.percentile(95)
+
+        if hedge_after is None:
+            return await self._send(host, path, params, timeout)
+        return await self._hedged(host, path, params, timeout, hedge_after)
+
+    async def _send(self, host: str, path: str, params: dict, timeout: float):
+        state = self._loop_state()
+        if host not in state["host_limits"]:
+            state["host_limits"][host] = asyncio.Semaphore(self.max_per_host)
+
+        async with state["host_limits"][host]:
+            start = time.perf_counter()
+            try:
+                response = await state["client"].get(
+                    f"http://{host}{path}",
+                    params=params,
+                    timeout=timeout if timeout is not None else self.timeout
+                )
+                response.raise_for_status()
+            except asyncio.CancelledError:
+                # No outcome (deadline or a hedge won): a half-open probe may be retried
+                with self._stats_lock:
+                    self._host(host).breaker.abandon()
+                raise
+            except Exception as e:
+                self._record(host, time.perf_counter() - start, e)
+                raise
+            self._record(host, time.perf_counter() - start)
+        return response
+
+    async def _hedged(self, host: str, path: str, params: dict, timeout: float, hedge_after: float):
+        """Send the request, and once more if the first is not answered within hedge_after seconds."""
+        attempts = [asyncio.ensure_future(self._send(host, path, params, timeout))]
+        pending = set(attempts)
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                with self._stats_lock:
+                    self._host(host).hedged += 1
+                attempts.append(asyncio.ensure_future(self._send(host, path, params, timeout)))
+                pending.add(attempts[-1])
+
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not attempts[0]:
+                            with self._stats_lock:
+                                self._host(host).hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_shared(self, host: str, path: str = "/MTM", params: dict = None, timeout: float = None):
+        """Like get(), but concurrent identical requests share one upstream call.
+
+        Returns (response, shared); shared is True when the response came from
+        a request another caller already had in flight.
+        """
+        key = (host, path, tuple(sorted((params or {}).items())))
+        return await self.flights.do(key, self.get, host, path, params=params, timeout=timeout)
+
+    async def fetch_mtm(self, user_id: str, user_ip: str, timeout: float = None):
+        """Fetch /MTM for a user and return (parsed_data, raw_text)."""
+        response = await self.get(user_ip, "/MTM", params={"UserID": user_id}, timeout=timeout)
+        data = response.json()
+        if isinstance(data, str):
+            # If the response is a JSON string, parse it again
+            data = json.loads(data)
+        return data, response.text
+
+    async def fetch_mtm_group(self, host: str, user_ids: list, timeout: float = None):
+        """Fetch /MTM for every user behind one client machine.
+
+        The users share the host's keep-alive connections and semaphore. Once
+        the host fails at the transport level (unreachable, hung) the rest of
+        its group fails fast instead of each waiting out its own timeout, and
+        the whole group is bounded by the host-level deadline.
+        Returns {user_id: (data, raw_text) or the exception raised}.
+        """
+        results = {}
+        host_failure = None
+
+        async def fetch_one(user_id):
+            nonlocal host_failure
+            if host_failure is not None:
+                results[user_id] = host_failure
+                return
+            try:
+                results[user_id] = await self.fetch_mtm(user_id, host)
+            except httpx.TransportError as e:
+                host_failure = e
+                results[user_id] = e
+            except Exception as e:
+                results[user_id] = e
+
+        deadline = timeout if timeout is not None else self.host_timeout
+        try:
+            await asyncio.wait_for(asyncio.gather(*(fetch_one(user_id) for user_id in user_ids)), deadline)
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"Client machine {host} did not answer within {deadline}s")
+            # Requests cancelled by the deadline are not recorded individually
+            self._record(host, deadline, error)
+            for user_id in user_ids:
+                results.setdefault(user_id, error)
+        return results
+
+    async def fetch_mtm_by_host(self, users: list, timeout: float = None):
+        """Fetch /MTM for a list of {"userId", "ip"} users, one fan-out per host.
+
+        timeout overrides the per-host deadline for this call.
+        """
+        groups = {}
+        for user in users:
+            if user.get("userId") and user.get("ip"):
+                groups.setdefault(user["ip"], []).append(user["userId"])
+
+        results = {}
+        for group_results in await asyncio.gather(
+            *(self.fetch_mtm_group(host, user_ids, timeout) for host, user_ids in groups.items())
+        ):
+            results.update(group_results)
+        return results
+
+    def get_host_stats(self):
+        with self._stats_lock:
+            return {host: stats.to_dict() for host, stats in self._host_stats.items()}
+
+    async def aclose(self):
+        """Close the client of the running loop (called on application shutdown)."""
+        state = self._per_loop.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state["client"].aclose()
+
+# Global upstream client
+upstream_client = UpstreamClient(
+    max_per_host=config.get("upstream_max_per_host", 4),
+    timeout=config.get("upstream_timeout", 5.0),
+    host_timeout=config.get("upstream_host_timeout", 10.0),
+    breaker_failures=config.get("upstream_breaker_failures", 5),
+    breaker_reset=config.get("upstream_breaker_reset", 30.0),
+    hedge=config.get("upstream_hedge", False)
+)
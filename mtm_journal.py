@@ -0,0 +1,157 @@
+# mtm_journal.py
+# Append-only memory-mapped journal of MTM samples for crash recovery
+
+import mmap
+import struct
+from mtm_imports import *
+
+JOURNAL_FILE = "mtm_journal.bin"
+
+# Record kinds (0 marks an unused slot)
+TICK = 1        # An MTM value passed to update_user_stats
+OPENING = 2     # An opening MTM capture
+HISTORY = 3     # A history point appended at a 30-second marker
+
+HEADER = struct.Struct("<4sHH8x")   # magic, version, record size
+RECORD = struct.Struct("<IB3xdd")   # user index, kind, epoch, mtm
+MAGIC = b"MTMJ"
+VERSION = 1
+
+class TickJournal:
+    """Fixed-size binary records appended to a memory-mapped file.
+
+    An append is a struct.pack_into into the mapping, with no system call,
+    so journaling every tick costs no I/O on the request path; the OS writes
+    the pages back, and they survive a crash of the process. User ids are
+    stored once, in a sidecar file (one id per line), and records refer to
+    them by line number.
+
+    compact(cut) drops the records before cut once they are safely in SQLite
+    and moves the remainder to the front of the file.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, capacity=262144):
+        self.path = path
+        self.users_path = path + ".users"
+        self.capacity = capacity
+        self.count = 0          # Records currently in the journal
+        self.appended = 0       # Records appended since startup
+        self.compactions = 0
+        self._users = []        # index -> user_id
+        self._user_index = {}   # user_id -> index
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Map the journal file (creating it if needed) and find its end."""
+        if self._map is not None:
+            return
+        size = HEADER.size + self.capacity * RECORD.size
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+                f.truncate(size)
+        self._file = open(self.path, "r+b")
+        magic, version, record_size = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{self.path} is not an MTM journal (version {VERSION})")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() < size:
+            self._file.truncate(size)
+        self.capacity = (max(self._file.tell(), size) - HEADER.size) // RECORD.size
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        if os.path.exists(self.users_path):
+            with open(self.users_path, "r") as f:
+                self._users = [line.rstrip("\n") for line in f]
+            self._user_index = {user_id: i for i, user_id in enumerate(self._users)}
+
+        # Records are contiguous from the start, so the end is the first unused slot
+        low, high = 0, self.capacity
+        while low < high:
+            middle = (low + high) // 2
+            if self._map[HEADER.size + middle * RECORD.size + 4] != 0:
+                low = middle + 1
+            else:
+                high = middle
+        self.count = low
+
+    def _grow(self):
+        """Double the file once it is full."""
+        self._map.flush()
+        self._map.close()
+        self.capacity *= 2
+        self._file.truncate(HEADER.size + self.capacity * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _index_of(self, user_id: str):
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = len(self._users)
+            # Written before any record refers to it
+            with open(self.users_path, "a") as f:
+                f.write(user_id + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._users.append(user_id)
+            self._user_index[user_id] = index
+        return index
+
+    def append(self, kind: int, user_id: str, mtm: float, epoch: float = None):
+        epoch = time.time() if epoch is None else epoch
+        with self._lock:
+            self._open()
+            if self.count == self.capacity:
+                self._grow()
+            RECORD.pack_into(self._map, HEADER.size + self.count * RECORD.size,
+                             self._index_of(user_id), kind, epoch, mtm)
+            self.count += 1
+            self.appended += 1
+
+    def records(self):
+        """Return [(kind, user_id, epoch, mtm)] for every record, oldest first."""
+        with self._lock:
+            self._open()
+            result = []
+            for i in range(self.count):
+                index, kind, epoch, mtm = RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+                if index < len(self._users):
+                    result.append((kind, self._users[index], epoch, mtm))
+            return result
+
+    def compact(self, cut: int):
+        """Drop the first cut records (already stored in SQLite) and flush the mapping."""
+        with self._lock:
+            self._open()
+            cut = min(cut, self.count)
+            remaining = self.count - cut
+            start = HEADER.size
+            if remaining:
+                self._map.move(start, start + cut * RECORD.size, remaining * RECORD.size)
+            # Zero the freed slots so the end of the journal can be found on startup
+            freed_from = start + remaining * RECORD.size
+            self._map[freed_from:start + self.count * RECORD.size] = bytes(cut * RECORD.size)
+            self.count = remaining
+            self._map.flush()
+            self.compactions += 1
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._file.close()
+                self._map = None
+                self._file = None
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "records": self.count,
+                "capacity": self.capacity,
+                "bytes": HEADER.size + self.capacity * RECORD.size,
+                "appended": self.appended,
+                "compactions": self.compactions,
+                "users": len(self._users)
+            }
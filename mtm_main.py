@@ -9,6 +9,9 @@ from mtm_html import DASHBOARD_HTML
 from mtm_background import *
 from mtm_persistence import load_state, save_state, start_auto_save, register_shutdown_handler
 from mtm_db import get_opening_mtm as get_opening_mtm_db, set_opening_mtm as set_opening_mtm_db, is_opening_mtm_captured as is_opening_mtm_captured_db
+from mtm_db import get_mtm_history_since, get_last_history_marker
+from mtm_history import read_history
+from mtm_db_async import async_db
 
 # Apply configuration
 mtm_cache["cache_ttl"] = config["cache_ttl"]
@@ -17,6 +20,13 @@ mtm_cache["cache_ttl"] = config["cache_ttl"]
 from mtm_api_part1 import *
 from mtm_api_part4 import *
 
+# Batch MTM endpoint - every user (or a subset) in one response
+@app.get("/MTM/all")
+async def get_mtm_all(UserID: str = ""):
+    """Return cached stats for all users, or for a comma-separated subset, in one payload"""
+    user_ids = [user_id.strip() for user_id in UserID.split(",") if user_id.strip()]
+    return JSONResponse(content=get_mtm_batch(user_ids))
+
 # Define the MTM endpoint (combination of part2 and part3)
 @app.get("/MTM")
 async def get_mtm(request: Request, UserID: str = ""):
@@ -34,18 +44,17 @@ async def get_mtm(request: Request, UserID: str = ""):
             content={"status": "error", "response": 0, "error": "UserID parameter is required"}
         )
     
+    # Several users requested at once (/MTM?UserID=a,b,c) - serve them as one batch
+    if "," in UserID:
+        user_ids = [user_id.strip() for user_id in UserID.split(",") if user_id.strip()]
+        return JSONResponse(content=get_mtm_batch(user_ids))
+    
     try:
         current_time = time.time()
         
-        # Get user IP from users.json
-        users_data = get_user_data()
-        user_ip = None
-        
-        # Find the specific user in the users data
-        for user in users_data["users"]:
-            if user["userId"] == UserID:
-                user_ip = user.get("ip")
-                break
+        # Get user IP from the in-memory user registry (no file I/O, dict lookup)
+        users = user_registry.current()
+        user_ip = users.get_ip(UserID)
         
         if not user_ip:
             logger.error(f"No IP found for user {UserID}")
@@ -54,30 +63,15 @@ async def get_mtm(request: Request, UserID: str = ""):
                 content={"status": "error", "response": 0, "error": f"User {UserID} not found or no IP configured"}
             )
         
-        # Get current time to check against opening hour and start time
-        now = datetime.now()
-        current_time_str = now.strftime("%H:%M")
-        
-        # Extract time parts for comparison
-        current_hour, current_minute = now.hour, now.minute
-        current_time_val = current_hour * 100 + current_minute
+        # Session phase is compiled once per users.json version; between
+        # boundaries this is a single timestamp compare
+        phase = trading_session.phase()
         
-        # Get the opening hour and start time from users.json
-        opening_hour = users_data.get("opening_mtm", "09:15")
-        start_time = users_data.get("start_time", "09:16")
-        
-        # Parse opening hour and start time
-        opening_hour_parts = opening_hour.split(":")
-        start_time_parts = start_time.split(":")
-        
-        opening_hour_val = int(opening_hour_parts[0]) * 100 + int(opening_hour_parts[1])
-        start_time_val = int(start_time_parts[0]) * 100 + int(start_time_parts[1])
-        
-        logger.info(f"Time check for {UserID}: Current={current_time_str} ({current_time_val}), Opening={opening_hour} ({opening_hour_val}), Start={start_time} ({start_time_val})")
+        logger.info(f"Session phase for {UserID}: {phase}")
         
         # BEFORE opening hour - don't fetch at all, just return zeros
-        if current_time_val < opening_hour_val:
-            logger.info(f"Before opening hour for {UserID} - {current_time_val} < {opening_hour_val} - not fetching, returning zeros")
+        if phase == PRE_OPEN:
+            logger.info(f"Before opening hour for {UserID} - not fetching, returning zeros")
             
             # Get opening hour value (should be 0 before opening hour)
             opening_hour_mtm = get_opening_mtm_db(UserID)
@@ -94,15 +88,17 @@ async def get_mtm(request: Request, UserID: str = ""):
             )
         
         # AT opening hour, fetch MTM and store it
-        elif current_time_val == opening_hour_val and not is_opening_mtm_captured_db(UserID):
-            logger.info(f"Exactly at opening hour for {UserID} - {current_time_val} == {opening_hour_val} - fetching for opening hour")
+        elif phase == OPENING and not is_opening_mtm_captured_db(UserID):
+            logger.info(f"Exactly at opening hour for {UserID} - fetching for opening hour")
             
             # Fetch from client machine
             full_url = f"http://{user_ip}/MTM"
             logger.info(f"Fetching opening hour MTM from {full_url} for user {UserID}")
-            response = requests.get(
-                full_url,
-                headers=headers,
+            # Concurrent requests at the opening minute share one fetch, so
+            # only the leader stores the opening value
+            response, coalesced = await upstream_client.get_shared(
+                user_ip,
+                "/MTM",
                 params={"UserID": UserID},
                 timeout=5
             )
@@ -117,8 +113,9 @@ async def get_mtm(request: Request, UserID: str = ""):
             mtm_value = float(data["response"])
             
             # Store the opening hour MTM value in the database
-            set_opening_mtm_db(UserID, mtm_value)
-            logger.info(f"Stored opening hour MTM for {UserID} in DB: {mtm_value}")
+            if not coalesced:
+                set_opening_mtm_db(UserID, mtm_value)
+                logger.info(f"Stored opening hour MTM for {UserID} in DB: {mtm_value}")
             
             # Get opening hour value for this user
             opening_hour_mtm = get_opening_mtm_db(UserID)
@@ -127,7 +124,8 @@ async def get_mtm(request: Request, UserID: str = ""):
             relative_mtm = mtm_value - opening_hour_mtm
             
             # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            if not coalesced:
+                update_user_stats(UserID, relative_mtm)
             
             # Return response with stats
             response_data = {
@@ -141,9 +139,10 @@ async def get_mtm(request: Request, UserID: str = ""):
             
             return JSONResponse(content=response_data)
         
-        # At opening hour but ALREADY hit - return opening hour MTM but zeros for current/max/min
-        elif current_time_val == opening_hour_val and is_opening_mtm_captured_db(UserID):
-            logger.info(f"Still at opening hour for {UserID} but already hit - returning zeros with stored opening hour")
+        # At opening hour but ALREADY hit, or between opening hour and start time -
+        # return opening hour MTM but zeros for current/max/min
+        elif phase == OPENING or phase == WARMUP:
+            logger.info(f"{phase} for {UserID} - returning zeros with stored opening hour")
             
             # Get opening hour value
             opening_hour_mtm = get_opening_mtm_db(UserID)
@@ -159,27 +158,9 @@ async def get_mtm(request: Request, UserID: str = ""):
                 }
             )
         
-        # BETWEEN opening hour and start time
-        elif current_time_val > opening_hour_val and current_time_val < start_time_val:
-            logger.info(f"Between opening and start for {UserID} - {opening_hour_val} < {current_time_val} < {start_time_val} - returning zeros with stored opening hour")
-            
-            # Get opening hour value
-            opening_hour_mtm = get_opening_mtm_db(UserID)
-            
-            return JSONResponse(
-                content={
-                    "status": "success",
-                    "response": 0,  # Current MTM as 0 (no change from opening)
-                    "max_mtm": 0,   # Max MTM as 0
-                    "min_mtm": 0,   # Min MTM as 0
-                    "opening_mtm": opening_hour_mtm,
-                    "cached": False
-                }
-            )
-        
-        # After start time or if at opening hour but already hit, use normal cache logic
-        # Use cache if available and not expired
-        if UserID in mtm_cache["data"] and UserID in mtm_cache["last_updated"] and time.time() - mtm_cache["last_updated"][UserID] < mtm_cache["cache_ttl"]:
+        # LIVE (or CLOSED) - use cache if available and not expired; after
+        # close the last value is served as-is, without polling
+        if UserID in mtm_cache["data"] and UserID in mtm_cache["last_updated"] and (phase == CLOSED or time.time() - mtm_cache["last_updated"][UserID] < mtm_cache["cache_ttl"]):
             logger.info(f"Using cached data for {UserID}")
             
             # Get opening hour value for this user
@@ -201,12 +182,13 @@ async def get_mtm(request: Request, UserID: str = ""):
         full_url = f"http://{user_ip}/MTM"
         logger.info(f"Fetching regular MTM from {full_url} for user {UserID}")
         
-        # Forward the request to the client machine
-        response = requests.get(
-            full_url,
-            headers=headers,
+        # Forward the request to the client machine; concurrent misses for
+        # this user wait on the same in-flight request
+        response, coalesced = await upstream_client.get_shared(
+            user_ip,
+            "/MTM",
             params={"UserID": UserID},
-            timeout=5  # Add timeout
+            timeout=5
         )
         
         response.raise_for_status()  # Raise exception for bad status codes
@@ -225,18 +207,17 @@ async def get_mtm(request: Request, UserID: str = ""):
             # Extract MTM value
             mtm_value = float(data["response"])
             
-            # Update cache
-            mtm_cache["data"][UserID] = response.text
-            mtm_cache["last_updated"][UserID] = time.time()
-            
             # Get opening hour value for this user
             opening_hour_mtm = get_opening_mtm_db(UserID)
             
             # Calculate relative MTM (current value minus opening hour value)
             relative_mtm = mtm_value - opening_hour_mtm
             
-            # Update user stats with the relative MTM value
-            update_user_stats(UserID, relative_mtm)
+            # Update cache and stats (a coalesced request's leader already did)
+            if not coalesced:
+                mtm_cache["data"][UserID] = response.text
+                mtm_cache["last_updated"][UserID] = time.time()
+                update_user_stats(UserID, relative_mtm)
             
             # Return response with stats
             response_data = {
@@ -254,7 +235,7 @@ async def get_mtm(request: Request, UserID: str = ""):
             # If not JSON, return the raw text
             return response.text
             
-    except requests.RequestException as e:
+    except (requests.RequestException, httpx.HTTPError) as e:
         error_msg = f"Failed to fetch MTM data: {str(e)}"
         logger.error(error_msg, exc_info=True)
         return JSONResponse(
@@ -269,6 +250,27 @@ async def get_mtm(request: Request, UserID: str = ""):
             content={"status": "error", "response": 0, "error": error_msg}
         )
 
+def _read_history(UserID: str, max_points: int, since: str):
+    """Build the /history payload (runs on the database thread pool)."""
+    # Cursors handed out before a daily reset are stale
+    check_daily_reset()
+    generation = get_app_state("last_reset_date", default=datetime.now().strftime("%Y-%m-%d"))
+    return read_history(UserID, max_points, since, generation, get_mtm_history_since, get_last_history_marker)
+
+# Endpoint to get today's MTM history for a user
+@app.get("/history")
+async def get_history(UserID: str = "", max_points: int = 0, since: str = ""):
+    """Return today's MTM history for a user from the database.
+
+    max_points downsamples the series; since=<cursor> (from an earlier
+    response) returns only the points added after it. reset is true when the
+    cursor is from before a daily reset and the full history is sent instead.
+    """
+    if not UserID:
+        return JSONResponse(status_code=400, content={"status": "error", "error": "UserID parameter is required"})
+    
+    return JSONResponse(content=await async_db.run(_read_history, UserID, max_points, since))
+
 # Endpoint to get configuration values
 @app.get("/config")
 async def get_config():
@@ -280,6 +282,16 @@ async def get_config():
         "server_port": config["server_port"]
     })
 
+# Server-push stream replacing per-user dashboard polling
+@app.get("/stream")
+async def stream_mtm(request: Request):
+    """Server-sent events with one consolidated MTM snapshot per cache update"""
+    return StreamingResponse(
+        mtm_stream.events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting MarvelQuant Central Hub (Optimized Version)...")
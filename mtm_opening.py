@@ -0,0 +1,144 @@
+# mtm_opening.py
+# Opening-MTM snapshot: every user captured concurrently at the opening boundary
+
+from mtm_imports import *
+from mtm_config import config
+from mtm_http import upstream_client
+from mtm_scheduler import _percentile
+
+class OpeningSnapshot:
+    """Captures the opening MTM of all users in one tight window.
+
+    prewarm() runs prewarm_lead seconds before the opening minute and opens
+    as many keep-alive connections to each client machine as the capture
+    will use, so the capture does not pay for TCP connects. capture() fires
+    every user's fetch at once at the boundary, retries the failures with
+    backoff until the end of the opening minute, and records each user's
+    capture skew: how long after the boundary their value arrived.
+    """
+
+    def __init__(self, client, prewarm_lead: float = 5.0, retry_delay: float = 0.5,
+                 max_retry_delay: float = 5.0, margin: float = 1.0):
+        # Connections idle longer than the client's 30s keep-alive would be closed again
+        self.prewarm_lead = max(1.0, min(prewarm_lead, 25.0))
+        self.client = client
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.margin = margin                # Retries stop this many seconds before the minute ends
+        self.last_prewarm = None
+        self.last_capture = None
+
+    async def prewarm(self, users: list, timeout: float = None):
+        """Open keep-alive connections to every client machine of users; returns hosts reached.
+
+        Each host gets min(its users, max_per_host) concurrent /MTM requests,
+        which the capture's fan-out then reuses. The values are discarded;
+        timeout bounds each request so the boundary is not missed.
+        """
+        groups = {}
+        for user in users:
+            if user.get("userId") and user.get("ip"):
+                groups.setdefault(user["ip"], []).append(user["userId"])
+        started = time.time()
+
+        async def warm(host, user_ids):
+            results = await asyncio.gather(
+                *(self.client.fetch_mtm(user_id, host, timeout=timeout) for user_id in user_ids[:self.client.max_per_host]),
+                return_exceptions=True
+            )
+            connections = sum(1 for result in results if not isinstance(result, Exception))
+            if connections < len(results):
+                logger.warning(f"Pre-warm of client machine {host}: {len(results) - connections} of {len(results)} requests failed")
+            return connections
+
+        connections = await asyncio.gather(*(warm(host, user_ids) for host, user_ids in groups.items()))
+        self.last_prewarm = {
+            "at": datetime.fromtimestamp(started).strftime("%H:%M:%S"),
+            "duration_ms": round((time.time() - started) * 1000, 1),
+            "hosts": len(groups),
+            "hosts_reached": sum(1 for count in connections if count),
+            "connections": sum(connections)
+        }
+        logger.info(f"Pre-warmed {self.last_prewarm['connections']} connections to "
+                    f"{self.last_prewarm['hosts_reached']}/{len(groups)} client machines")
+        return self.last_prewarm["hosts_reached"]
+
+    async def capture(self, users: list, boundary: float, until: float, store):
+        """Fetch every user's MTM concurrently and store(user_id, data) each one.
+
+        boundary is the start of the opening minute, until its end. Users
+        whose fetch or store fails are retried with doubling delays while
+        there is time left. Returns the report also kept in last_capture.
+        """
+        end = until - self.margin
+        pending = [user for user in users if user.get("userId") and user.get("ip")]
+        attempts = {user["userId"]: 0 for user in pending}
+        skew = {}
+        errors = {}
+        rounds = 0
+
+        async def capture_one(user):
+            user_id = user["userId"]
+            attempts[user_id] += 1
+            try:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("Opening minute ended")
+                data, _ = await asyncio.wait_for(self.client.fetch_mtm(user_id, user["ip"]), remaining)
+                arrived = time.time()
+                store(user_id, data)
+            except Exception as e:
+                errors[user_id] = f"{type(e).__name__}: {str(e)}"
+                return False
+            skew[user_id] = arrived - boundary
+            errors.pop(user_id, None)
+            return True
+
+        delay = self.retry_delay
+        while pending:
+            rounds += 1
+            results = await asyncio.gather(*(capture_one(user) for user in pending))
+            pending = [user for user, captured in zip(pending, results) if not captured]
+            if not pending or time.time() + delay >= end:
+                break
+            logger.warning(f"Opening MTM: retrying {len(pending)} users in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+        skews_ms = [round(value * 1000, 1) for value in skew.values()]
+        self.last_capture = {
+            "boundary": datetime.fromtimestamp(boundary).strftime("%Y-%m-%d %H:%M:%S"),
+            "users": len(attempts),
+            "captured": len(skew),
+            "failed": sorted(user["userId"] for user in pending),
+            "rounds": rounds,
+            "skew_ms": {
+                "min": min(skews_ms, default=0),
+                "p50": _percentile(skews_ms, 50),
+                "max": max(skews_ms, default=0),
+                "spread": round(max(skews_ms) - min(skews_ms), 1) if skews_ms else 0
+            },
+            "per_user": {
+                user_id: {"skew_ms": round(skew[user_id] * 1000, 1), "attempts": count} if user_id in skew
+                else {"attempts": count, "error": errors.get(user_id)}
+                for user_id, count in attempts.items()
+            }
+        }
+        logger.info(f"Opening MTM captured for {len(skew)}/{len(attempts)} users in {rounds} rounds, "
+                    f"skew {self.last_capture['skew_ms']['min']}-{self.last_capture['skew_ms']['max']} ms")
+        if pending:
+            logger.error(f"Opening MTM not captured for: {', '.join(self.last_capture['failed'])}")
+        return self.last_capture
+
+    def get_stats(self):
+        return {
+            "prewarm_lead": self.prewarm_lead,
+            "last_prewarm": self.last_prewarm,
+            "last_capture": self.last_capture
+        }
+
+# Global opening snapshot, sharing the upstream client's connections
+opening_snapshot = OpeningSnapshot(
+    upstream_client,
+    prewarm_lead=config.get("opening_prewarm_lead", 5.0)
+)
@@ -7,9 +7,12 @@ import sys
 import time
 import threading
 from mtm_imports import *
-from mtm_db_stabilized import init_db, cleanup_old_history
-from mtm_cache_stabilized import cleanup_cache
-from mtm_background_stabilized import cleanup_background
+from mtm_db_stabilized import init_db, cleanup_old_history, run_maintenance
+from mtm_session import trading_session, PRE_OPEN, CLOSED
+from mtm_cache_stabilized import cleanup_cache, load_from_db, replay_journal, start_batch_processor, sync_hub_state
+from mtm_background_stabilized import cleanup_background, start_background_scheduler_in, stop_background_scheduler
+from mtm_workers import hub_worker
+from mtm_config import config
 
 class ApplicationManager:
     """Manages application lifecycle with proper cleanup"""
@@ -139,6 +142,35 @@ def start_auto_save():
     cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
     cleanup_thread.start()
     logger.info("Periodic cleanup worker started")
+    
+    start_maintenance_scheduler()
+
+def start_maintenance_scheduler(min_quiet_seconds=600):
+    """Run database maintenance once a day outside market hours.
+
+    Maintenance runs in the PRE_OPEN or CLOSED session phase, and only when
+    at least min_quiet_seconds remain before the next phase boundary, so it
+    never overlaps the opening capture or live polling.
+    """
+    def maintenance_worker():
+        last_run_day = None
+        while True:
+            try:
+                today = datetime.now().date()
+                if (last_run_day != today
+                        and trading_session.phase() in (PRE_OPEN, CLOSED)
+                        and trading_session.seconds_until_next_transition() >= min_quiet_seconds):
+                    run_maintenance()
+                    last_run_day = today
+                # Re-check at the next phase boundary, or every 5 minutes
+                time.sleep(min(max(trading_session.seconds_until_next_transition(), 1.0), 300.0))
+            except Exception as e:
+                logger.error(f"Error in database maintenance: {str(e)}", exc_info=True)
+                time.sleep(300)
+    
+    maintenance_thread = threading.Thread(target=maintenance_worker, daemon=True)
+    maintenance_thread.start()
+    logger.info("Database maintenance scheduler started")
 
 def register_shutdown_handler():
     """Register an exit handler to properly clean up resources."""
@@ -158,12 +190,64 @@ def register_shutdown_handler():
             process_batch_updates()
         except Exception as e:
             logger.error(f"Error processing final batch updates: {str(e)}")
+
+        # Store the bars still open so they survive the restart
+        try:
+            from mtm_cache_stabilized import bar_engine
+            bar_engine.flush(include_open=True)
+        except Exception as e:
+            logger.error(f"Error storing open MTM bars: {str(e)}")
+
+        # Commit any database writes still waiting in the write-behind queue,
+        # then empty the journal they cover
+        try:
+            from mtm_cache_stabilized import compact_journal, tick_journal
+            compact_journal()
+            tick_journal.close()
+        except Exception as e:
+            logger.error(f"Error compacting the tick journal: {str(e)}")
+        try:
+            from mtm_db_stabilized import write_queue
+            write_queue.close()
+        except Exception as e:
+            logger.error(f"Error flushing database write queue: {str(e)}")
         
         logger.info("Application shutdown cleanup completed.")
     
     atexit.register(on_exit)
     logger.info("Registered optimized shutdown handler.")
 
+def start_hub_worker():
+    """Startup handler of each worker of a multi-worker hub.
+
+    Every worker serves requests; the one holding the poller lease (now, or
+    later after the poller exits) also loads and journals the state, writes
+    the database, runs maintenance and the background scheduler in its own
+    event loop. The sync thread then shares state between the workers.
+    """
+    # A spawned worker may import the app twice (as __mp_main__ and by name)
+    if hub_worker.started:
+        return
+    loop = asyncio.get_running_loop()
+    
+    def become_poller():
+        load_state()
+        load_from_db()
+        replay_journal()
+        start_batch_processor()
+        register_shutdown_handler()
+        start_auto_save()
+        if config["enable_background_scheduler"]:
+            start_background_scheduler_in(loop)
+    
+    hub_worker.on_promote(become_poller)
+    hub_worker.start(sync_hub_state)
+
+def stop_hub_worker():
+    """Shutdown handler of each worker; the lease is released when the process exits."""
+    hub_worker.stop()
+    stop_background_scheduler()
+
 def add_custom_shutdown_handler(handler):
     """Add a custom shutdown handler"""
     app_manager.add_shutdown_handler(handler)
@@ -0,0 +1,78 @@
+# mtm_scheduler.py
+# Wall-clock alignment and per-tick metrics for the background poller
+
+import math
+from collections import deque
+from mtm_imports import *
+
+def next_boundary(now: float, interval: float):
+    """First multiple of interval seconds (since the epoch, so :00/:30 for 30) after now."""
+    return (math.floor(now / interval) + 1) * interval
+
+async def sleep_until(at: float, stop: asyncio.Event, max_step: float = 5.0):
+    """Sleep until wall-clock time `at`, at most max_step seconds; return False if stopped.
+
+    Returns early (True, before `at`) after max_step so the caller can
+    re-plan when the schedule changes. The final wait is on the wall clock,
+    so a tick is never fired before its boundary.
+    """
+    remaining = at - time.time()
+    if remaining > 0:
+        try:
+            await asyncio.wait_for(stop.wait(), min(remaining, max_step))
+        except asyncio.TimeoutError:
+            pass
+    return not stop.is_set()
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class TickStats:
+    """Lateness and completion time of the last ticks of a scheduler.
+
+    lateness is how long after its boundary a tick started; duration is from
+    the start until every user's fetch finished or the deadline passed.
+    """
+
+    def __init__(self, keep: int = 500):
+        self.ticks = 0
+        self.deadline_misses = 0    # Ticks where some fetch was cut off by the deadline
+        self.skipped = 0            # Boundaries passed while the previous tick was still running
+        self._recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, scheduled: float, started: float, finished: float,
+               users: int, errors: int, timed_out: int):
+        tick = {
+            "kind": kind,
+            "scheduled": datetime.fromtimestamp(scheduled).strftime("%H:%M:%S"),
+            "lateness_ms": round((started - scheduled) * 1000, 1),
+            "duration_ms": round((finished - started) * 1000, 1),
+            "users": users,
+            "errors": errors,
+            "timed_out": timed_out
+        }
+        with self._lock:
+            self.ticks += 1
+            if timed_out:
+                self.deadline_misses += 1
+            self._recent.append(tick)
+        return tick
+
+    def get_stats(self):
+        with self._lock:
+            recent = list(self._recent)
+            stats = {"ticks": self.ticks, "deadline_misses": self.deadline_misses, "skipped": self.skipped}
+        lateness = [tick["lateness_ms"] for tick in recent]
+        duration = [tick["duration_ms"] for tick in recent]
+        stats.update({
+            "lateness_ms": {"p50": _percentile(lateness, 50), "p99": _percentile(lateness, 99),
+                            "max": max(lateness, default=0)},
+            "duration_ms": {"p50": _percentile(duration, 50), "p99": _percentile(duration, 99),
+                            "max": max(duration, default=0)},
+            "last_tick": recent[-1] if recent else None
+        })
+        return stats
@@ -28,24 +28,20 @@ if os.path.exists("MQ-Logo-Main.svg"):
 # Mount the static directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Standard headers for requests
-headers = {
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-    'Accept-Language': 'en-US,en;q=0.9',
-    'Cache-Control': 'max-age=0',
-    'Connection': 'keep-alive',
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-}
+# Shared upstream client and standard headers for requests
+from mtm_http import headers, upstream_client
+from mtm_users import user_registry
+from mtm_session import trading_session, PRE_OPEN, OPENING, WARMUP, LIVE, CLOSED
+
+@app.on_event("shutdown")
+async def close_upstream_client():
+    """Close keep-alive connections to the client machines"""
+    await upstream_client.aclose()
 
 # Function to get user data from users.json
 def get_user_data():
-    try:
-        with open("users.json", "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load users.json: {str(e)}", exc_info=True)
-        # Return empty user data instead of defaults
-        return {"users": []}
+    """Return the parsed users.json, reloaded only when the file changes."""
+    return user_registry.current().data
 
 # Create default users.json if it doesn't exist
 if not os.path.exists("users.json"):
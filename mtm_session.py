@@ -0,0 +1,114 @@
+# mtm_session.py
+# Trading-session phases compiled from the users.json schedule
+
+from mtm_imports import *
+from mtm_users import user_registry
+
+# Session phases, in the order they occur during a day
+PRE_OPEN = "PRE_OPEN"   # Before opening_mtm: nothing is fetched
+OPENING = "OPENING"     # The opening_mtm minute: the opening MTM is captured
+WARMUP = "WARMUP"       # After the opening minute, before start_time
+LIVE = "LIVE"           # From start_time: MTM is polled and tracked
+CLOSED = "CLOSED"       # After close_time (only if users.json sets one)
+
+def _at(day, hhmm: int):
+    """Epoch timestamp of an HHMM time on the given date (local time)."""
+    return datetime.combine(day, dt_time(hhmm // 100, hhmm % 100)).timestamp()
+
+class TradingSession:
+    """Current session phase, recompiled only at phase boundaries.
+
+    The schedule is parsed once per users.json version into a list of
+    (timestamp, phase) transitions for the day. phase() compares the clock
+    against the next precomputed boundary and only does more work when one
+    has been crossed, so request handlers and pollers can call it freely.
+    Listeners registered with on_transition() are called as
+    callback(old_phase, new_phase) when a boundary is crossed.
+    """
+
+    def __init__(self, registry=user_registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._version = None
+        self._day = None
+        self._transitions = []  # [(timestamp, phase)] for today, ascending
+        self._phase = None
+        self._phase_since = None
+        self._next_at = 0.0     # Timestamp of the next boundary (or next recompile)
+
+    def on_transition(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def _compile(self, users, now: float):
+        """Build today's transition list from the current users.json version."""
+        today = datetime.fromtimestamp(now).date()
+        opening_at = _at(today, users.opening_hour_val)
+        warmup_at = opening_at + 60
+        live_at = max(_at(today, users.start_time_val), warmup_at)
+        transitions = [(0.0, PRE_OPEN), (opening_at, OPENING), (warmup_at, WARMUP), (live_at, LIVE)]
+        if users.close_time_val is not None:
+            transitions.append((max(_at(today, users.close_time_val), live_at), CLOSED))
+        self._transitions = transitions
+        self._version = users.version
+        self._day = today
+
+    def _advance(self, now: float):
+        users = self.registry.current()
+        with self._lock:
+            if users.version != self._version or datetime.fromtimestamp(now).date() != self._day:
+                self._compile(users, now)
+
+            # Latest transition at or before now; the next one is the new boundary
+            phase, since = PRE_OPEN, 0.0
+            next_at = datetime.combine(self._day, dt_time()).timestamp() + 86400  # Recompile at midnight
+            for at, transition_phase in self._transitions:
+                if at <= now:
+                    phase, since = transition_phase, at
+                else:
+                    next_at = at
+                    break
+
+            old_phase = self._phase
+            self._phase, self._phase_since, self._next_at = phase, since, next_at
+
+        if old_phase != phase:
+            logger.info(f"Trading session phase: {old_phase} -> {phase}")
+            for callback in self._listeners:
+                try:
+                    callback(old_phase, phase)
+                except Exception as e:
+                    logger.error(f"Session transition listener failed: {str(e)}", exc_info=True)
+
+    def phase(self, now: float = None):
+        """Return the current phase."""
+        now = time.time() if now is None else now
+        if now >= self._next_at or self.registry.current().version != self._version:
+            self._advance(now)
+        return self._phase
+
+    def phase_started_at(self, now: float = None):
+        """Timestamp of the boundary that started the current phase."""
+        self.phase(now)
+        return self._phase_since
+
+    def seconds_until_next_transition(self, now: float = None):
+        """Seconds until the next phase boundary (for schedulers to sleep on)."""
+        now = time.time() if now is None else now
+        self.phase(now)
+        return max(0.0, self._next_at - now)
+
+    def get_status(self):
+        users = self.registry.current()
+        return {
+            "phase": self.phase(),
+            "since": datetime.fromtimestamp(self._phase_since).strftime("%H:%M:%S") if self._phase_since else None,
+            "next_transition": datetime.fromtimestamp(self._next_at).strftime("%Y-%m-%d %H:%M:%S"),
+            "opening_mtm": users.opening_hour,
+            "start_time": users.start_time,
+            "close_time": users.close_time
+        }
+
+# Global trading session
+trading_session = TradingSession()
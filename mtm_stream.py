@@ -0,0 +1,76 @@
+# mtm_stream.py
+# Server-push of consolidated MTM snapshots to dashboards
+
+from mtm_imports import *
+
+class SnapshotStream:
+    """Fan-out of cache updates to /stream subscribers.
+
+    Writers (request handlers, background poller threads) call notify(); every
+    subscriber is an asyncio.Event on its own loop that is set thread-safely.
+    The snapshot is built at most once per cache version and shared by all
+    viewers, so hub load no longer grows with viewers x users.
+    """
+
+    def __init__(self, build_snapshot, source_version=None, coalesce=0.25, keepalive=15.0):
+        self.build_snapshot = build_snapshot
+        self.source_version = source_version  # e.g. the user registry version, so edits to users.json rebuild the snapshot
+        self.coalesce = coalesce    # Wait this long after a change so one poll cycle lands as one push
+        self.keepalive = keepalive  # Send an SSE comment when idle to keep proxies from closing the stream
+        self.version = 0
+        self._lock = threading.Lock()
+        self._subscribers = {}      # asyncio.Event -> owning event loop
+        self._snapshot = None
+        self._snapshot_version = None
+
+    def notify(self):
+        """Mark the cache as changed and wake every subscriber."""
+        with self._lock:
+            self.version += 1
+            subscribers = list(self._subscribers.items())
+        for event, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed, the subscriber is going away
+                pass
+
+    def subscribe(self):
+        event = asyncio.Event()
+        with self._lock:
+            self._subscribers[event] = asyncio.get_running_loop()
+        return event
+
+    def unsubscribe(self, event):
+        with self._lock:
+            self._subscribers.pop(event, None)
+
+    def snapshot(self):
+        """Return the snapshot for the current version, building it if stale."""
+        version = (self.version, self.source_version() if self.source_version else None)
+        if self._snapshot_version != version:
+            self._snapshot = self.build_snapshot()
+            self._snapshot_version = version
+        return self._snapshot
+
+    async def events(self, request):
+        """Yield server-sent events: one snapshot on connect, then one per change."""
+        changed = self.subscribe()
+        changed.set()
+        try:
+            while not await request.is_disconnected():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                changed.clear()
+                await asyncio.sleep(self.coalesce)
+                changed.clear()
+                yield f"data: {json.dumps(self.snapshot())}\n\n"
+        finally:
+            self.unsubscribe(changed)
+
+    def get_stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "version": self.version}
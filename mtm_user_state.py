@@ -0,0 +1,129 @@
+# mtm_user_state.py
+# Per-user live MTM state with one lock per user
+
+from mtm_imports import *
+
+class UserState:
+    """Live MTM state of one user.
+
+    Every field is read and written under the user's own lock, so updates
+    for different users never wait on each other, and snapshot() returns
+    values that belong together (max/min always include current).
+    """
+
+    __slots__ = ("user_id", "current_mtm", "max_mtm", "min_mtm", "opening_mtm",
+                 "last_updated", "raw", "time_key", "dirty", "lock")
+
+    def __init__(self, user_id: str, stats: dict = None, opening_mtm: float = 0):
+        self.user_id = user_id
+        self.current_mtm = stats["current_mtm"] if stats else 0
+        self.max_mtm = stats["max_mtm"] if stats else -float('inf')
+        self.min_mtm = stats["min_mtm"] if stats else float('inf')
+        self.opening_mtm = float(opening_mtm or 0)
+        self.last_updated = None    # Epoch of the last raw client response
+        self.raw = None             # Last raw client response
+        self.time_key = None        # Last 30-second history marker stored
+        self.dirty = stats is None  # Stats not yet queued for the database
+        self.lock = threading.Lock()
+
+    def update(self, mtm_value: float):
+        """Apply a new MTM value; caller holds lock."""
+        self.current_mtm = mtm_value
+        if mtm_value > self.max_mtm:
+            self.max_mtm = mtm_value
+        if mtm_value < self.min_mtm:
+            self.min_mtm = mtm_value
+        self.dirty = True
+
+    def stats(self):
+        """The {"current_mtm", "max_mtm", "min_mtm"} dict stored in user_stats; caller holds lock."""
+        return {"current_mtm": self.current_mtm, "max_mtm": self.max_mtm, "min_mtm": self.min_mtm}
+
+    def snapshot(self):
+        """Consistent copy of every field."""
+        with self.lock:
+            return {
+                "current_mtm": self.current_mtm,
+                "max_mtm": self.max_mtm,
+                "min_mtm": self.min_mtm,
+                "opening_mtm": self.opening_mtm,
+                "last_updated": self.last_updated,
+                "raw": self.raw
+            }
+
+    def reset(self):
+        """Start a new trading day (the raw response is kept); caller holds lock."""
+        self.current_mtm = 0
+        self.max_mtm = -float('inf')
+        self.min_mtm = float('inf')
+        self.opening_mtm = 0.0
+        self.time_key = None
+        self.dirty = False
+
+class UserStateStore:
+    """Registry of UserState objects, one per user.
+
+    Lookups are plain dict reads and a new user is added with
+    dict.setdefault, so there is no registry-wide lock: two threads creating
+    the same user both get the one object that won. loader(user_id) returns
+    (stats or None, opening MTM) for a user not yet in memory and is called
+    without any lock held, since it may read the database.
+    """
+
+    def __init__(self, loader=None, cache_ttl: float = 5.0, batch_interval: float = 10):
+        self.loader = loader
+        self.cache_ttl = cache_ttl              # Seconds a raw client response stays fresh
+        self.batch_interval = batch_interval    # Seconds between batched user_stats writes
+        self.last_batch_time = 0
+        self.created = 0
+        self._states = {}
+
+    def get(self, user_id: str):
+        """The user's state, or None."""
+        return self._states.get(user_id)
+
+    def get_or_create(self, user_id: str, stats: dict = None):
+        """The user's state, loading it first if needed; stats skips the loader."""
+        state = self._states.get(user_id)
+        if state is None:
+            opening_mtm = 0
+            if stats is None and self.loader is not None:
+                stats, opening_mtm = self.loader(user_id)
+            new_state = UserState(user_id, stats, opening_mtm)
+            state = self._states.setdefault(user_id, new_state)
+            if state is new_state:
+                self.created += 1
+        return state
+
+    def all(self):
+        """Every state, as a list safe to iterate while users are added."""
+        return list(self._states.values())
+
+    def collect_dirty(self):
+        """Return {user_id: stats} for users changed since the last call and mark them clean."""
+        changed = {}
+        for state in self.all():
+            with state.lock:
+                if state.dirty:
+                    changed[state.user_id] = state.stats()
+                    state.dirty = False
+        return changed
+
+    def pending(self):
+        """Users whose stats have not been queued for the database yet."""
+        return sum(1 for state in self.all() if state.dirty)
+
+    def __contains__(self, user_id):
+        return user_id in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    def get_stats(self):
+        return {
+            "users": len(self._states),
+            "created": self.created,
+            "dirty": self.pending(),
+            "cache_ttl": self.cache_ttl,
+            "batch_interval": self.batch_interval
+        }
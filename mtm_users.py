@@ -0,0 +1,102 @@
+# mtm_users.py
+# In-memory user registry backed by users.json
+
+from mtm_imports import *
+
+USERS_FILE = "users.json"
+
+def parse_hhmm(value: str, default: str):
+    """Parse an "HH:MM" setting into the HHMM integer used for time comparisons."""
+    try:
+        hours, minutes = (value or default).split(":")[:2]
+        return int(hours) * 100 + int(minutes)
+    except (AttributeError, ValueError):
+        logger.warning(f"Invalid time '{value}' in {USERS_FILE}, using {default}")
+        hours, minutes = default.split(":")
+        return int(hours) * 100 + int(minutes)
+
+class UserDirectory:
+    """One immutable, fully parsed version of users.json."""
+
+    def __init__(self, data: dict, version: int):
+        self.data = data
+        self.version = version
+        self.users = [user for user in data.get("users", []) if user.get("userId")]
+        self.index = {user["userId"]: user for user in self.users}
+
+        # Session times parsed once per version instead of once per request
+        self.opening_hour = data.get("opening_mtm", "09:15")
+        self.start_time = data.get("start_time", "09:16")
+        self.chart_start_time = data.get("chart_start_time", "09:15")
+        self.opening_hour_val = parse_hhmm(self.opening_hour, "09:15")
+        self.start_time_val = parse_hhmm(self.start_time, "09:16")
+        # Optional: stop polling client machines after this time
+        self.close_time = data.get("close_time")
+        self.close_time_val = parse_hhmm(self.close_time, "23:59") if self.close_time else None
+
+    def get_user(self, user_id: str):
+        return self.index.get(user_id)
+
+    def get_ip(self, user_id: str):
+        user = self.index.get(user_id)
+        return user.get("ip") if user else None
+
+class UserRegistry:
+    """Loads users.json once and reloads it only when the file's mtime changes.
+
+    The mtime is checked at most once every check_interval seconds, so request
+    handlers and the background poller do no file I/O on the hot path. A reload
+    builds a new UserDirectory and swaps it in with a single assignment, so
+    readers always see one consistent version.
+    """
+
+    def __init__(self, path=USERS_FILE, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._directory = UserDirectory({"users": []}, 0)
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._directory.version
+
+    def current(self):
+        """Return the current UserDirectory, reloading first if the file changed."""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self._check_for_changes()
+        return self._directory
+
+    def reload(self):
+        """Force a reload on the next access (e.g. after writing users.json)."""
+        self._last_check = 0.0
+        self._mtime = None
+
+    def _check_for_changes(self):
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load {self.path}: {str(e)}", exc_info=True)
+                # Keep serving the last good version; retry when the file changes again
+                self._mtime = mtime
+                return
+
+            self._mtime = mtime
+            self._directory = UserDirectory(data, self._directory.version + 1)
+            logger.info(f"Loaded {len(self._directory.users)} users from {self.path} (version {self._directory.version})")
+
+# Global user registry
+user_registry = UserRegistry()
@@ -0,0 +1,179 @@
+# mtm_workers.py
+# Multi-worker hub: electing the one worker that polls through an OS file lock
+
+from mtm_imports import *
+from mtm_config import config
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+LEASE_FILE = "mtm_poller.lock"
+
+SINGLE = "single"   # The only worker: polls and serves, as a one-process hub always has
+POLLER = "poller"   # Holds the lease: polls, journals and writes the database
+READER = "reader"   # Serves requests from the state the poller shares
+
+class PollerLease:
+    """Exclusive, non-blocking OS lock on a file, held by the polling worker.
+
+    The lock belongs to the open file, so the OS releases it when the
+    holder exits, however it exits (including a crash or kill -9), and the
+    next try_acquire() by another worker succeeds. The holder's pid is
+    written into the file for diagnostics.
+    """
+
+    def __init__(self, path=LEASE_FILE):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        """Take the lock if no other process holds it; returns whether it is held."""
+        if self._file is not None:
+            return True
+        f = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def owner(self):
+        """Pid written by the current holder, or None."""
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+class HubWorker:
+    """Role of this process in the hub.
+
+    With one worker the role is SINGLE and nothing changes. With more,
+    every worker starts as a READER and tries the lease at startup and then
+    every sync_interval seconds; the one that gets it is promoted to POLLER
+    (on_promote callbacks start the scheduler, journal and database
+    writers) and keeps it until the process exits, after which another
+    worker takes over within one interval. Every interval the worker's
+    sync() exchanges state with the others.
+    """
+
+    def __init__(self, workers: int = 1, sync_interval: float = 0.5, lease: PollerLease = None):
+        self.workers = max(1, workers)
+        self.sync_interval = sync_interval
+        self.lease = lease or PollerLease()
+        self.role = READER if self.multi else SINGLE
+        self.promoted_at = None
+        self.syncs = 0
+        self.sync_errors = 0
+        self.last_sync_ms = 0.0
+        self._on_promote = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def multi(self):
+        return self.workers > 1
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    @property
+    def is_poller(self):
+        """True for the one worker that may call the client machines and write state."""
+        return self.role != READER
+
+    def on_promote(self, callback):
+        """Call callback() (from the sync thread, or start()) when this worker becomes the poller."""
+        self._on_promote.append(callback)
+
+    def elect(self):
+        """Try to take the lease; promote this worker if it just did."""
+        if self.role != READER or not self.lease.try_acquire():
+            return False
+        self.role = POLLER
+        self.promoted_at = time.time()
+        logger.info(f"Worker {os.getpid()} holds the poller lease and takes over polling")
+        for callback in self._on_promote:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error starting the poller: {str(e)}", exc_info=True)
+        return True
+
+    def _sync_once(self, sync):
+        started = time.perf_counter()
+        try:
+            self.elect()
+            sync()
+            self.syncs += 1
+        except Exception as e:
+            self.sync_errors += 1
+            logger.error(f"Error syncing worker state: {str(e)}", exc_info=True)
+        self.last_sync_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def start(self, sync):
+        """Elect and sync once now, then keep doing both every sync_interval in a thread."""
+        if self.started:
+            return
+        self._sync_once(sync)
+
+        def run():
+            while not self._stop.wait(self.sync_interval):
+                self._sync_once(sync)
+
+        self._thread = threading.Thread(target=run, name="hub-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"Worker {os.getpid()} started as {self.role} of {self.workers}")
+
+    def stop(self):
+        """Stop syncing; the lease is kept until the process exits."""
+        self._stop.set()
+
+    def get_stats(self):
+        return {
+            "role": self.role,
+            "pid": os.getpid(),
+            "workers": self.workers,
+            "poller_pid": os.getpid() if self.lease.held else self.lease.owner(),
+            "promoted_at": datetime.fromtimestamp(self.promoted_at).strftime("%H:%M:%S") if self.promoted_at else None,
+            "sync_interval": self.sync_interval,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "last_sync_ms": self.last_sync_ms
+        }
+
+# Role of this process; every worker of a multi-worker hub reads the same config
+hub_worker = HubWorker(
+    workers=config.get("hub_workers", 1),
+    sync_interval=config.get("hub_sync_interval", 0.5)
+)